@@ -0,0 +1,151 @@
+"""
+Keep only the operations touching a watched set of accounts.
+
+The watchlist can hold millions of accounts, so instead of a set of addresses it keeps the accounts' 32 bytes
+public keys: a bloom filter rejects most of the accounts that are not watched, and the rest are looked up in
+a sorted array of the keys. The watchlist file is loaded again whenever it is modified.
+"""
+
+import binascii
+import bisect
+import logging
+import os
+import struct
+
+PUBLIC_KEY_SIZE = 32
+# Addresses are a version byte, the public key and a checksum, encoded in base32
+ACCOUNT_VERSION_BYTE = 6 << 3
+CHECKSUM_SIZE = 2
+ADDRESS_SIZE = PUBLIC_KEY_SIZE + CHECKSUM_SIZE + 1
+ADDRESS_LENGTH = ADDRESS_SIZE * 8 // 5
+BASE32_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ234567'
+# int() reads base 32 digits as 0-9 and A-V, decoding addresses through it is much faster than base64.b32decode
+BASE32_TO_DIGITS = str.maketrans(BASE32_ALPHABET, '0123456789ABCDEFGHIJKLMNOPQRSTUV')
+BASE32_CHARACTERS = frozenset(BASE32_ALPHABET)
+
+# Bits of the bloom filter per account, and the number of bits set for an account.
+# About 1% of the accounts that are not watched pass the bloom filter and are looked up in the sorted keys.
+BLOOM_BITS_PER_ACCOUNT = 10
+BLOOM_HASHES = 7
+# Public keys are uniformly random, so the positions of an account in the bloom filter are read from its key
+BLOOM_HASHES_STRUCT = struct.Struct('<{}I'.format(BLOOM_HASHES))
+
+
+def decode_address(address):
+    """
+    Decode an account address to its public key, validating it.
+
+    Same as kin_base's decode_check, which is too slow for millions of addresses,
+    its CRC16-XModem checksum is implemented in C by binascii.
+    """
+    if len(address) != ADDRESS_LENGTH or not BASE32_CHARACTERS.issuperset(address):
+        raise ValueError('Invalid account address: {}'.format(address))
+
+    decoded = _unpack_address(address)
+    if decoded[0] != ACCOUNT_VERSION_BYTE or \
+            binascii.crc_hqx(decoded[:-CHECKSUM_SIZE], 0) != int.from_bytes(decoded[-CHECKSUM_SIZE:], 'little'):
+        raise ValueError('Invalid account address: {}'.format(address))
+
+    return decoded[1:-CHECKSUM_SIZE]
+
+
+def _unpack_address(address):
+    """Decode the base32 of an address without validating it."""
+    return int(address.translate(BASE32_TO_DIGITS), 32).to_bytes(ADDRESS_SIZE, 'big')
+
+
+class SortedKeys:
+    """Public keys in a single bytes object, sorted, looked up with bisect."""
+
+    def __init__(self, keys):
+        """
+        :param keys: An iterable of unique public keys
+        """
+        self.keys = b''.join(sorted(keys))
+
+    def __len__(self):
+        return len(self.keys) // PUBLIC_KEY_SIZE
+
+    def __getitem__(self, index):
+        return self.keys[index * PUBLIC_KEY_SIZE:(index + 1) * PUBLIC_KEY_SIZE]
+
+    def __contains__(self, key):
+        index = bisect.bisect_left(self, key)
+        return index < len(self) and self[index] == key
+
+
+class AccountWatchlist:
+    """A set of accounts loaded from a file, with an address on every line."""
+
+    def __init__(self, file_name):
+        """
+        :param file_name: Path of the watchlist file, it is first loaded by reload_if_changed
+        """
+        self.file_name = file_name
+        self.modified_time = None
+        self.bloom_filter = bytearray(1)
+        self.bloom_size = 8
+        self.keys = SortedKeys([])
+
+    def reload_if_changed(self):
+        """
+        Load the watchlist file if it was modified since it was last loaded.
+        When the file can not be loaded, the accounts loaded before are kept.
+        """
+        try:
+            modified_time = os.stat(self.file_name).st_mtime
+            if modified_time == self.modified_time:
+                return
+
+            with open(self.file_name) as watchlist_file:
+                keys = {decode_address(line.strip()) for line in watchlist_file if line.strip()}
+        except Exception as e:
+            if self.modified_time is None:
+                raise
+            logging.error('Could not reload the account watchlist {}, keeping the previous one: {}'.format(
+                self.file_name, e))
+            return
+
+        self.__load(keys)
+        self.modified_time = modified_time
+        logging.info('Loaded {} accounts from the watchlist {}'.format(len(keys), self.file_name))
+
+    def __contains__(self, address):
+        """Tell if an address is watched."""
+        # Addresses of the operations were encoded by the decoder, they are valid
+        key = _unpack_address(address)[1:PUBLIC_KEY_SIZE + 1]
+        return self.__might_contain(key) and key in self.keys
+
+    def is_watched(self, row):
+        """Tell if the row of an operation has a watched source or destination."""
+        destination = getattr(row, 'destination', None)
+        return row.source in self or (destination is not None and destination in self)
+
+    def filter_chunks(self, operations_chunks):
+        """
+        Keep the rows of watched accounts.
+
+        :param operations_chunks: An iterable of chunks of an app id, a table name and the rows of the table
+        :return: A generator of the chunks, with only the rows of watched accounts in them
+        """
+        for app_id, table_name, rows in operations_chunks:
+            rows = [row for row in rows if self.is_watched(row)]
+            if rows:
+                yield app_id, table_name, rows
+
+    def __load(self, keys):
+        bloom_size = max(8, len(keys) * BLOOM_BITS_PER_ACCOUNT)
+        bloom_filter = bytearray((bloom_size + 7) // 8)
+        for key in keys:
+            for position in self.__get_bloom_positions(key, bloom_size):
+                bloom_filter[position >> 3] |= 1 << (position & 7)
+        self.bloom_filter, self.bloom_size, self.keys = bloom_filter, bloom_size, SortedKeys(keys)
+
+    def __might_contain(self, key):
+        bloom_filter = self.bloom_filter
+        return all(bloom_filter[position >> 3] & (1 << (position & 7))
+                   for position in self.__get_bloom_positions(key, self.bloom_size))
+
+    @staticmethod
+    def __get_bloom_positions(key, bloom_size):
+        return (value % bloom_size for value in BLOOM_HASHES_STRUCT.unpack_from(key))
@@ -1,3 +1 @@
-from adapters.hc_storage_adapter import HistoryCollectorStorageAdapter
-from adapters.postgres_storage_adapter import PostgresStorageAdapter
-from adapters.s3_storage_adapter import S3StorageAdapter
\ No newline at end of file
+# Adapters are imported by their module, so a process imports only the dependencies of the storage it uses
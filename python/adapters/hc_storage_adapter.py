@@ -1,7 +1,16 @@
+import functools
 import logging
+import time
 from abc import ABC, abstractmethod
 from datetime import datetime
 
+# Tables every storage has, the operations of other types are saved to tables named after their handlers
+PAYMENTS_TABLE = 'payments'
+CREATIONS_TABLE = 'creations'
+
+# Storages that do not support claiming files can only be written by a single collector
+SHARED_STORAGE_UNSUPPORTED = 'Sharing the storage between collectors is not supported by {}'
+
 
 class HistoryCollectorStorageError(Exception):
 
@@ -9,15 +18,38 @@ class HistoryCollectorStorageError(Exception):
         super(HistoryCollectorStorageError, self).__init__(message)
 
 
+@functools.lru_cache(maxsize=128)
+def utc_from_timestamp(timestamp):
+    """Convert a ledger close time to utc time, cached as all the operations of a ledger share it."""
+    return datetime.utcfromtimestamp(timestamp)
+
+
 class HistoryCollectorStorageAdapter(ABC):
+    # Operations are converted to named tuples of the output schema columns, defined by every adapter
+    payment_row = None
+    creation_row = None
+
     def __init__(self):
         super().__init__()
         self.file_name = None
+        self.advance_last_file = True
+        # The app the operations being saved are routed to, None for the default destination
+        self.app_id = None
+        # Seconds the last commit of a file took
+        self.last_commit_time = None
 
     @abstractmethod
     def get_last_file_sequence(self):
         pass
 
+    @abstractmethod
+    def update_last_file_sequence(self, file_name):
+        pass
+
+    @abstractmethod
+    def is_file_saved(self, file_name):
+        pass
+
     @abstractmethod
     def _save_payments(self, payments):
         pass
@@ -26,6 +58,11 @@ class HistoryCollectorStorageAdapter(ABC):
     def _save_creations(self, creations):
         pass
 
+    @abstractmethod
+    def _save_rows(self, table_name, rows):
+        """Save the rows of a table of an operation handler, other than the payments and creations tables."""
+        pass
+
     @abstractmethod
     def _commit(self):
         pass
@@ -34,26 +71,99 @@ class HistoryCollectorStorageAdapter(ABC):
     def _rollback(self):
         pass
 
+    @classmethod
     @abstractmethod
-    def convert_payment(self, source, destination, amount, memo, tx_fee, tx_charged_fee, op_index, tx_status, op_status,
+    def convert_payment(cls, source, destination, amount, memo, tx_fee, tx_charged_fee, op_index, tx_status, op_status,
                         tx_hash, timestamp):
         pass
 
+    @classmethod
     @abstractmethod
-    def convert_creation(self, source, destination, balance, memo, tx_fee, tx_charged_fee, op_index, tx_status,
+    def convert_creation(cls, source, destination, balance, memo, tx_fee, tx_charged_fee, op_index, tx_status,
                          op_status, tx_hash, timestamp):
         pass
 
-    def save(self, payments_operations_list: list, creations_operations_list: list, file_name: str):
+    def _flush(self):
+        """Called after every chunk of operations was saved, before the next one."""
+        pass
+
+    def claim_file(self, file_name, owner, lease_time):
+        """
+        Claim a file for a while, so that collectors sharing the storage save different files.
+
+        :param owner: Identifier of the collector claiming the file
+        :param lease_time: Seconds until the claim expires, unless it is renewed
+        :return: True if the file was claimed, False if another collector's claim on it has not expired
+        """
+        raise HistoryCollectorStorageError(SHARED_STORAGE_UNSUPPORTED.format(type(self).__name__))
+
+    def renew_file_claims(self, file_names, owner, lease_time):
+        """
+        Renew the claims of the owner on files for another lease time.
+
+        :return: A set of the names of the files still claimed by the owner
+        """
+        raise HistoryCollectorStorageError(SHARED_STORAGE_UNSUPPORTED.format(type(self).__name__))
+
+    def release_file_claim(self, file_name, owner):
+        """Release the claim of the owner on a file, so that any collector can claim it."""
+        raise HistoryCollectorStorageError(SHARED_STORAGE_UNSUPPORTED.format(type(self).__name__))
+
+    def has_file_claims(self):
+        """Check if any collector has a claim that has not expired."""
+        raise HistoryCollectorStorageError(SHARED_STORAGE_UNSUPPORTED.format(type(self).__name__))
+
+    def advance_last_file_sequence(self, first_file, next_file_function):
+        """
+        Advance the last file over the files saved out of order right after it, by any collector.
+
+        :param first_file: The first file to save, the next file while it is also the last file
+        :param next_file_function: Get the name of the file after a file
+        :return: The last file
+        """
+        raise HistoryCollectorStorageError(SHARED_STORAGE_UNSUPPORTED.format(type(self).__name__))
+
+    def save(self, payments_operations_list: list, creations_operations_list: list, file_name: str,
+             advance_last_file=True):
+        """
+        Save the operations of a file as a single 'transaction'.
+
+        :param advance_last_file: Update the last file to this file. When False, the file is only marked as saved,
+          used when files are saved out of order and the last file is advanced separately.
+        """
+        self.save_chunks([(None, PAYMENTS_TABLE, payments_operations_list),
+                          (None, CREATIONS_TABLE, creations_operations_list)], file_name, advance_last_file)
+
+    def save_chunks(self, operations_chunks, file_name: str, advance_last_file=True):
+        """
+        Save the operations of a file as a single 'transaction', one chunk of operations at a time.
+
+        :param operations_chunks: An iterable of an app id, a table name and a list of rows of the table.
+          Operations of the None app id are saved to the default destination.
+        :param advance_last_file: Update the last file to this file. When False, the file is only marked as saved,
+          used when files are saved out of order and the last file is advanced separately.
+        """
         try:
             self.file_name = file_name
-            self._save_payments(payments_operations_list)
-            self._save_creations(creations_operations_list)
+            self.advance_last_file = advance_last_file
+            for app_id, table_name, rows in operations_chunks:
+                self.app_id = app_id
+                if table_name == PAYMENTS_TABLE:
+                    self._save_payments(rows)
+                elif table_name == CREATIONS_TABLE:
+                    self._save_creations(rows)
+                else:
+                    self._save_rows(table_name, rows)
+                self._flush()
+            self.app_id = None
+            commit_start = time.monotonic()
             self._commit()
+            self.last_commit_time = time.monotonic() - commit_start
             logging.info('Successfully stored the data of file: {} to storage'.format(file_name))
 
         except Exception:
             logging.warning('Exception occurred while trying to save file: {}'.format(file_name))
+            self.app_id = None
             self._rollback()
             logging.info('Rollback finished successfully')
             raise
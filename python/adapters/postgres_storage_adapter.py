@@ -1,8 +1,38 @@
+import collections
+import io
 import psycopg2
 import logging
 from datetime import datetime
-from adapters.hc_storage_adapter import HistoryCollectorStorageAdapter
-from psycopg2.extras import execute_values
+from adapters.hc_storage_adapter import HistoryCollectorStorageAdapter, HistoryCollectorStorageError, \
+    PAYMENTS_TABLE, CREATIONS_TABLE, utc_from_timestamp
+from psycopg2 import sql
+
+# Postgres types of the columns of the operation handlers' tables
+POSTGRES_TYPES = {str: 'text', int: 'BIGINT', float: 'FLOAT', datetime: 'TIMESTAMP'}
+
+# Characters escaped in the text format of COPY, where columns are separated by tabs and rows by newlines
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+COPY_NULL = '\\N'
+
+
+def format_copy_value(value):
+    """Format a value of a row in the text format of COPY."""
+    if value is None:
+        return COPY_NULL
+    if isinstance(value, str):
+        return value.translate(COPY_ESCAPES)
+    # Numbers keep every digit and timestamps are formatted as postgres reads them
+    return str(value)
+
+
+def format_copy_rows(rows):
+    """
+    Format rows in the text format of COPY.
+
+    :param rows: A list of tuples of values, in the order of the columns
+    :return: A text file object of the rows, positioned at its start
+    """
+    return io.StringIO(''.join('\t'.join(map(format_copy_value, row)) + '\n' for row in rows))
 
 
 class PostgresStorageAdapter(HistoryCollectorStorageAdapter):
@@ -14,6 +44,17 @@ class PostgresStorageAdapter(HistoryCollectorStorageAdapter):
         self.conn = psycopg2.connect("postgresql://python:{password}@{host}:5432/{database}".format(
             password=python_password, host=postgres_host, database=database))
         self.cursor = self.conn.cursor()
+
+        # Databases created before backfilling was supported have no 'completedfiles' table
+        self.cursor.execute("SELECT to_regclass('completedfiles')")
+        self.has_completed_files = self.cursor.fetchone()[0] is not None
+        # Nor a 'fileclaims' table, before collectors could share the database
+        self.cursor.execute("SELECT to_regclass('fileclaims')")
+        self.has_file_claims_table = self.cursor.fetchone()[0] is not None
+        self.conn.commit()
+
+        # Copy queries by table name, every app has its own tables
+        self.copy_queries = {}
         logging.info('Successfully connected to the database')
 
     def get_last_file_sequence(self):
@@ -25,67 +66,142 @@ class PostgresStorageAdapter(HistoryCollectorStorageAdapter):
 
         return last_file
 
+    def update_last_file_sequence(self, file_name):
+        """Update the last file, files saved out of order up to it are no longer needed to be marked."""
+        self.cursor.execute('UPDATE lastfile SET name = %s', (file_name,))
+        if self.has_completed_files:
+            self.cursor.execute('DELETE FROM completedfiles WHERE name <= %s', (file_name,))
+        self.conn.commit()
+
+    def is_file_saved(self, file_name):
+        """Check if a file was saved out of order, ahead of the last file."""
+        if not self.has_completed_files:
+            return False
+
+        self.cursor.execute('SELECT 1 FROM completedfiles WHERE name = %s', (file_name,))
+        is_saved = self.cursor.fetchone() is not None
+        self.conn.commit()
+
+        return is_saved
+
+    def claim_file(self, file_name, owner, lease_time):
+        """Claim a file, unless another collector's claim on it has not expired. Expiry uses the database's clock."""
+        self.__verify_file_claims_table()
+        self.cursor.execute('INSERT INTO fileclaims VALUES (%s, %s, now() + %s * interval \'1 second\') '
+                            'ON CONFLICT (name) DO UPDATE SET owner = EXCLUDED.owner, expires = EXCLUDED.expires '
+                            'WHERE fileclaims.expires < now() OR fileclaims.owner = EXCLUDED.owner '
+                            'RETURNING name', (file_name, owner, lease_time))
+        is_claimed = self.cursor.fetchone() is not None
+        self.conn.commit()
+
+        return is_claimed
+
+    def renew_file_claims(self, file_names, owner, lease_time):
+        self.__verify_file_claims_table()
+        self.cursor.execute('UPDATE fileclaims SET expires = now() + %s * interval \'1 second\' '
+                            'WHERE name = ANY(%s) AND owner = %s RETURNING name', (lease_time, list(file_names), owner))
+        renewed = {row[0] for row in self.cursor.fetchall()}
+        self.conn.commit()
+
+        return renewed
+
+    def release_file_claim(self, file_name, owner):
+        self.__verify_file_claims_table()
+        self.cursor.execute('DELETE FROM fileclaims WHERE name = %s AND owner = %s', (file_name, owner))
+        self.conn.commit()
+
+    def has_file_claims(self):
+        self.__verify_file_claims_table()
+        self.cursor.execute('SELECT 1 FROM fileclaims WHERE expires > now() LIMIT 1')
+        has_claims = self.cursor.fetchone() is not None
+        self.conn.commit()
+
+        return has_claims
+
+    def advance_last_file_sequence(self, first_file, next_file_function):
+        """Advance the last file, the 'lastfile' row is locked so collectors advance it one at a time."""
+        if not self.has_completed_files:
+            raise HistoryCollectorStorageError('Saving files out of order requires the completedfiles table, '
+                                               'see build_database.py')
+        self.cursor.execute('SELECT name FROM lastfile FOR UPDATE')
+        last_file = self.cursor.fetchone()[0]
+        self.cursor.execute('SELECT name FROM completedfiles WHERE name >= %s', (last_file,))
+        completed_files = {row[0] for row in self.cursor.fetchall()}
+
+        next_file = first_file if last_file == first_file else next_file_function(last_file)
+        while next_file in completed_files:
+            last_file = next_file
+            next_file = next_file_function(last_file)
+
+        self.cursor.execute('UPDATE lastfile SET name = %s', (last_file,))
+        # The last file itself stays marked, it is the next file too while it is the first file
+        self.cursor.execute('DELETE FROM completedfiles WHERE name < %s', (last_file,))
+        self.conn.commit()
+
+        return last_file
+
     def _save_payments(self, payments: list):
         if payments:
-            payments_columns = self.payments_output_schema().keys()
-            execute_values(self.cursor,
-                           'INSERT INTO payments ({columns}) VALUES %s'.format(columns=', '.join(payments_columns)),
-                           payments,
-                           template='({mapping})'.format(
-                               mapping=', '.join(['%({})s'.format(column) for column in payments_columns])
-                           ))
+            # Rows are tuples in the order of the columns
+            self.__copy_rows(PAYMENTS_TABLE, self.payment_row, payments)
 
     def _save_creations(self, creations: list):
         if creations:
-            creations_columns = self.creations_output_schema().keys()
-            execute_values(self.cursor,
-                           'INSERT INTO creations ({columns}) VALUES %s'.format(columns=', '.join(creations_columns)),
-                           creations,
-                           template='({mapping})'.format(
-                               mapping=', '.join(['%({})s'.format(column) for column in creations_columns])
-                           ))
+            self.__copy_rows(CREATIONS_TABLE, self.creation_row, creations)
+
+    def _save_rows(self, table_name, rows):
+        if rows:
+            self.__copy_rows(table_name, type(rows[0]), rows)
 
     def _commit(self):
-        # Update the 'lastfile' entry in the storage
-        self.cursor.execute("UPDATE lastfile SET name = %s", (self.file_name,))
+        if self.advance_last_file:
+            # Update the 'lastfile' entry in the storage
+            self.cursor.execute("UPDATE lastfile SET name = %s", (self.file_name,))
+        else:
+            if not self.has_completed_files:
+                raise HistoryCollectorStorageError('Saving files out of order requires the completedfiles table, '
+                                                   'see build_database.py')
+            # Mark the file as saved, the 'lastfile' entry will be advanced over it later
+            self.cursor.execute("INSERT INTO completedfiles VALUES (%s)", (self.file_name,))
         self.conn.commit()
 
     def _rollback(self):
         self.conn.rollback()
 
-    def convert_payment(self, source, destination, amount, memo, tx_fee, tx_charged_fee, op_index, tx_status, op_status,
+    @classmethod
+    def convert_payment(cls, source, destination, amount, memo, tx_fee, tx_charged_fee, op_index, tx_status, op_status,
                         tx_hash, timestamp):
-        payment = dict.fromkeys(self.payments_output_schema())
-        payment['source'] = source
-        payment['destination'] = destination
-        payment['amount'] = amount
-        payment['memo_text'] = memo
-        payment['fee'] = tx_fee
-        payment['fee_charged'] = tx_charged_fee
-        payment['operation_index'] = op_index
-        payment['tx_status'] = tx_status
-        payment['op_status'] = op_status
-        payment['hash'] = tx_hash
-        payment['time'] = datetime.utcfromtimestamp(timestamp)
-
-        return payment
-
-    def convert_creation(self, source, destination, balance, memo, tx_fee, tx_charged_fee, op_index, tx_status,
+        return cls.payment_row(source=source, destination=destination, amount=amount, memo_text=memo, fee=tx_fee,
+                               fee_charged=tx_charged_fee, operation_index=op_index, tx_status=tx_status,
+                               op_status=op_status, hash=tx_hash, time=utc_from_timestamp(timestamp))
+
+    @classmethod
+    def convert_creation(cls, source, destination, balance, memo, tx_fee, tx_charged_fee, op_index, tx_status,
                          op_status, tx_hash, timestamp):
-        creation = dict.fromkeys(self.creations_output_schema())
-        creation['source'] = source
-        creation['destination'] = destination
-        creation['starting_balance'] = balance
-        creation['memo_text'] = memo
-        creation['fee'] = tx_fee
-        creation['fee_charged'] = tx_charged_fee
-        creation['operation_index'] = op_index
-        creation['tx_status'] = tx_status
-        creation['op_status'] = op_status
-        creation['hash'] = tx_hash
-        creation['time'] = datetime.utcfromtimestamp(timestamp)
-
-        return creation
+        return cls.creation_row(source=source, destination=destination, starting_balance=balance, memo_text=memo,
+                                fee=tx_fee, fee_charged=tx_charged_fee, operation_index=op_index,
+                                tx_status=tx_status, op_status=op_status, hash=tx_hash,
+                                time=utc_from_timestamp(timestamp))
+
+    @staticmethod
+    def get_table_name(table_name, app_id=None):
+        """
+        :param table_name: Name of the default table, such as 'payments'
+        :param app_id: The app the table is for, the default table if None
+        :return: Name of the table the operations of the app are saved to
+        """
+        if app_id is None:
+            return table_name
+
+        return '{}_{}'.format(table_name, app_id)
+
+    @staticmethod
+    def get_postgres_schema(schema):
+        """
+        :param schema: A dictionary of columns of an operation handler's table. Key - name, Value - type
+        :return: The dictionary of the columns, Key - name, Value - string literal of postgres type
+        """
+        return {column: POSTGRES_TYPES[column_type] for column, column_type in schema.items()}
 
     @staticmethod
     def payments_output_schema():
@@ -128,3 +244,36 @@ class PostgresStorageAdapter(HistoryCollectorStorageAdapter):
             'hash': 'varchar(64) not NULL',
             'time': 'TIMESTAMP not NULL'
         }
+
+    def __verify_file_claims_table(self):
+        if not self.has_file_claims_table:
+            raise HistoryCollectorStorageError('Sharing the database between collectors requires the fileclaims '
+                                               'table, see build_database.py')
+
+    def __copy_rows(self, table_name, row, rows):
+        """
+        Copy rows to the table of the current app, in the transaction that updates the last file on commit.
+
+        Rows are streamed to the server in the text format of COPY, which it loads without parsing an insert query.
+        """
+        self.cursor.copy_expert(self.__get_copy_query(table_name, row), format_copy_rows(rows))
+
+    def __get_copy_query(self, table_name, row):
+        """Get the query copying rows to the table of the current app."""
+        table_name = self.get_table_name(table_name, self.app_id)
+        copy_query = self.copy_queries.get(table_name)
+        if copy_query is None:
+            # App ids may have characters that have to be quoted
+            copy_query = sql.SQL('COPY {table} ({columns}) FROM STDIN').format(
+                table=sql.Identifier(table_name),
+                columns=sql.SQL(', ').join(sql.Identifier(column) for column in row._fields)).as_string(self.conn)
+            self.copy_queries[table_name] = copy_query
+
+        return copy_query
+
+
+# Rows are defined at module level, so they can be pickled when operations are extracted by worker processes
+PostgresPayment = collections.namedtuple('PostgresPayment', PostgresStorageAdapter.payments_output_schema())
+PostgresCreation = collections.namedtuple('PostgresCreation', PostgresStorageAdapter.creations_output_schema())
+PostgresStorageAdapter.payment_row = PostgresPayment
+PostgresStorageAdapter.creation_row = PostgresCreation
@@ -1,16 +1,23 @@
+import collections
 import boto3
 import logging
 import time
 import io
 import pandas
-from datetime import datetime
-from adapters.hc_storage_adapter import HistoryCollectorStorageAdapter, HistoryCollectorStorageError
+from botocore.exceptions import ClientError
+from adapters.hc_storage_adapter import HistoryCollectorStorageAdapter, HistoryCollectorStorageError, \
+    utc_from_timestamp
 
 LAST_FILE_NAME = 'last_file'
 HC_ROOT_FOLDER = 'kin_history_collector/'
 COMPLETED_LEDGERS_DIR_NAME = 'completed_ledgers'
+APPS_DIR_NAME = 'apps'
+# Payments and creations are saved together, the operations of other types to directories named after their table
+LEDGERS_DIR_NAME = 'ledgers'
 DEFAULT_REGION = 'us-east-1'
 MAX_RETRIES = 3
+# Parts of a multipart upload, apart from the last one, must be at least 5MB
+MULTIPART_MIN_PART_SIZE = 5 * 1024 * 1024
 
 
 class S3StorageAdapter(HistoryCollectorStorageAdapter):
@@ -25,7 +32,7 @@ class S3StorageAdapter(HistoryCollectorStorageAdapter):
         self.aws_region = region if region != '' else DEFAULT_REGION
         self.last_file_location = '{}{}'.format(self.full_key_prefix, LAST_FILE_NAME)
         self.completion_indication_path ='{}{}/'.format(self.full_key_prefix, COMPLETED_LEDGERS_DIR_NAME)
-        self.ledgers_prefix = '{}{}ledger='.format(self.full_key_prefix, 'ledgers/')
+        self.ledgers_prefix = '{}{}/ledger='.format(self.full_key_prefix, LEDGERS_DIR_NAME)
         self.s3_client = boto3.client('s3', aws_access_key_id=aws_access_key, aws_secret_access_key=aws_secret_key,
                                       region_name=region)
         self.__init_operations_to_save()
@@ -54,6 +61,22 @@ class S3StorageAdapter(HistoryCollectorStorageAdapter):
 
         return last_file_seq
 
+    def update_last_file_sequence(self, file_name):
+        """Update the last file object."""
+        self.s3_client.put_object(Body=file_name, Bucket=self.bucket, Key=self.last_file_location)
+
+    def is_file_saved(self, file_name):
+        """Check if a file was saved, using its completion indication object."""
+        try:
+            self.s3_client.head_object(Bucket=self.bucket,
+                                       Key='{}{}'.format(self.completion_indication_path, file_name))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                return False
+            raise
+
+        return True
+
     def _save_payments(self, payments: list):
         # Preparing
         self.operations_to_save += payments
@@ -61,9 +84,23 @@ class S3StorageAdapter(HistoryCollectorStorageAdapter):
     def _save_creations(self, creations: list):
         self.operations_to_save += creations
 
+    def _save_rows(self, table_name, rows):
+        if rows:
+            self.__write_csv(rows, table_name, type(rows[0])._fields)
+
+    def _flush(self):
+        """
+        Convert the chunk's operations to csv, and upload it as a part of the ledger's csv once there is enough of it
+        """
+        self.__write_operations_to_save()
+        for csv_id, csv_buffer in self.csv_buffers.items():
+            if csv_buffer.tell() >= MULTIPART_MIN_PART_SIZE:
+                self.__upload_part(csv_id)
+
     def _commit(self):
         """
-        Mark the ledger directory with a completed flag (using empty file) and also update the last file
+        Mark the ledger directory with a completed flag (using empty file) and also update the last file,
+        unless the ledger is saved out of order
         """
 
         # Saving all operations of ledger
@@ -72,7 +109,8 @@ class S3StorageAdapter(HistoryCollectorStorageAdapter):
         # Marking completion of ledger
         self.s3_client.put_object(Body='', Bucket=self.bucket,
                                   Key='{}{}'.format(self.completion_indication_path, self.file_name))
-        self.s3_client.put_object(Body=self.file_name, Bucket=self.bucket, Key=self.last_file_location)
+        if self.advance_last_file:
+            self.update_last_file_sequence(self.file_name)
 
         # Empty operations to save
         self.__init_operations_to_save()
@@ -83,22 +121,31 @@ class S3StorageAdapter(HistoryCollectorStorageAdapter):
         """
 
         try:
+            # Parts that were uploaded are not objects yet, they are removed by aborting the upload
+            for csv_id, multipart_upload in self.multipart_uploads.items():
+                self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.__get_csv_key(csv_id),
+                                                      UploadId=multipart_upload['UploadId'])
+
+            # The ledger's directory of every app and table it had operations of
+            ledgers_prefixes = {self.__get_ledgers_prefix(*csv_id) for csv_id in self.csv_buffers}
+            ledgers_prefixes.add(self.ledgers_prefix)
             self.__init_operations_to_save()
-            is_all_deleted = False
-            while not is_all_deleted:
-                # list_objects_v2 and delete_objects can handle up to 1000 objects at a time
-                res = self.s3_client.list_objects_v2(Bucket=self.bucket,
-                                                     Prefix='{}{}/'.format(self.ledgers_prefix, self.file_name))
-                if res['ResponseMetadata']['HTTPStatusCode'] != 200:
-                    raise RuntimeError(
-                        'Could not complete rollback for ledger {}. S3 list_objects response error.'.format(
-                            self.file_name))
-                if res.get('Contents'):
-                    s3_objects = [s3_object.get('Key') for s3_object in res.get('Contents')]
-                    self.__delete_objects(s3_objects)
-
-                # IsTruncated is True when there were more objects in the directory than list_objects_v2 could fetch
-                is_all_deleted = not res['IsTruncated']
+            for ledgers_prefix in ledgers_prefixes:
+                is_all_deleted = False
+                while not is_all_deleted:
+                    # list_objects_v2 and delete_objects can handle up to 1000 objects at a time
+                    res = self.s3_client.list_objects_v2(Bucket=self.bucket,
+                                                         Prefix='{}{}/'.format(ledgers_prefix, self.file_name))
+                    if res['ResponseMetadata']['HTTPStatusCode'] != 200:
+                        raise RuntimeError(
+                            'Could not complete rollback for ledger {}. S3 list_objects response error.'.format(
+                                self.file_name))
+                    if res.get('Contents'):
+                        s3_objects = [s3_object.get('Key') for s3_object in res.get('Contents')]
+                        self.__delete_objects(s3_objects)
+
+                    # IsTruncated is True when the directory had more objects than list_objects_v2 could fetch
+                    is_all_deleted = not res['IsTruncated']
 
             self.__delete_objects(['{}{}'.format(self.completion_indication_path, self.file_name)])
 
@@ -107,41 +154,23 @@ class S3StorageAdapter(HistoryCollectorStorageAdapter):
                 self.file_name))
             raise
 
-    def convert_payment(self, source, destination, amount, memo, tx_fee, tx_charged_fee, op_index, tx_status, op_status,
+    @classmethod
+    def convert_payment(cls, source, destination, amount, memo, tx_fee, tx_charged_fee, op_index, tx_status, op_status,
                         tx_hash, timestamp):
         # Converting timestamp from int to utc time
-        payment = dict.fromkeys(self.payments_output_schema())
-        payment['source'] = source
-        payment['destination'] = destination
-        payment['amount'] = amount
-        payment['memo'] = memo
-        payment['tx_fee'] = tx_fee
-        payment['tx_charged_fee'] = tx_charged_fee
-        payment['op_index'] = op_index
-        payment['tx_status'] = tx_status
-        payment['op_status'] = op_status
-        payment['tx_hash'] = tx_hash
-        payment['timestamp'] = datetime.utcfromtimestamp(timestamp)
-        payment['type'] = 'payment'
-        return payment
-
-    def convert_creation(self, source, destination, balance, memo, tx_fee, tx_charged_fee, op_index, tx_status,
+        return cls.payment_row(source=source, destination=destination, amount=amount, memo=memo, tx_fee=tx_fee,
+                               tx_charged_fee=tx_charged_fee, op_index=op_index, tx_status=tx_status,
+                               op_status=op_status, tx_hash=tx_hash, timestamp=utc_from_timestamp(timestamp),
+                               type='payment')
+
+    @classmethod
+    def convert_creation(cls, source, destination, balance, memo, tx_fee, tx_charged_fee, op_index, tx_status,
                          op_status, tx_hash, timestamp):
         # Converting timestamp from int to utc time
-        creation = dict.fromkeys(self.creations_output_schema())
-        creation['source'] = source
-        creation['destination'] = destination
-        creation['starting_balance'] = balance
-        creation['memo'] = memo
-        creation['tx_fee'] = tx_fee
-        creation['tx_charged_fee'] = tx_charged_fee
-        creation['op_index'] = op_index
-        creation['tx_status'] = tx_status
-        creation['op_status'] = op_status
-        creation['tx_hash'] = tx_hash
-        creation['timestamp'] = datetime.utcfromtimestamp(timestamp)
-        creation['type'] = 'creation'
-        return creation
+        return cls.creation_row(source=source, destination=destination, starting_balance=balance, memo=memo,
+                                tx_fee=tx_fee, tx_charged_fee=tx_charged_fee, op_index=op_index,
+                                tx_status=tx_status, op_status=op_status, tx_hash=tx_hash,
+                                timestamp=utc_from_timestamp(timestamp), type='creation')
 
     @staticmethod
     def payments_output_schema():
@@ -165,6 +194,9 @@ class S3StorageAdapter(HistoryCollectorStorageAdapter):
 
     def __init_operations_to_save(self):
         self.operations_to_save = []
+        # The ledger's csvs and their multipart uploads, by the app and the directory they are for
+        self.csv_buffers = {}
+        self.multipart_uploads = {}
 
     def __test_connection(self):
         """
@@ -177,12 +209,11 @@ class S3StorageAdapter(HistoryCollectorStorageAdapter):
             self.get_last_file_sequence()
             # Trying to write 'test' ledger, then delete it. Not using the 'save' method, as it will rewrite last_file
             self.file_name = 'test'
-            self._save_creations([{'source': 'GCQTAWULBNFLBAEQLEN6FDGGCPYTVZ3Y55AB4F7HSTMQKNX3HZINMQJM',
-                                   'destination': 'GDDFYG3OSTSHADS7SP6TZ4XM62EQ522CI7UYJSNAETGJJCGOX66TP5Q5',
-                                   'starting_balance': 10.0, 'memo': None, 'tx_fee': 100, 'tx_charged_fee': 100,
-                                   'op_index': 0, 'tx_status': 'txFAILED', 'op_status': 'CREATE_ACCOUNT_LOW_RESERVE',
-                                   'tx_hash': 'a17aa64d4f0ae434dceb16501dd1d2217a59e42d555e24fdf7e17fffa13a1331',
-                                   'timestamp': datetime(2018, 6, 20, 12, 47, 21)}])
+            self._save_creations([self.convert_creation(
+                'GCQTAWULBNFLBAEQLEN6FDGGCPYTVZ3Y55AB4F7HSTMQKNX3HZINMQJM',
+                'GDDFYG3OSTSHADS7SP6TZ4XM62EQ522CI7UYJSNAETGJJCGOX66TP5Q5', 10.0, None, 100, 100, 0, 'txFAILED',
+                'CREATE_ACCOUNT_LOW_RESERVE', 'a17aa64d4f0ae434dceb16501dd1d2217a59e42d555e24fdf7e17fffa13a1331',
+                1529498841)])
             self.__save_to_s3()
             self._rollback()
             self.file_name = None
@@ -193,32 +224,81 @@ class S3StorageAdapter(HistoryCollectorStorageAdapter):
 
     def __save_to_s3(self):
         """
-        Stores all the ledger's operations in the right partition and hierarchy on S3.
+        Stores all the ledger's operations in the right partition and hierarchy on S3, a csv for every app and table.
+        Large ledgers were already uploaded in parts while they were saved, in which case the upload is completed.
         If data is empty, we don't save empty file
         :return:
         """
 
-        # Skipping saving empty files.
-        if not self.operations_to_save:
-            return
+        # Operations saved after the last flush
+        self.__write_operations_to_save()
 
-        # Converting the data into a dataframe. The columns will be sorted alphabetically
-        # TODO: Use a different method to stream csv dataframe other than pandas and remove pandas from pipfile and
-        #  Dockerfile, as it really pumps the size of the docker image (from 150MB to 1GB)
-        pd_dataframe = pandas.DataFrame(self.operations_to_save)
+        for csv_id, csv_buffer in self.csv_buffers.items():
+            multipart_upload = self.multipart_uploads.get(csv_id)
+            if multipart_upload is None:
+                # Skipping saving empty files.
+                if csv_buffer.tell() == 0:
+                    continue
 
-        # Arranging columns order according the schema if there's data and converting it to csv with no header or index
-        try:
-            pd_dataframe = pd_dataframe[self.payments_output_schema().keys()]
-        except KeyError:
-            pass
+                # Uploading the stream to S3 to the right hierarchy and right partition
+                csv_buffer.seek(0)
+                self.s3_client.upload_fileobj(csv_buffer, self.bucket, self.__get_csv_key(csv_id))
+            else:
+                # The last part can be smaller than the minimal part size
+                if csv_buffer.tell() > 0:
+                    self.__upload_part(csv_id)
+                self.s3_client.complete_multipart_upload(Bucket=self.bucket, Key=self.__get_csv_key(csv_id),
+                                                         UploadId=multipart_upload['UploadId'],
+                                                         MultipartUpload={'Parts': multipart_upload['Parts']})
+                del self.multipart_uploads[csv_id]
+
+    def __write_operations_to_save(self):
+        """Append the payments and creations to save to the ledger's csv buffer."""
+        # Payments and creations rows have the same columns order, the amount and the starting balance share a column
+        self.__write_csv(self.operations_to_save, LEDGERS_DIR_NAME, self.payment_row._fields)
+        self.operations_to_save = []
 
-        bytes_stream_csv = io.BytesIO(pd_dataframe.to_csv(header=False, index=False).encode('utf-8'))
+    def __write_csv(self, rows, dir_name, columns):
+        """Append rows to the ledger's csv buffer of the current app in a directory."""
+        if not rows:
+            return
 
-        # Uploading the stream to S3 to the right hierarchy and right partition
-        self.s3_client.upload_fileobj(bytes_stream_csv, self.bucket,
-                                      '{prefix}{ledger}/{ledger}.csv'.format(
-                                          prefix=self.ledgers_prefix, ledger=self.file_name))
+        # Converting the data into a dataframe, with the columns of the schema.
+        # TODO: Use a different method to stream csv dataframe other than pandas and remove pandas from pipfile and
+        #  Dockerfile, as it really pumps the size of the docker image (from 150MB to 1GB)
+        pd_dataframe = pandas.DataFrame.from_records(rows, columns=columns)
+
+        # Converting it to csv with no header or index
+        csv_buffer = self.csv_buffers.setdefault((self.app_id, dir_name), io.BytesIO())
+        csv_buffer.write(pd_dataframe.to_csv(header=False, index=False).encode('utf-8'))
+
+    def __upload_part(self, csv_id):
+        """Upload a csv buffer as the next part of its csv, starting the upload on the first part."""
+        multipart_upload = self.multipart_uploads.get(csv_id)
+        if multipart_upload is None:
+            response = self.s3_client.create_multipart_upload(Bucket=self.bucket, Key=self.__get_csv_key(csv_id))
+            multipart_upload = self.multipart_uploads[csv_id] = {'UploadId': response['UploadId'], 'Parts': []}
+
+        part_number = len(multipart_upload['Parts']) + 1
+        response = self.s3_client.upload_part(Body=self.csv_buffers[csv_id].getvalue(), Bucket=self.bucket,
+                                              Key=self.__get_csv_key(csv_id), PartNumber=part_number,
+                                              UploadId=multipart_upload['UploadId'])
+        multipart_upload['Parts'].append({'ETag': response['ETag'], 'PartNumber': part_number})
+        self.csv_buffers[csv_id] = io.BytesIO()
+
+    def __get_ledgers_prefix(self, app_id, dir_name):
+        """Every app has its own directories of ledgers, apart from the default ones."""
+        if app_id is None:
+            return '{}{}/ledger='.format(self.full_key_prefix, dir_name)
+
+        return '{}{}/{}/{}/ledger='.format(self.full_key_prefix, APPS_DIR_NAME, app_id, dir_name)
+
+    def __get_csv_key(self, csv_id):
+        """
+        :param csv_id: The app and the directory of the csv
+        """
+        return '{prefix}{ledger}/{ledger}.csv'.format(prefix=self.__get_ledgers_prefix(*csv_id),
+                                                      ledger=self.file_name)
 
     def __delete_objects(self, list_of_objects):
         if list_of_objects:
@@ -249,3 +329,10 @@ class S3StorageAdapter(HistoryCollectorStorageAdapter):
                     logging.error('Error while trying to delete objects from storage: {}.\n Retry'.format(e))
                     time.sleep(10)
                     retry_count += 1
+
+
+# Rows are defined at module level, so they can be pickled when operations are extracted by worker processes
+S3Payment = collections.namedtuple('S3Payment', S3StorageAdapter.payments_output_schema())
+S3Creation = collections.namedtuple('S3Creation', S3StorageAdapter.creations_output_schema())
+S3StorageAdapter.payment_row = S3Payment
+S3StorageAdapter.creation_row = S3Creation
@@ -0,0 +1,85 @@
+"""
+Send alerts on a background thread, so the collector never waits for an alert to be delivered.
+
+Alerts are delivered at most once every interval. The alerts queued in between are delivered together,
+and an alert repeated while it was queued is delivered once, with the number of times it was repeated.
+"""
+
+import collections
+import logging
+import threading
+import time
+import traceback
+
+
+class AlertDispatcher:
+    """Queue alerts and deliver them from a thread of its own."""
+
+    def __init__(self, deliver_function, min_interval):
+        """
+        :param deliver_function: Called on the dispatcher's thread with the text of the alerts to deliver
+        :param min_interval: Minimal number of seconds between deliveries
+        """
+        self.deliver_function = deliver_function
+        self.min_interval = min_interval
+        self.condition = threading.Condition()
+        # Number of times every queued alert was repeated, by its text
+        self.queued = collections.OrderedDict()
+        self.next_delivery_time = 0
+        self.closed = False
+        self.thread = None
+
+    def send(self, message):
+        """Queue an alert, without waiting for it to be delivered."""
+        with self.condition:
+            if self.closed:
+                logging.warning('Alert dispatcher is closed, dropping alert: {}'.format(message))
+                return
+
+            # The thread is started by the first alert, so processes forked before it do not inherit it
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__run, name='alert-dispatcher', daemon=True)
+                self.thread.start()
+
+            self.queued[message] = self.queued.get(message, 0) + 1
+            self.condition.notify()
+
+    def close(self, timeout=None):
+        """
+        Deliver the queued alerts right away, and stop the dispatcher.
+
+        :param timeout: Maximal number of seconds to wait for the delivery, None waits until it completes
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def __run(self):
+        while True:
+            with self.condition:
+                while not self.queued and not self.closed:
+                    self.condition.wait()
+
+                # Alerts keep being queued until the next delivery, unless the dispatcher is closed
+                delay = self.next_delivery_time - time.monotonic()
+                while delay > 0 and not self.closed:
+                    self.condition.wait(delay)
+                    delay = self.next_delivery_time - time.monotonic()
+
+                if not self.queued:
+                    return
+                alerts = self.queued
+                self.queued = collections.OrderedDict()
+
+            try:
+                self.deliver_function('\n\n'.join(
+                    message if count == 1 else '{}\n(Repeated {} times)'.format(message, count)
+                    for message, count in alerts.items()))
+            except Exception:
+                logging.warning('Could not deliver alert')
+                logging.warning(traceback.format_exc())
+
+            self.next_delivery_time = time.monotonic() + self.min_interval
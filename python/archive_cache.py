@@ -0,0 +1,148 @@
+"""
+Keep the downloaded archive files on disk, so processing the same checkpoints again does not download them again.
+
+Every file is saved under the hash of its archive path, after a header of the hash of its contents. Files whose
+contents do not match their hash are dropped when they are read. When the cache grows over its size,
+the least recently used files are removed - reading a file updates its modification time.
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+# The header of every cached file, the hex sha256 of the contents after it
+CHECKSUM_SIZE = hashlib.sha256().digest_size * 2
+TEMPORARY_SUFFIX = '.tmp'
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class ArchiveCache:
+    """A size capped cache of archive files in a directory, safe to use from multiple threads and processes."""
+
+    def __init__(self, directory, max_size, spool_size):
+        """
+        :param directory: The directory of the cached files, created on the first saved file
+        :param max_size: Maximal size in bytes of the cached files
+        :param spool_size: Files read from the cache are kept in memory, unless they are larger than this
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.spool_size = spool_size
+        self.lock = threading.Lock()
+        # Size of the cached files, counted when the first file is saved.
+        # Other processes might save files too, so it is counted again before removing files.
+        self.size = None
+
+    def get(self, archive_path):
+        """
+        Read a cached file.
+
+        :return: A binary file object of the cached file positioned at its start, None if it is not cached
+        """
+        path = self.__get_path(archive_path)
+        try:
+            cached_file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+
+        file_object = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        with cached_file:
+            checksum = cached_file.read(CHECKSUM_SIZE).decode('ascii', errors='replace')
+            contents_hash = _copy_with_hash(cached_file, file_object)
+
+        if contents_hash.hexdigest() != checksum:
+            logging.warning('Cached file of {} is corrupted, removing it'.format(archive_path))
+            file_object.close()
+            _remove(path)
+            return None
+
+        # Mark the file as recently used
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+        file_object.seek(0)
+        return file_object
+
+    def put(self, archive_path, file_object):
+        """
+        Save a file to the cache, removing the least recently used files if the cache is too large.
+
+        :param file_object: A binary file object positioned at its start, it is positioned at its start again
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.__get_path(archive_path)
+
+        # Written to a temporary file first, so a partially written file is never read
+        temporary_file = tempfile.NamedTemporaryFile(dir=self.directory, suffix=TEMPORARY_SUFFIX, delete=False)
+        try:
+            with temporary_file:
+                temporary_file.write(b'0' * CHECKSUM_SIZE)
+                contents_hash = _copy_with_hash(file_object, temporary_file)
+                temporary_file.seek(0)
+                temporary_file.write(contents_hash.hexdigest().encode('ascii'))
+            os.replace(temporary_file.name, path)
+        except Exception:
+            _remove(temporary_file.name)
+            raise
+        finally:
+            file_object.seek(0)
+
+        self.__evict(os.path.getsize(path))
+
+    def __evict(self, added_size):
+        """Remove the least recently used files until the cache is not larger than its maximal size."""
+        with self.lock:
+            if self.size is None:
+                self.size = sum(size for _, size, _ in self.__scan())
+            else:
+                self.size += added_size
+            if self.size <= self.max_size:
+                return
+
+            cached_files = sorted(self.__scan(), key=lambda cached_file: cached_file[2])
+            self.size = sum(size for _, size, _ in cached_files)
+            for path, size, _ in cached_files:
+                if self.size <= self.max_size:
+                    break
+                _remove(path)
+                self.size -= size
+
+    def __scan(self):
+        """Get the path, size and modification time of every cached file."""
+        cached_files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(TEMPORARY_SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Removed by another process
+                continue
+            cached_files.append((entry.path, stat.st_size, stat.st_mtime))
+
+        return cached_files
+
+    def __get_path(self, archive_path):
+        return os.path.join(self.directory, hashlib.sha256(archive_path.encode()).hexdigest())
+
+
+def _copy_with_hash(source, destination):
+    """Copy a file object to another, and get the sha256 of the copied contents."""
+    contents_hash = hashlib.sha256()
+    for buffer in iter(lambda: source.read(COPY_BUFFER_SIZE), b''):
+        contents_hash.update(buffer)
+        destination.write(buffer)
+
+    return contents_hash
+
+
+def _remove(path):
+    """Remove a file, if it was not removed already."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,142 @@
+"""
+Read the files of a history archive, wherever the archive is kept.
+
+An archive source is given by the URL of the archive's root directory:
+    s3://<bucket>/<prefix>      An archive bucket, read with the anonymous s3 client
+    http(s)://<host>/<prefix>   An archive published over http
+    file:///<directory>         A local mirror of the archive, its files are memory mapped instead of copied
+"""
+
+import mmap
+import os
+import shutil
+import tempfile
+import urllib.error
+import urllib.parse
+import urllib.request
+from abc import ABC, abstractmethod
+from botocore.exceptions import ClientError
+
+
+class ArchiveFileError(Exception):
+    """A file could not be read from the archive, reading it again might succeed."""
+
+    def __init__(self, message):
+        super(ArchiveFileError, self).__init__(message)
+
+
+class MissingArchiveFileError(ArchiveFileError):
+    """A file is not in the archive, it might not be published yet."""
+
+
+class ArchiveSource(ABC):
+    """Reads files by their path in the archive."""
+
+    def __init__(self, url):
+        """
+        :param url: URL of the archive's root directory
+        """
+        self.url = url.rstrip('/')
+
+    def get_url(self, path):
+        """Get the URL of a file in the archive, it identifies the file among all archives."""
+        return '{}/{}'.format(self.url, path)
+
+    @abstractmethod
+    def open(self, path):
+        """
+        Read a file from the archive.
+
+        :param path: Path of the file from the archive's root directory, e.g. 'ledger/00/00/00/ledger-0000003f.xdr.gz'
+        :return: A binary file object of the file, positioned at its start
+        :raise MissingArchiveFileError: If the file is not in the archive
+        :raise ArchiveFileError: If the file could not be read
+        """
+        pass
+
+
+class S3ArchiveSource(ArchiveSource):
+    """An archive in an s3 bucket."""
+
+    def __init__(self, url, s3, spool_size):
+        """
+        :param s3: An s3 client
+        :param spool_size: Files are kept in memory, unless they are larger than this
+        """
+        super(S3ArchiveSource, self).__init__(url)
+        parsed_url = urllib.parse.urlparse(self.url)
+        self.bucket = parsed_url.netloc
+        self.prefix = parsed_url.path.lstrip('/') + '/' if parsed_url.path.strip('/') else ''
+        self.s3 = s3
+        self.spool_size = spool_size
+
+    def open(self, path):
+        file_object = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        try:
+            # A single GET request, streamed into the file object
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.prefix + path)
+            shutil.copyfileobj(response['Body'], file_object)
+        except ClientError as e:
+            file_object.close()
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                raise MissingArchiveFileError('File {} is not in the archive'.format(self.get_url(path))) from e
+            raise ArchiveFileError('Could not read file {}: {}'.format(self.get_url(path), e)) from e
+        except BaseException:
+            file_object.close()
+            raise
+
+        file_object.seek(0)
+        return file_object
+
+
+class HttpArchiveSource(ArchiveSource):
+    """An archive published over http."""
+
+    def __init__(self, url, timeout, spool_size):
+        """
+        :param timeout: Timeout in seconds for connecting and reading every file
+        :param spool_size: Files are kept in memory, unless they are larger than this
+        """
+        super(HttpArchiveSource, self).__init__(url)
+        self.timeout = timeout
+        self.spool_size = spool_size
+
+    def open(self, path):
+        file_object = tempfile.SpooledTemporaryFile(max_size=self.spool_size)
+        try:
+            with urllib.request.urlopen(self.get_url(path), timeout=self.timeout) as response:
+                shutil.copyfileobj(response, file_object)
+        except urllib.error.HTTPError as e:
+            file_object.close()
+            if e.code == 404:
+                raise MissingArchiveFileError('File {} is not in the archive'.format(self.get_url(path))) from e
+            raise ArchiveFileError('Could not read file {}: {}'.format(self.get_url(path), e)) from e
+        except OSError as e:
+            # Connection errors and timeouts
+            file_object.close()
+            raise ArchiveFileError('Could not read file {}: {}'.format(self.get_url(path), e)) from e
+        except BaseException:
+            file_object.close()
+            raise
+
+        file_object.seek(0)
+        return file_object
+
+
+class LocalArchiveSource(ArchiveSource):
+    """A copy of an archive in a local directory."""
+
+    def __init__(self, url):
+        super(LocalArchiveSource, self).__init__(url)
+        self.directory = urllib.request.url2pathname(urllib.parse.urlparse(self.url).path)
+
+    def open(self, path):
+        try:
+            with open(os.path.join(self.directory, path), 'rb') as archive_file:
+                # The file is read from the page cache, without copying it first
+                return mmap.mmap(archive_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError as e:
+            raise MissingArchiveFileError('File {} is not in the archive'.format(self.get_url(path))) from e
+        except ValueError as e:
+            # Empty files can not be mapped, the file is still being copied
+            raise ArchiveFileError('Could not read file {}: {}'.format(self.get_url(path), e)) from e
@@ -0,0 +1,229 @@
+"""
+Ingest a range of checkpoints in parallel shards.
+
+Shards may complete in any order, but the last file is only advanced over the shards that
+completed contiguously from the start of the range, so a crash never leaves holes behind it.
+
+Collectors sharing a storage claim the shards they ingest in the storage, so each of them ingests different shards.
+"""
+
+import collections
+import logging
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+
+# A new checkpoint is published every 64 ledgers
+CHECKPOINT_FREQUENCY = 64
+
+Shard = collections.namedtuple('Shard', ['first_sequence', 'count', 'last_sequence'])
+
+
+def split_to_shards(first_sequence, last_sequence, shard_size, aligned=False):
+    """
+    Split a range of checkpoints into shards of consecutive checkpoints.
+
+    :param first_sequence: Hexadecimal sequence of the first checkpoint file in the range, for example '0000003f'
+    :param last_sequence: Hexadecimal sequence of the last checkpoint file in the range
+    :param shard_size: Number of checkpoints in every shard, the last shard might be smaller
+    :param aligned: Start the shards at multiples of shard_size checkpoints, so the first shard might be smaller too.
+      Every range is then split to the same shards, wherever it starts.
+    :return: An ordered list of shards, empty if the range is empty
+    """
+    first = int(first_sequence, 16)
+    last = int(last_sequence, 16)
+
+    shards = []
+    shard_first = first
+    while shard_first <= last:
+        shard_last = shard_first + (shard_size - 1) * CHECKPOINT_FREQUENCY
+        if aligned:
+            shard_last -= get_shard_index(shard_first, shard_size) * CHECKPOINT_FREQUENCY
+        shard_last = min(shard_last, last)
+        shards.append(Shard(__format_sequence(shard_first),
+                            (shard_last - shard_first) // CHECKPOINT_FREQUENCY + 1,
+                            __format_sequence(shard_last)))
+        shard_first = shard_last + CHECKPOINT_FREQUENCY
+
+    return shards
+
+
+def get_shard_index(sequence, shard_size):
+    """Get the position of a checkpoint in its aligned shard, 0 for the first checkpoint of the shard."""
+    return ((sequence + 1) // CHECKPOINT_FREQUENCY - 1) % shard_size
+
+
+class ShardWatermark:
+    """Track the completed shards of a range and the last checkpoint completed contiguously from its start."""
+
+    def __init__(self, shards):
+        self.shards = shards
+        self.completed = set()
+        self.next_index = 0
+
+    def complete(self, index):
+        """
+        Mark a shard as completed.
+
+        :return: The last checkpoint of the contiguous completed shards if it advanced, otherwise None
+        """
+        self.completed.add(index)
+
+        advanced_to = None
+        while self.next_index in self.completed:
+            self.completed.remove(self.next_index)
+            advanced_to = self.shards[self.next_index].last_sequence
+            self.next_index += 1
+
+        return advanced_to
+
+
+def ingest_shards(pool, ingest_function, shards, advance_function, max_pending, max_retries):
+    """
+    Ingest shards on a pool of workers, advancing the last file as the shards complete.
+
+    :param pool: An executor to run the shards on
+    :param ingest_function: Called on the pool with the first sequence and count of checkpoints of a shard
+    :param shards: Ordered list of shards to ingest
+    :param advance_function: Called with the last checkpoint completed contiguously, whenever it advances
+    :param max_pending: Maximal number of shards submitted to the pool at a time
+    :param max_retries: Number of times a failed shard is submitted again before giving up
+    """
+    watermark = ShardWatermark(shards)
+    failed_attempts = collections.Counter()
+    pending = {}
+    next_index = 0
+
+    def submit(index):
+        pending[pool.submit(ingest_function, shards[index].first_sequence, shards[index].count)] = index
+
+    while pending or next_index < len(shards):
+        while next_index < len(shards) and len(pending) < max_pending:
+            submit(next_index)
+            next_index += 1
+
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = pending.pop(future)
+            try:
+                future.result()
+            except Exception:
+                failed_attempts[index] += 1
+                if failed_attempts[index] > max_retries:
+                    logging.error('Reached retry limit on shard starting at {}'.format(shards[index].first_sequence))
+                    for pending_future in pending:
+                        pending_future.cancel()
+                    raise
+
+                logging.warning('Shard starting at {} failed, retrying'.format(shards[index].first_sequence))
+                submit(index)
+                continue
+
+            advanced_to = watermark.complete(index)
+            if advanced_to is not None:
+                advance_function(advanced_to)
+
+
+class ShardClaims:
+    """
+    Claim aligned shards in the storage, so that collectors sharing the storage ingest different shards.
+
+    A shard is claimed by the name of its first checkpoint for a lease time, and its claim is renewed while it is
+    ingested. The shards of a collector that stopped are claimed by the others once their claims expire.
+    """
+
+    def __init__(self, storage_adapter, owner, lease_time, shard_size):
+        """
+        :param owner: Identifier of the collector, unique among the collectors sharing the storage
+        :param lease_time: Seconds until a claim expires, unless it is renewed
+        :param shard_size: Number of checkpoints in every aligned shard, the same for all the collectors
+        """
+        self.storage_adapter = storage_adapter
+        self.owner = owner
+        self.lease_time = lease_time
+        self.shard_size = shard_size
+        # Claims are renewed a few times during their lease, so a late renewal does not lose them
+        self.renew_interval = lease_time / 3
+
+    def get_name(self, shard):
+        """Get the name the shard is claimed by, the first checkpoint of its aligned shard."""
+        first = int(shard.first_sequence, 16)
+        return '{:08x}'.format(first - get_shard_index(first, self.shard_size) * CHECKPOINT_FREQUENCY)
+
+    def claim(self, shard):
+        """:return: True if the shard was claimed, False if another collector claimed it"""
+        return self.storage_adapter.claim_file(self.get_name(shard), self.owner, self.lease_time)
+
+    def renew(self, shards):
+        names = {self.get_name(shard) for shard in shards}
+        lost_names = names - self.storage_adapter.renew_file_claims(names, self.owner, self.lease_time)
+        for name in sorted(lost_names):
+            # Its checkpoints are only saved once, whichever collector saves them first
+            logging.warning('The claim on shard {} expired and it might be ingested by another collector'.format(name))
+
+    def release(self, shard):
+        self.storage_adapter.release_file_claim(self.get_name(shard), self.owner)
+
+
+def ingest_claimed_shards(pool, ingest_function, shards, shard_claims, advance_function, max_pending, max_retries):
+    """
+    Ingest the shards no other collector claimed on a pool of workers, advancing the last file as they complete.
+
+    Every shard is claimed before it is submitted, and its claim is renewed until it completes.
+    Shards claimed by other collectors are skipped.
+
+    :param ingest_function: Called on the pool with the first sequence and count of checkpoints of a shard,
+      returns the number of checkpoints it saved
+    :param shards: Ordered list of aligned shards to ingest
+    :param shard_claims: The ShardClaims of the storage
+    :param advance_function: Called whenever a shard completes, advances the last file over the checkpoints
+      saved by all the collectors
+    :return: Number of checkpoints saved
+    """
+    failed_attempts = collections.Counter()
+    pending = {}
+    next_index = 0
+    saved = 0
+    renew_time = time.monotonic() + shard_claims.renew_interval
+
+    def submit(index):
+        pending[pool.submit(ingest_function, shards[index].first_sequence, shards[index].count)] = index
+
+    while pending or next_index < len(shards):
+        while next_index < len(shards) and len(pending) < max_pending:
+            if shard_claims.claim(shards[next_index]):
+                submit(next_index)
+            next_index += 1
+        if not pending:
+            break
+
+        done, _ = wait(pending, timeout=max(renew_time - time.monotonic(), 0), return_when=FIRST_COMPLETED)
+        if time.monotonic() >= renew_time:
+            shard_claims.renew([shards[index] for future, index in pending.items() if future not in done])
+            renew_time = time.monotonic() + shard_claims.renew_interval
+
+        for future in done:
+            index = pending.pop(future)
+            try:
+                shard_saved = future.result()
+            except Exception:
+                failed_attempts[index] += 1
+                if failed_attempts[index] > max_retries:
+                    logging.error('Reached retry limit on shard starting at {}'.format(shards[index].first_sequence))
+                    shard_claims.release(shards[index])
+                    for pending_future in pending:
+                        pending_future.cancel()
+                    raise
+
+                logging.warning('Shard starting at {} failed, retrying'.format(shards[index].first_sequence))
+                submit(index)
+                continue
+
+            shard_claims.release(shards[index])
+            saved += shard_saved
+            advance_function()
+
+    return saved
+
+
+def __format_sequence(sequence):
+    return '{:08x}'.format(sequence)
@@ -4,13 +4,21 @@ import os
 import sys
 import logging
 import psycopg2
+from psycopg2 import sql
 from adapters.postgres_storage_adapter import PostgresStorageAdapter
+from adapters.hc_storage_adapter import PAYMENTS_TABLE, CREATIONS_TABLE
+from operation_handlers import OPERATION_HANDLERS
 
 # Get constants from env variables
 PYTHON_PASSWORD = os.environ['PYTHON_PASSWORD']
 FIRST_FILE = os.environ['FIRST_FILE']
 POSTGRES_PASSWORD = os.environ['POSTGRES_PASSWORD']
 POSTGRES_HOST = os.environ['POSTGRES_HOST']
+# Networks sharing a postgres host are saved to databases of their own
+POSTGRES_DATABASE = os.environ.get('POSTGRES_DATABASE', 'kin')
+APP_IDS = [app_id.strip() for app_id in os.environ.get('APP_IDS', '').split(',') if app_id.strip()]
+OPERATION_TABLES = [table_name.strip() for table_name in
+                    os.environ.get('OPERATION_TABLES', 'payments,creations').split(',') if table_name.strip()]
 
 
 def setup_postgres(database=''):
@@ -36,7 +44,7 @@ def main():
 
     # Check if the database already exists
     try:
-        setup_postgres(database='/kin')
+        cur = setup_postgres(database='/' + POSTGRES_DATABASE)
     except psycopg2.OperationalError as e:
         if 'does not exist' in str(e):
             pass
@@ -44,6 +52,10 @@ def main():
             raise
     else:
         logging.info('Using existing database instead of creating a new one')
+        # Apps and operation tables might have been added since the database was created
+        create_operation_tables(cur)
+        create_completed_files_table(cur)
+        create_file_claims_table(cur)
         sys.exit(0)
 
     if verify_file_sequence() != 0:
@@ -55,14 +67,16 @@ def main():
         cur = setup_postgres()
 
         # Create the database
-        cur.execute('CREATE DATABASE {};'.format('kin'))
+        cur.execute(sql.SQL('CREATE DATABASE {};').format(sql.Identifier(POSTGRES_DATABASE)))
 
-        # Create the user
-        cur.execute('CREATE USER python;')
-        cur.execute("ALTER USER python WITH PASSWORD '{}'".format(PYTHON_PASSWORD))
+        # Create the user, unless it was created with the database of another network
+        cur.execute("SELECT 1 FROM pg_roles WHERE rolname = 'python'")
+        if cur.fetchone() is None:
+            cur.execute('CREATE USER python;')
+            cur.execute("ALTER USER python WITH PASSWORD '{}'".format(PYTHON_PASSWORD))
 
         # Create the tables
-        cur = setup_postgres('/kin')
+        cur = setup_postgres('/' + POSTGRES_DATABASE)
         cur.execute(__generate_table_creation('payments', PostgresStorageAdapter.payments_output_schema()))
 
         cur.execute(__generate_table_creation('creations', PostgresStorageAdapter.creations_output_schema()))
@@ -82,6 +96,10 @@ def main():
         cur.execute('GRANT SELECT on lastfile TO python')
         cur.execute('GRANT UPDATE on lastfile to python')
 
+        create_operation_tables(cur)
+        create_completed_files_table(cur)
+        create_file_claims_table(cur)
+
         logging.info('Database created successfully.')
 
     except:
@@ -89,10 +107,47 @@ def main():
         raise
 
 
-def __generate_table_creation(table_name, schema):
-    return 'CREATE TABLE {table_name}( {columns});'.format(
-        table_name=table_name,
-        columns=', '.join(['{name} {type}'.format(name=column, type=schema[column]) for column in schema])
+def create_operation_tables(cur):
+    """Create the tables of the operations in OPERATION_TABLES and of every app in APP_IDS, that do not exist yet."""
+    schemas = {PAYMENTS_TABLE: PostgresStorageAdapter.payments_output_schema(),
+               CREATIONS_TABLE: PostgresStorageAdapter.creations_output_schema()}
+    for table_name in OPERATION_TABLES:
+        if table_name not in schemas:
+            schemas[table_name] = PostgresStorageAdapter.get_postgres_schema(
+                OPERATION_HANDLERS[table_name].output_schema())
+
+    for app_id in [None] + APP_IDS:
+        for table_name, schema in schemas.items():
+            app_table_name = PostgresStorageAdapter.get_table_name(table_name, app_id)
+            cur.execute(__generate_table_creation(app_table_name, schema, if_not_exists=True))
+
+            # App ids may have characters that have to be quoted
+            cur.execute(sql.SQL('GRANT INSERT, SELECT on {} TO python').format(sql.Identifier(app_table_name)))
+
+    logging.info('Tables of the operations are ready')
+
+
+def create_completed_files_table(cur):
+    """Create the table of the files a backfill saved ahead of the last file, if it does not exist yet."""
+    cur.execute('CREATE TABLE IF NOT EXISTS completedfiles('
+                'name varchar(8) PRIMARY KEY);')
+    cur.execute('GRANT INSERT, SELECT, DELETE on completedfiles TO python')
+
+
+def create_file_claims_table(cur):
+    """Create the table of the files claimed by collectors sharing the database, if it does not exist yet."""
+    cur.execute('CREATE TABLE IF NOT EXISTS fileclaims('
+                'name varchar(8) PRIMARY KEY, '
+                'owner text not NULL, '
+                'expires TIMESTAMP WITH TIME ZONE not NULL);')
+    cur.execute('GRANT INSERT, SELECT, UPDATE, DELETE on fileclaims TO python')
+
+
+def __generate_table_creation(table_name, schema, if_not_exists=False):
+    return sql.SQL('CREATE TABLE {if_not_exists}{table_name}( {columns});').format(
+        if_not_exists=sql.SQL('IF NOT EXISTS ' if if_not_exists else ''),
+        table_name=sql.Identifier(table_name),
+        columns=sql.SQL(', '.join(['{name} {type}'.format(name=column, type=schema[column]) for column in schema]))
     )
 
 
@@ -0,0 +1,102 @@
+"""
+Choose how many checkpoints to fetch concurrently while following the archive.
+
+Far behind the archive tip, enough checkpoints are downloaded and decoded ahead of the one being written that a
+fetched checkpoint is ready whenever a write completes. At the tip there is nothing to fetch ahead, so a single
+checkpoint is fetched at a time. The number of checkpoints fetched ahead never exceeds what the decoding workers can
+keep up with, nor what fits in the memory budget.
+"""
+
+import logging
+import math
+import threading
+
+# Weight of the last observation in the moving averages of the stage latencies and the checkpoint size
+LATENCY_SMOOTHING = 0.3
+
+DOWNLOAD_STAGE = 'download'
+DECODE_STAGE = 'decode'
+WRITE_STAGE = 'write'
+COMMIT_STAGE = 'commit'
+
+
+class ConcurrencyController:
+    """Learn the latency of every stage of ingesting a checkpoint, and pick the prefetch depth from them."""
+
+    def __init__(self, max_depth, cpu_budget, memory_budget):
+        """
+        :param max_depth: Maximal number of checkpoints to fetch ahead of the one being written
+        :param cpu_budget: Number of checkpoints that can be decoded at the same time
+        :param memory_budget: Maximal number of bytes of the checkpoints fetched at the same time, 0 for no limit
+        """
+        self.max_depth = max_depth
+        self.cpu_budget = max(cpu_budget, 1)
+        self.memory_budget = memory_budget
+
+        self.lock = threading.Lock()
+        # Moving averages of the seconds every stage takes, by the stage
+        self.latencies = {}
+        # Moving average of the bytes a fetched checkpoint takes, until it is written
+        self.checkpoint_size = None
+        # Number of checkpoints published to the archive after the one being written, None if unknown
+        self.lag = None
+        self.depth = max_depth
+
+    def observe_stage(self, stage, seconds):
+        """Learn how long a stage of ingesting a checkpoint took."""
+        with self.lock:
+            self.latencies[stage] = self.__smooth(self.latencies.get(stage), seconds)
+
+    def observe_checkpoint_size(self, size):
+        """Learn how many bytes a fetched checkpoint takes."""
+        with self.lock:
+            self.checkpoint_size = self.__smooth(self.checkpoint_size, size)
+
+    def observe_lag(self, lag):
+        """
+        :param lag: Number of checkpoints published to the archive after the one being written, None if unknown
+        """
+        with self.lock:
+            self.lag = lag
+
+    def get_depth(self):
+        """Return the number of checkpoints to fetch ahead of the one being written."""
+        with self.lock:
+            depth = self.__get_depth()
+            if depth != self.depth:
+                latencies = ', '.join('{} {:.2f}s'.format(stage, seconds)
+                                      for stage, seconds in sorted(self.latencies.items()))
+                logging.info('Fetching {} checkpoints ahead, {} behind the archive tip, latencies: {}'.format(
+                    depth, 'unknown' if self.lag is None else self.lag, latencies or 'unknown'))
+                self.depth = depth
+            return depth
+
+    def __get_depth(self):
+        depth = self.max_depth
+
+        # Nothing is published ahead of the checkpoint being written at the tip
+        if self.lag is not None:
+            depth = min(depth, max(self.lag, 0))
+
+        download = self.latencies.get(DOWNLOAD_STAGE)
+        decode = self.latencies.get(DECODE_STAGE)
+        write = self.latencies.get(WRITE_STAGE)
+        if download is not None and decode is not None:
+            fetch = download + decode
+            # A fetched checkpoint is ready whenever a write completes, when as many are fetched as fit in a fetch
+            if write:
+                depth = min(depth, math.ceil(fetch / write))
+            # The checkpoints beyond those being decoded and those downloading meanwhile only wait for a decoder
+            if decode:
+                depth = min(depth, math.ceil(self.cpu_budget * fetch / decode) - 1)
+
+        if self.memory_budget and self.checkpoint_size:
+            depth = min(depth, int(self.memory_budget // self.checkpoint_size) - 1)
+
+        return max(depth, 0)
+
+    @staticmethod
+    def __smooth(average, value):
+        if average is None:
+            return value
+        return average + LATENCY_SMOOTHING * (value - average)
@@ -0,0 +1,90 @@
+"""
+Keep the decoded checkpoints on disk, so their operations can be extracted again without decoding the XDR files.
+
+Every checkpoint is a gzipped file of pickled records: first its ledger:closeTime dictionary, then every transaction
+history entry with the results of its ledger, already joined by ledger. The pickled dictionaries repeat their keys,
+so even the fastest compression level makes them several times smaller, and it is still faster to read than XDR.
+"""
+
+import contextlib
+import gzip
+import os
+import pickle
+import tempfile
+from ledger_results import LedgerResults
+
+FILE_SUFFIX = '.pickle.gz'
+COMPRESS_LEVEL = 1
+
+
+class DecodedCheckpoints:
+    """A directory of decoded checkpoints, by file sequence."""
+
+    def __init__(self, directory):
+        """
+        :param directory: The directory of the decoded checkpoints, created on the first saved checkpoint
+        """
+        self.directory = directory
+
+    def contains(self, file_sequence):
+        """Tell if a checkpoint was saved."""
+        return os.path.exists(self.__get_path(file_sequence))
+
+    @contextlib.contextmanager
+    def save(self, file_sequence, ledgers_dictionary, ledgers):
+        """
+        Save a checkpoint while its ledgers are iterated.
+
+        The checkpoint is kept only if the context exits without an error, after all of its ledgers were iterated.
+
+        :param ledgers_dictionary: The checkpoint's ledger:closeTime dictionary
+        :param ledgers: An iterable of transaction history entries and the LedgerResults of their ledger
+        :return: A context of a generator of the same ledgers
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        # Written to a temporary file first, so a partially written checkpoint is never read
+        checkpoint_file = tempfile.NamedTemporaryFile(dir=self.directory, suffix='.tmp', delete=False)
+        try:
+            with checkpoint_file, gzip.GzipFile(fileobj=checkpoint_file, mode='wb',
+                                                compresslevel=COMPRESS_LEVEL) as gzip_file:
+                pickle.dump(ledgers_dictionary, gzip_file, pickle.HIGHEST_PROTOCOL)
+                saved_ledgers = _save_ledgers(gzip_file, ledgers)
+                yield saved_ledgers
+                # Save the ledgers the context did not iterate
+                for _ in saved_ledgers:
+                    pass
+            os.replace(checkpoint_file.name, self.__get_path(file_sequence))
+        except BaseException:
+            os.remove(checkpoint_file.name)
+            raise
+
+    @contextlib.contextmanager
+    def load(self, file_sequence, validate=False):
+        """
+        Load a saved checkpoint.
+
+        :param validate: Check the hash of every transaction that is matched with its result
+        :return: A context of the checkpoint's ledger:closeTime dictionary, and a generator of its
+          transaction history entries and the LedgerResults of their ledger
+        """
+        with gzip.open(self.__get_path(file_sequence), 'rb') as checkpoint_file:
+            ledgers_dictionary = pickle.load(checkpoint_file)
+            yield ledgers_dictionary, _load_ledgers(checkpoint_file, validate)
+
+    def __get_path(self, file_sequence):
+        return os.path.join(self.directory, file_sequence + FILE_SUFFIX)
+
+
+def _save_ledgers(file_object, ledgers):
+    for transaction_history_entry, ledger_results in ledgers:
+        pickle.dump((transaction_history_entry, ledger_results.result_pairs), file_object, pickle.HIGHEST_PROTOCOL)
+        yield transaction_history_entry, ledger_results
+
+
+def _load_ledgers(file_object, validate):
+    while True:
+        try:
+            transaction_history_entry, result_pairs = pickle.load(file_object)
+        except EOFError:
+            return
+        yield transaction_history_entry, LedgerResults(transaction_history_entry['ledgerSeq'], result_pairs, validate)
@@ -0,0 +1,80 @@
+"""
+Join the transactions of a checkpoint with their results, one ledger at a time.
+
+Both files are ordered by ledger, so they are merged by ledger sequence while they are decoded.
+The results of a ledger are ordered by the order its transactions were applied in, not by their order
+in the transaction set, so inside a ledger with more than one transaction the results are matched by hash.
+"""
+
+
+class LedgerResultsError(Exception):
+
+    def __init__(self, message):
+        super(LedgerResultsError, self).__init__(message)
+
+
+class LedgerResults:
+    """The results of the transactions in a single ledger."""
+
+    def __init__(self, ledger_sequence, result_pairs, validate=False):
+        """
+        :param ledger_sequence: Sequence of the ledger
+        :param result_pairs: The 'results' of the ledger's results entry, pairs of a transaction hash and its result
+        :param validate: Check the hash of a transaction also when it is matched by position
+        """
+        self.ledger_sequence = ledger_sequence
+        self.result_pairs = result_pairs
+        self.validate = validate
+        self.results_by_hash = None
+
+    def get(self, transaction):
+        """
+        Find the result of a transaction in the ledger.
+
+        :param transaction: A decoded transaction envelope, with its 'hash'
+        :return: The transaction's 'result'
+        """
+        if len(self.result_pairs) == 1:
+            # The only transaction in the ledger, nothing to look up
+            result_pair = self.result_pairs[0]
+            if self.validate and result_pair['transactionHash'] != transaction['hash']:
+                raise LedgerResultsError('Transaction {} does not match the result of ledger {}'.format(
+                    transaction['hash'], self.ledger_sequence))
+            return result_pair['result']
+
+        if self.results_by_hash is None:
+            self.results_by_hash = {result_pair['transactionHash']: result_pair['result']
+                                    for result_pair in self.result_pairs}
+
+        try:
+            return self.results_by_hash[transaction['hash']]
+        except KeyError:
+            raise LedgerResultsError('Could not find the result of transaction {} in ledger {}'.format(
+                transaction['hash'], self.ledger_sequence))
+
+
+def merge_by_ledger(transactions, results, validate=False):
+    """
+    Merge the transactions and results of a checkpoint by ledger.
+
+    :param transactions: Iterable of decoded transaction history entries, ordered by ledger sequence
+    :param results: Iterable of decoded transaction history result entries, ordered by ledger sequence
+    :param validate: Check the hash of every transaction that is matched with its result
+    :return: A generator of every transaction history entry and the LedgerResults of its ledger
+    """
+    results_iterator = iter(results)
+    results_entry = next(results_iterator, None)
+
+    for transaction_history_entry in transactions:
+        ledger_sequence = transaction_history_entry['ledgerSeq']
+
+        # Skip the results of ledgers that are not in the transactions file
+        while results_entry is not None and results_entry['ledgerSeq'] < ledger_sequence:
+            results_entry = next(results_iterator, None)
+
+        if results_entry is None or results_entry['ledgerSeq'] != ledger_sequence:
+            result_pairs = []
+        else:
+            result_pairs = results_entry['txResultSet']['results']
+
+        yield transaction_history_entry, LedgerResults(ledger_sequence, result_pairs, validate)
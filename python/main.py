@@ -1,45 +1,74 @@
 """
 ETL for stellar history files.
 
-Script to download xdr files from an s3 bucket,
+Script to download xdr files from a history archive,
 unpack them, filter the transactions in them,
 and write the relevant transactions to a database.
 """
 
 import os
 import time
+import atexit
 import logging
 import re
 import sys
 import traceback
 import smtplib
 import ssl
-import boto3
 import json
-from botocore import UNSIGNED
-from botocore.client import Config
+import tempfile
+import io
+import functools
+import queue
+import threading
+import urllib.parse
+import socket
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from botocore.exceptions import ClientError
-import psycopg2
-from xdrparser import parser
-from adapters import *
-
-# Get constants from env variables
-FIRST_FILE = os.environ['FIRST_FILE']
-PYTHON_PASSWORD = os.environ['PYTHON_PASSWORD']
-POSTGRES_HOST = os.environ['POSTGRES_HOST']
-S3_STORAGE_AWS_ACCESS_KEY = os.environ['S3_STORAGE_AWS_ACCESS_KEY']
-S3_STORAGE_AWS_SECRET_KEY = os.environ['S3_STORAGE_AWS_SECRET_KEY']
-S3_STORAGE_BUCKET = os.environ['S3_STORAGE_BUCKET']
-S3_STORAGE_KEY_PREFIX = os.environ['S3_STORAGE_KEY_PREFIX']
-S3_STORAGE_REGION = os.environ['S3_STORAGE_REGION']
-KIN_ISSUER = os.environ['KIN_ISSUER']
-NETWORK_PASSPHARSE = os.environ['NETWORK_PASSPHRASE']
+import xdr_decoder
+from prefetcher import CheckpointPrefetcher
+from concurrency_controller import ConcurrencyController, DOWNLOAD_STAGE, DECODE_STAGE, WRITE_STAGE, COMMIT_STAGE
+from operations_spool import OperationsSpool, write_chunks
+from operation_handlers import TransactionFields
+from account_watchlist import AccountWatchlist
+from operation_columns import OperationColumns
+from archive_cache import ArchiveCache
+from decoded_checkpoints import DecodedCheckpoints
+from archive_sources import ArchiveFileError, MissingArchiveFileError, S3ArchiveSource, HttpArchiveSource, \
+    LocalArchiveSource
+from ledger_results import merge_by_ledger
+import backfill
+from tip_scheduler import TipScheduler, jittered_backoff
+from alert_dispatcher import AlertDispatcher
+from networks import Network, load_networks
+
+# Get constants from env variables.
+# Only the variables of the configured storage are needed, and FIRST_FILE is only needed to follow the archive.
+# The variables of the network are the settings of every network in NETWORKS_FILE that does not set them.
+FIRST_FILE = os.environ.get('FIRST_FILE', '')
+PYTHON_PASSWORD = os.environ.get('PYTHON_PASSWORD', '')
+POSTGRES_HOST = os.environ.get('POSTGRES_HOST', '')
+POSTGRES_DATABASE = os.environ.get('POSTGRES_DATABASE', 'kin')
+S3_STORAGE_AWS_ACCESS_KEY = os.environ.get('S3_STORAGE_AWS_ACCESS_KEY', '')
+S3_STORAGE_AWS_SECRET_KEY = os.environ.get('S3_STORAGE_AWS_SECRET_KEY', '')
+S3_STORAGE_BUCKET = os.environ.get('S3_STORAGE_BUCKET', '')
+S3_STORAGE_KEY_PREFIX = os.environ.get('S3_STORAGE_KEY_PREFIX', '')
+S3_STORAGE_REGION = os.environ.get('S3_STORAGE_REGION', '')
+KIN_ISSUER = os.environ.get('KIN_ISSUER', '')
+NETWORK_PASSPHARSE = os.environ.get('NETWORK_PASSPHRASE', '')
 MAX_RETRIES = int(os.environ['MAX_RETRIES'])
-BUCKET_NAME = os.environ['BUCKET_NAME']
+BUCKET_NAME = os.environ.get('BUCKET_NAME', '')
 LOG_LEVEL = os.environ['LOG_LEVEL']
 
 APP_ID = os.environ.get('APP_ID', None)
+# Apps whose transactions are saved to destinations of their own, all of them from a single pass over the archive
+APP_IDS = [app_id.strip() for app_id in os.environ.get('APP_IDS', '').split(',') if app_id.strip()]
 CORE_DIRECTORY = os.environ.get('CORE_DIRECTORY', '')
+# URL of the archive to read, s3://, http(s):// or file://, the BUCKET_NAME and CORE_DIRECTORY on s3 if not set
+ARCHIVE_URL = os.environ.get('ARCHIVE_URL', '')
+# A JSON file of the networks to follow concurrently, each with its own archive and storage, see networks.py.
+# A single network is configured by the variables above if it is not set.
+NETWORKS_FILE = os.environ.get('NETWORKS_FILE', '')
 
 EMAIL_SMTP = os.environ.get('EMAIL_SMTP')
 EMAIL_ACCOUNT = os.environ.get('EMAIL_ACCOUNT')
@@ -48,35 +77,162 @@ EMAIL_RECIPIENTS = os.environ.get('EMAIL_RECIPIENTS')
 
 LAMBDA_NAME = os.environ.get('LAMBDA_NAME')
 LAMBDA_REGION = os.environ.get('LAMBDA_REGION', 'us-east-1')
+# Minimal number of seconds between alerts, the alerts raised in between are sent together
+ALERT_INTERVAL = int(os.environ.get('ALERT_INTERVAL', 60))
+
+# Maximal number of upcoming files to fetch while the current one is written, when far behind the archive tip.
+# Fewer are fetched when the writes keep up with fewer, and one at a time at the tip.
+# Both budgets are split between the networks followed, see get_prefetch_depth.
+PREFETCH_DEPTH = int(os.environ.get('PREFETCH_DEPTH', 2))
+# Maximal number of bytes of the files fetched at the same time, and of the operations extracted from them
+PREFETCH_MEMORY_BUDGET = int(os.environ.get('PREFETCH_MEMORY_BUDGET', 1024 * 1024 * 1024))
+# Downloaded files and extracted operations are kept in memory, larger files (in bytes) are spooled to a temporary file
+DOWNLOAD_SPOOL_SIZE = int(os.environ.get('DOWNLOAD_SPOOL_SIZE', 64 * 1024 * 1024))
+# Connection settings of the archive S3 client, timeouts are in seconds
+S3_CONNECT_TIMEOUT = int(os.environ.get('S3_CONNECT_TIMEOUT', 5))
+S3_READ_TIMEOUT = int(os.environ.get('S3_READ_TIMEOUT', 30))
+# Number of worker processes used to catch up with the archive, 0 disables backfilling
+BACKFILL_WORKERS = int(os.environ.get('BACKFILL_WORKERS', 0))
+BACKFILL_SHARD_SIZE = int(os.environ.get('BACKFILL_SHARD_SIZE', 16))
+# Collectors backfilling a shared storage claim the shards they ingest, a claim expires if it is not renewed within
+# the lease time in seconds. Only one of them follows the archive after the backfill, the others set FOLLOW_ARCHIVE
+# to false and stop once the archive tip is reached.
+BACKFILL_CLAIMS = os.environ.get('BACKFILL_CLAIMS', 'false').lower() == 'true'
+CLAIM_LEASE_TIME = int(os.environ.get('CLAIM_LEASE_TIME', 300))
+FOLLOW_ARCHIVE = os.environ.get('FOLLOW_ARCHIVE', 'true').lower() == 'true'
+# Number of worker processes that decode the downloaded files, 0 decodes them in the collector's process
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', 0))
+# Number of operations extracted and saved at a time, the rest of a checkpoint's operations wait in a file
+SAVE_CHUNK_SIZE = int(os.environ.get('SAVE_CHUNK_SIZE', 10000))
+# Check that every transaction matches its result, also where they are matched by their position
+VALIDATE_TRANSACTION_HASHES = os.environ.get('VALIDATE_TRANSACTION_HASHES', 'false').lower() == 'true'
+# Tables of the operations to extract, every table has an operation handler
+OPERATION_TABLES = [table_name.strip() for table_name in
+                    os.environ.get('OPERATION_TABLES', 'payments,creations').split(',') if table_name.strip()]
+# A file of accounts, only the operations they are the source or the destination of are saved
+WATCHLIST_FILE = os.environ.get('WATCHLIST_FILE', '')
+# A directory to keep the downloaded archive files in, and the maximal size in bytes of the files kept
+ARCHIVE_CACHE_DIRECTORY = os.environ.get('ARCHIVE_CACHE_DIRECTORY', '')
+ARCHIVE_CACHE_SIZE = int(os.environ.get('ARCHIVE_CACHE_SIZE', 10 * 1024 * 1024 * 1024))
+# A directory to save every decoded checkpoint to, and whether to extract the operations of the checkpoints saved there
+# instead of downloading and decoding them
+DECODED_CHECKPOINTS_DIRECTORY = os.environ.get('DECODED_CHECKPOINTS_DIRECTORY', '')
+REPROCESS_DECODED_CHECKPOINTS = os.environ.get('REPROCESS_DECODED_CHECKPOINTS', 'false').lower() == 'true'
 
 
 # Add trailing / to core directory
 if CORE_DIRECTORY != '' and CORE_DIRECTORY[-1] != '/':
     CORE_DIRECTORY += '/'
 
-# 1-<uppercase|lowercase|digits>*4-anything
-APP_ID_REGEX = re.compile('^1-[A-z0-9]{4}-.*')
+if not ARCHIVE_URL:
+    ARCHIVE_URL = 's3://{}/{}'.format(BUCKET_NAME, CORE_DIRECTORY)
+
 SSL_PORT = 465
 
+# Seconds every decode worker is kept busy on start, so that all of them are started at once
+DECODE_WORKERS_WARM_UP_TIME = 1
+
+NETWORK_SETTINGS = dict(kin_issuer=KIN_ISSUER, network_passphrase=NETWORK_PASSPHARSE, archive_url=ARCHIVE_URL,
+                        first_file=FIRST_FILE, app_id=APP_ID, app_ids=APP_IDS, operation_tables=OPERATION_TABLES,
+                        postgres_host=POSTGRES_HOST, postgres_database=POSTGRES_DATABASE,
+                        python_password=PYTHON_PASSWORD, s3_storage_bucket=S3_STORAGE_BUCKET,
+                        s3_storage_key_prefix=S3_STORAGE_KEY_PREFIX,
+                        s3_storage_aws_access_key=S3_STORAGE_AWS_ACCESS_KEY,
+                        s3_storage_aws_secret_key=S3_STORAGE_AWS_SECRET_KEY, s3_storage_region=S3_STORAGE_REGION)
+
+# The networks to follow, and the networks by their name, worker processes are given the name of their task's network
+NETWORKS = load_networks(NETWORKS_FILE, NETWORK_SETTINGS) if NETWORKS_FILE else [Network(None, **NETWORK_SETTINGS)]
+NETWORKS_BY_NAME = {network.name: network for network in NETWORKS}
+
+# Reloaded whenever the file is modified, before a file is written
+ACCOUNT_WATCHLIST = AccountWatchlist(WATCHLIST_FILE) if WATCHLIST_FILE else None
+
+# Downloaded files are read from the cache when they were downloaded before
+ARCHIVE_CACHE = ArchiveCache(ARCHIVE_CACHE_DIRECTORY, ARCHIVE_CACHE_SIZE, DOWNLOAD_SPOOL_SIZE) \
+    if ARCHIVE_CACHE_DIRECTORY else None
+
+# Alerts are delivered in the background, the ones left when the collector quits are delivered before it exits
+ALERT_DISPATCHER = AlertDispatcher(lambda message: deliver_notification(message), ALERT_INTERVAL)
+atexit.register(ALERT_DISPATCHER.close, timeout=60)
+
+# Decoded checkpoints are saved with all of their transactions, so operations of any table can be extracted from them.
+# The checkpoints of every network in NETWORKS_FILE are saved to a directory of its own, by the network's name.
+DECODED_CHECKPOINTS = {network.name: DecodedCheckpoints(os.path.join(DECODED_CHECKPOINTS_DIRECTORY, network.name or ''))
+                       for network in NETWORKS} if DECODED_CHECKPOINTS_DIRECTORY else None
+
+# Every checkpoint is made of these files, all of them are downloaded together
+CHECKPOINT_FILE_TYPES = ('ledger', 'transactions', 'results')
+# The archive's state file, pointing to its last published checkpoint
+HISTORY_STATE_FILE = '.well-known/stellar-history.json'
+# Seconds to wait before downloading a missing file again, the backoff grows from the minimal to the maximal interval
+MISSING_FILE_MIN_RETRY_INTERVAL = 5
+MISSING_FILE_MAX_RETRY_INTERVAL = 60
+
+# Clients of a worker process ingesting single checkpoints by network name, created on the first checkpoint it ingests
+worker_clients = {}
+# Connections of the alert dispatcher's thread, reused by all the alerts it sends
+smtp_server = None
+lambda_client = None
+
+
+def setup_s3(networks_count=1):
+    """
+    Set up the s3 client with anonymous connection.
 
-def setup_s3():
-    """Set up the s3 client with anonymous connection."""
-    s3 = boto3.client('s3', config=Config(signature_version=UNSIGNED))
+    The client is shared by all the download workers of all the networks, so its connection pool is sized to let every
+    file of every prefetched checkpoint download at the same time over a kept-alive connection.
+    """
+    # Clients and their dependencies are imported when they are set up, so a process imports only the ones it uses
+    import boto3
+    from botocore import UNSIGNED
+    from botocore.client import Config
+
+    config = Config(signature_version=UNSIGNED,
+                    max_pool_connections=len(CHECKPOINT_FILE_TYPES) * (get_prefetch_depth(networks_count) + 1) *
+                    networks_count,
+                    connect_timeout=S3_CONNECT_TIMEOUT,
+                    read_timeout=S3_READ_TIMEOUT)
+    s3 = boto3.client('s3', config=config)
     logging.info('Successfully initialized S3 client')
     return s3
 
 
+def setup_archive_source(network, s3=None):
+    """
+    Set up the source of the archive files of a network, by the scheme of its archive URL.
+
+    :param s3: An s3 client shared by the networks, a client of its own is set up if None
+    """
+    archive_url = network.archive_url
+    scheme = urllib.parse.urlparse(archive_url).scheme
+    if scheme == 's3':
+        return S3ArchiveSource(archive_url, s3 if s3 is not None else setup_s3(), DOWNLOAD_SPOOL_SIZE)
+    if scheme in ('http', 'https'):
+        return HttpArchiveSource(archive_url, S3_READ_TIMEOUT, DOWNLOAD_SPOOL_SIZE)
+    if scheme == 'file':
+        return LocalArchiveSource(archive_url)
+
+    raise ValueError('Unsupported archive URL: {}'.format(archive_url))
+
+
 def setup_postgres():
     """Set up a connection to the postgres database using the user 'python'."""
+    import psycopg2
+
     conn = psycopg2.connect("postgresql://python:{}@{}:5432/kin".format(PYTHON_PASSWORD, POSTGRES_HOST))
     logging.info('Successfully connected to the database')
     return conn
 
 
-def download_file(s3, file_name):
-    """Download the files from the s3 bucket."""
+def download_file(archive_source, file_name):
+    """
+    Download a file from the archive, or read it from the archive cache if it is enabled.
+
+    Files of s3 and http archives are kept in memory, unless they are larger than DOWNLOAD_SPOOL_SIZE.
+    :return: A binary file object of the gzipped file, positioned at its start
+    """
     # File transactions-004c93bf.xdr.gz will be in:
-    # BUCKET_NAME/CORE_DIRECTORY/transactions/00/4c/93/
+    # <archive url>/transactions/00/4c/93/
 
     # "ledger-004c93bf" > "00/4c/93/"
     file_number = file_name.split('-')[-1]
@@ -84,25 +240,191 @@ def download_file(s3, file_name):
     sub_directory = sub_directory[:9]
 
     sub_directory = file_name.split('-')[0] + '/' + sub_directory
+    path = sub_directory + file_name + '.xdr.gz'
+
+    if ARCHIVE_CACHE is not None:
+        file_object = ARCHIVE_CACHE.get(archive_source.get_url(path))
+        if file_object is not None:
+            logging.info('File {} read from the archive cache'.format(file_name))
+            return file_object
 
     for attempt in range(MAX_RETRIES + 1):
         try:
             logging.info('Trying to download file {}.xdr.gz'.format(file_name))
-            s3.download_file(BUCKET_NAME, CORE_DIRECTORY + sub_directory + file_name + '.xdr.gz', file_name + '.xdr.gz')
+            file_object = archive_source.open(path)
             logging.info('File {} downloaded'.format(file_name))
-            break
-        except ClientError as e:
-
+            if ARCHIVE_CACHE is not None:
+                __cache_file(archive_source.get_url(path), file_object)
+            return file_object
+        except ArchiveFileError as e:
             # If you failed to get the file more than MAX_RETRIES times: raise the exception
             if attempt == MAX_RETRIES:
                 logging.error('Reached retry limit when downloading file {}, raising exception.'.format(file_name))
                 raise
 
-            # If I get a 404, it might mean that the file does not exist yet, so I will try again in 3 minutes
-            error_code = int(e.response['Error']['Code'])
-            if error_code == 404:
-                logging.warning('404, could not get file {}, retrying in 3 minutes'.format(file_name))
-                time.sleep(180)
+            # If the file is missing, it might not be fully published yet, so I will try again shortly
+            if isinstance(e, MissingArchiveFileError):
+                retry_interval = jittered_backoff(attempt, MISSING_FILE_MIN_RETRY_INTERVAL,
+                                                  MISSING_FILE_MAX_RETRY_INTERVAL)
+                logging.warning('404, could not get file {}, retrying in {:.0f} seconds'.format(
+                    file_name, retry_interval))
+                time.sleep(retry_interval)
+
+
+def __cache_file(archive_path, file_object):
+    """Save a downloaded file to the archive cache, a file that can not be saved is only downloaded again."""
+    try:
+        ARCHIVE_CACHE.put(archive_path, file_object)
+    except OSError as e:
+        logging.warning('Could not save file {} to the archive cache: {}'.format(archive_path, e))
+
+
+def download_checkpoint(archive_source, download_executor, file_sequence):
+    """
+    Download all the files of a checkpoint concurrently.
+
+    :return: A dictionary of file type and the file object of the downloaded file
+    """
+    futures = {file_type: download_executor.submit(download_file, archive_source,
+                                                   '{}-{}'.format(file_type, file_sequence))
+               for file_type in CHECKPOINT_FILE_TYPES}
+
+    try:
+        return {file_type: future.result() for file_type, future in futures.items()}
+    except Exception:
+        # Release the files that were downloaded before failing
+        for future in futures.values():
+            if not future.cancel() and future.exception() is None:
+                future.result().close()
+        raise
+
+
+def fetch_checkpoint(network, archive_source, download_executor, file_sequence, adapter_class, tip_scheduler=None,
+                     decode_executor=None, concurrency_controller=None):
+    """
+    Download the files of a checkpoint of a network and extract the operations to write from them.
+
+    :param adapter_class: The class of the storage adapter, used to convert the operations
+    :param tip_scheduler: When following the archive tip, used to wait for the checkpoint to be published
+    :param decode_executor: A process pool to decode the files on, if None they are decoded on the calling thread
+    :param concurrency_controller: Told how long the download and the decoding took, and the size of the checkpoint
+    :return: An OperationsSpool of the chunks of operations
+    """
+    if tip_scheduler is not None:
+        # The checkpoint file is named after its last ledger
+        tip_scheduler.wait_for_ledger(int(file_sequence, 16))
+
+    if REPROCESS_DECODED_CHECKPOINTS and DECODED_CHECKPOINTS is not None and \
+            DECODED_CHECKPOINTS[network.name].contains(file_sequence):
+        # Nothing to download nor decode, the operations are extracted from the saved checkpoint
+        logging.info('Reprocessing decoded checkpoint {}'.format(file_sequence))
+        files = None
+    else:
+        download_start = time.monotonic()
+        files = download_checkpoint(archive_source, download_executor, file_sequence)
+        if concurrency_controller is not None:
+            concurrency_controller.observe_stage(DOWNLOAD_STAGE, time.monotonic() - download_start)
+
+    files_size = 0 if files is None else sum(__get_file_size(file_object) for file_object in files.values())
+    decode_start = time.monotonic()
+    if decode_executor is None:
+        operations = OperationsSpool(tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE))
+        try:
+            ledgers_dictionary = decode_checkpoint(network, files, file_sequence, adapter_class,
+                                                   operations.file_object)
+        except Exception:
+            operations.close()
+            raise
+    else:
+        # Only the compressed files are sent to the worker, and the extracted operations are passed back in a file
+        files_contents = None
+        if files is not None:
+            try:
+                files_contents = {file_type: io.BytesIO(file_object.read())
+                                  for file_type, file_object in files.items()}
+            finally:
+                for file_object in files.values():
+                    file_object.close()
+        ledgers_dictionary, operations_file_name = decode_executor.submit(
+            decode_checkpoint_to_file, network.name, files_contents, file_sequence, adapter_class).result()
+        operations = OperationsSpool.from_file_name(operations_file_name)
+
+    if concurrency_controller is not None:
+        concurrency_controller.observe_stage(DECODE_STAGE, time.monotonic() - decode_start)
+        concurrency_controller.observe_checkpoint_size(files_size + __get_file_size(operations.file_object))
+
+    if tip_scheduler is not None:
+        tip_scheduler.observe_ledgers(ledgers_dictionary)
+
+    return operations
+
+
+def __get_file_size(file_object):
+    """Get the number of bytes of a file object, kept in memory unless it is larger than DOWNLOAD_SPOOL_SIZE."""
+    position = file_object.tell()
+    file_object.seek(0, io.SEEK_END)
+    size = file_object.tell()
+    file_object.seek(position)
+    return min(size, DOWNLOAD_SPOOL_SIZE)
+
+
+def decode_checkpoint_to_file(network_name, files, file_sequence, adapter_class):
+    """
+    Decode the files of a checkpoint into a temporary file of its operations, runs in a decode worker process.
+
+    :param network_name: Name of the checkpoint's network, the worker has the same networks
+    :return: The checkpoint's ledger:closeTime dictionary, and the name of the temporary file
+    """
+    operations_file = tempfile.NamedTemporaryFile(delete=False)
+    try:
+        with operations_file:
+            ledgers_dictionary = decode_checkpoint(NETWORKS_BY_NAME[network_name], files, file_sequence,
+                                                   adapter_class, operations_file)
+    except Exception:
+        os.remove(operations_file.name)
+        raise
+
+    return ledgers_dictionary, operations_file.name
+
+
+def decode_checkpoint(network, files, file_sequence, adapter_class, operations_file):
+    """
+    Decode the files of a checkpoint and write the chunks of operations extracted from them to a file.
+
+    :param files: A dictionary of file type and the file object of the downloaded file,
+      None to load the checkpoint from the decoded checkpoints instead
+    :param operations_file: A binary file object to write the chunks of operations to
+    :return: The checkpoint's ledger:closeTime dictionary
+    """
+    decoded_checkpoints = DECODED_CHECKPOINTS[network.name] if DECODED_CHECKPOINTS is not None else None
+    if files is None:
+        with decoded_checkpoints.load(file_sequence, VALIDATE_TRANSACTION_HASHES) as (ledgers_dictionary, ledgers):
+            write_chunks(operations_file, extract_operations(network, adapter_class, ledgers, ledgers_dictionary,
+                                                             SAVE_CHUNK_SIZE))
+        return ledgers_dictionary
+
+    with files['ledger'], files['transactions'], files['results']:
+        # Get a ledger:closeTime dictionary
+        ledgers_dictionary = get_ledgers_dictionary(xdr_decoder.parse(files['ledger'], 'ledger-' + file_sequence))
+
+        # Transactions and their results are decoded one ledger at a time, while their operations are extracted.
+        # Saved checkpoints keep all the transactions, so none are filtered before they are decoded.
+        transactions = xdr_decoder.XdrFile(files['transactions'], 'transactions-' + file_sequence,
+                                           with_hash=True, network_id=network.network_passphrase,
+                                           envelope_filter=network.transaction_filter
+                                           if decoded_checkpoints is None else None)
+        results = xdr_decoder.XdrFile(files['results'], 'results-' + file_sequence)
+        ledgers = merge_by_ledger(transactions, results, VALIDATE_TRANSACTION_HASHES)
+
+        if decoded_checkpoints is None:
+            write_chunks(operations_file, extract_operations(network, adapter_class, ledgers, ledgers_dictionary,
+                                                             SAVE_CHUNK_SIZE))
+        else:
+            with decoded_checkpoints.save(file_sequence, ledgers_dictionary, ledgers) as ledgers:
+                write_chunks(operations_file, extract_operations(network, adapter_class, ledgers, ledgers_dictionary,
+                                                                 SAVE_CHUNK_SIZE))
+
+    return ledgers_dictionary
 
 
 def get_ledgers_dictionary(ledgers):
@@ -110,96 +432,101 @@ def get_ledgers_dictionary(ledgers):
     return {ledger['header']['ledgerSeq']: ledger['header']['scpValue']['closeTime'] for ledger in ledgers}
 
 
-def get_result_dictionary(results):
-    """Get a dictionary of a transaction hash and its result"""
-    #return {result['txResultSet']['results'][0]['transactionHash']:
-    #        result['txResultSet']['results'][0]['result'] for result in results}
+def extract_operations(network, adapter_class, ledgers, ledgers_dictionary, chunk_size):
+    """
+    Extract the operations of the enabled operation handlers of a network.
 
-    results_dict = {}
-    for result in results:
-        for tx_result in result['txResultSet']['results']:
-            results_dict[tx_result['transactionHash']] = tx_result['result']
+    The operations of every ledger are first gathered into columns and selected with vectorized filters,
+    then only the selected operations are converted to rows.
 
-    return results_dict
+    :param ledgers: An iterable of transaction history entries and the LedgerResults of their ledger
+    :param chunk_size: Number of operations in every chunk, the last chunk might be smaller
+    :return: A generator of chunks of an app id, a table name and the rows of the table, the payments and creations
+      rows converted by the storage adapter class. The app id is None unless the network has app ids.
+    """
+    operation_handlers = network.operation_handlers
 
+    # Rows by table name, by the app id they are routed to
+    operations_by_app = {}
+    operations_count = 0
 
-def write_data(storage_adapter, transactions, ledgers_dictionary, results_dictionary, file_name):
-    """Filter payment/creation operations and write them to the storage."""
-    logging.info('Writing contents of file: {} to storage'.format(file_name))
+    for transaction_history_entry, ledger_results in ledgers:
+        # The columns of one ledger are selected at a time, so only the decoded transactions of a ledger are kept
+        operation_columns = OperationColumns(operation_handlers)
+        timestamp = ledgers_dictionary.get(transaction_history_entry['ledgerSeq'])
+        for transaction in transaction_history_entry['txSet']['txs']:
+            operation_columns.add_transaction(transaction, ledger_results, timestamp)
 
-    payments_operations_list = []
-    creations_operations_list = []
+        selected_operations, apps = operation_columns.select(network.kin_issuer, network.saved_app_ids)
+        tx_position = None
 
-    for transaction_history_entry in transactions:
-        timestamp = ledgers_dictionary.get(transaction_history_entry['ledgerSeq'])
+        for operation_position in selected_operations:
+            if operation_columns.tx_positions[operation_position] != tx_position:
+                tx_position = operation_columns.tx_positions[operation_position]
+                if operations_count >= chunk_size:
+                    yield from __get_operations_chunks(operations_by_app)
+                    operations_by_app = {}
+                    operations_count = 0
 
-        for transaction in transaction_history_entry['txSet']['txs']:
-            # Find the results of this tx based on its hash
-            results = results_dictionary.get(transaction['hash'])
-            memo = transaction['tx']['memo']['text']
-
-            # If the transaction is not from our app, skip it
-            if APP_ID is not None:
-                if APP_ID_REGEX.match(str(memo)) is not None:
-                    app = memo.split('-')[1]
-                    if app != APP_ID:
-                        continue
-                else:
-                    continue
-
-            tx_hash = transaction['hash']
-            tx_fee = transaction['tx']['fee']
-            tx_charged_fee = results['feeCharged']
-            tx_status = results['result']['code']  # txSUCCESS/FAILED/BAD_AUTH etc
-
-            for op_index, (tx_operation, result_operation) in enumerate(zip(transaction['tx']['operations'], results['result'].get('results', []))):
-
-                op_status = None
-
-                # Operation type 1 = Payment
-                if tx_operation['body']['type'] == 1:
-                    # Check if this is a payment for our asset
-                    if tx_operation['body']['paymentOp']['asset']['alphaNum4'] is not None and \
-                                    tx_operation['body']['paymentOp']['asset']['alphaNum4']['assetCode'] == 'KIN' and \
-                                    tx_operation['body']['paymentOp']['asset']['alphaNum4']['issuer']['ed25519'] == KIN_ISSUER:
-
-                        source = transaction['tx']['sourceAccount']['ed25519']
-                        destination = tx_operation['body']['paymentOp']['destination']['ed25519']
-                        amount = tx_operation['body']['paymentOp']['amount']
-                        if result_operation:
-                            op_status = result_operation['tr']['paymentResult']['code']
-
-                        # Override the tx source with the operation source if it exists
-                        try:
-                            source = tx_operation['sourceAccount'][0]['ed25519']
-                        except (KeyError, IndexError):
-                            pass
-
-                        payments_operations_list.append(
-                            storage_adapter.convert_payment(source, destination, amount, memo, tx_fee,
-                                                            tx_charged_fee, op_index, tx_status, op_status,
-                                                            tx_hash, timestamp))
-
-                # Operation type 0 = Create account
-                elif tx_operation['body']['type'] == 0:
-                    source = transaction['tx']['sourceAccount']['ed25519']
-                    destination = tx_operation['body']['createAccountOp']['destination']['ed25519']
-                    balance = tx_operation['body']['createAccountOp']['startingBalance']
-                    if result_operation:
-                        op_status = result_operation['tr']['createAccountResult']['code']
-
-                    # Override the tx source with the operation source if it exists
-                    try:
-                        source = tx_operation['sourceAccount'][0]['ed25519']
-                    except (KeyError, IndexError):
-                        pass
-
-                    creations_operations_list.append(
-                        storage_adapter.convert_creation(source, destination, balance, memo, tx_fee, tx_charged_fee,
-                                                         op_index, tx_status, op_status, tx_hash, timestamp))
+                transaction, ledger_results, timestamp = operation_columns.transactions[tx_position]
+
+                # Every one of the app ids has its own destination
+                app_id = str(apps[tx_position]) if network.app_ids else None
+                operations_by_table = operations_by_app.setdefault(app_id, {})
+
+                # Find the results of this tx, among the results of its ledger
+                tx_results = ledger_results.get(transaction)
+                operation_results = tx_results['result'].get('results', [])
+
+                transaction_fields = TransactionFields(
+                    memo=transaction['tx']['memo']['text'], tx_fee=transaction['tx']['fee'],
+                    tx_charged_fee=tx_results['feeCharged'],
+                    tx_status=tx_results['result']['code'],  # txSUCCESS/FAILED/BAD_AUTH etc
+                    tx_hash=transaction['hash'], timestamp=timestamp)
+
+            # Same as zipping the operations with their results, operations without a result are skipped
+            op_index = operation_columns.op_indices[operation_position]
+            if op_index >= len(operation_results):
+                continue
+            tx_operation = transaction['tx']['operations'][op_index]
+            operation_handler = operation_handlers[tx_operation['body']['type']]
+
+            # Override the tx source with the operation source if it exists
+            try:
+                source = tx_operation['sourceAccount'][0]['ed25519']
+            except (KeyError, IndexError):
+                source = transaction['tx']['sourceAccount']['ed25519']
+
+            row = operation_handler.extract(adapter_class, transaction_fields, source, tx_operation,
+                                            operation_results[op_index], op_index)
+            if row is not None:
+                operations_by_table.setdefault(operation_handler.table_name, []).append(row)
+                operations_count += 1
+
+    yield from __get_operations_chunks(operations_by_app)
+
+
+def __get_operations_chunks(operations_by_app):
+    """Get the chunks of the rows of every app and table."""
+    for app_id, operations_by_table in operations_by_app.items():
+        for table_name, rows in operations_by_table.items():
+            yield app_id, table_name, rows
+
+
+def write_data(storage_adapter, operations, file_name, advance_last_file=True):
+    """
+    Write the operations of a file to the storage.
+
+    :param operations: An iterable of chunks of an app id, a table name and the rows of the table
+    """
+    logging.info('Writing contents of file: {} to storage'.format(file_name))
+
+    if ACCOUNT_WATCHLIST is not None:
+        ACCOUNT_WATCHLIST.reload_if_changed()
+        operations = ACCOUNT_WATCHLIST.filter_chunks(operations)
 
     # Try saving data into storage as a single 'transaction'
-    storage_adapter.save(payments_operations_list, creations_operations_list, file_name)
+    storage_adapter.save_chunks(operations, file_name, advance_last_file)
 
 
 def get_new_file_sequence(old_file_name):
@@ -228,67 +555,321 @@ def get_new_file_sequence(old_file_name):
     return new_file_name
 
 
+def get_archive_current_ledger(archive_source):
+    """Get the last ledger published to the archive, from the archive's state file."""
+    with archive_source.open(HISTORY_STATE_FILE) as state_file:
+        return json.loads(state_file.read().decode('utf-8'))['currentLedger']
+
+
+def get_archive_tip_sequence(archive_source):
+    """Get the sequence of the last checkpoint file published to the archive."""
+    current_ledger = get_archive_current_ledger(archive_source)
+
+    # Checkpoint files are named after their last ledger, which is one before a multiple of 64
+    return '{:08x}'.format((current_ledger + 1) // backfill.CHECKPOINT_FREQUENCY * backfill.CHECKPOINT_FREQUENCY - 1)
+
+
+def get_network(network_name=None):
+    """Get a network by its name, the first network if None."""
+    if network_name is None:
+        return NETWORKS[0]
+
+    if network_name not in NETWORKS_BY_NAME:
+        raise ValueError('There is no network named {}'.format(network_name))
+    return NETWORKS_BY_NAME[network_name]
+
+
+def ingest_checkpoint(file_sequence, network_name=None):
+    """
+    Ingest a single checkpoint without advancing the last file, runs in a backfill or a batch worker process.
+
+    :param network_name: Name of the checkpoint's network, the first network if None
+    :return: True if the checkpoint was saved, False if it was saved before
+    """
+    network = get_network(network_name)
+    if network.name not in worker_clients:
+        worker_clients[network.name] = (get_storage_adapter(network), setup_archive_source(network),
+                                        ThreadPoolExecutor(max_workers=len(CHECKPOINT_FILE_TYPES)))
+    storage_adapter, archive_source, download_executor = worker_clients[network.name]
+
+    # Checkpoints saved before an interruption, or by an earlier attempt, are skipped
+    if is_checkpoint_saved(network, storage_adapter, file_sequence):
+        return False
+
+    with fetch_checkpoint(network, archive_source, download_executor, file_sequence,
+                          type(storage_adapter)) as operations:
+        write_data(storage_adapter, operations, file_sequence, advance_last_file=False)
+    return True
+
+
+def is_checkpoint_saved(network, storage_adapter, file_sequence):
+    """
+    Check if a checkpoint of a network was saved, up to the last file or out of order ahead of it.
+
+    Files up to the last file are no longer marked as saved, so they are compared with the last file.
+    """
+    last_file = storage_adapter.get_last_file_sequence()
+    # The last file is the first file to save until the first file is saved
+    if last_file is not None and (file_sequence < last_file or
+                                  (file_sequence == last_file and last_file != network.first_file)):
+        return True
+
+    return storage_adapter.is_file_saved(file_sequence)
+
+
+def ingest_shard(first_sequence, count, network_name=None):
+    """
+    Ingest consecutive checkpoints without advancing the last file, runs in a backfill worker process.
+
+    :return: Number of checkpoints saved, the others were saved before
+    """
+    saved = 0
+    file_sequence = first_sequence
+    for _ in range(count):
+        saved += ingest_checkpoint(file_sequence, network_name)
+        file_sequence = get_new_file_sequence(file_sequence)
+
+    return saved
+
+
+def backfill_to_tip(network, storage_adapter, archive_source, file_sequence):
+    """
+    Ingest the checkpoints of a network from file_sequence up to the archive tip on BACKFILL_WORKERS processes.
+
+    Stops once less than a shard of checkpoints is left, so the follower can continue from there.
+    :return: The sequence of the next file to ingest
+    """
+    with ProcessPoolExecutor(max_workers=BACKFILL_WORKERS) as pool:
+        while True:
+            tip_sequence = get_archive_tip_sequence(archive_source)
+            shards = backfill.split_to_shards(file_sequence, tip_sequence, BACKFILL_SHARD_SIZE)
+            if len(shards) <= 1:
+                logging.info('Backfill reached the archive tip at file {}'.format(tip_sequence))
+                return file_sequence
+
+            logging.info('Backfilling files {} to {} in {} shards'.format(file_sequence, tip_sequence, len(shards)))
+            backfill.ingest_shards(pool, functools.partial(ingest_shard, network_name=network.name), shards,
+                                   storage_adapter.update_last_file_sequence,
+                                   max_pending=BACKFILL_WORKERS * 2, max_retries=MAX_RETRIES)
+            file_sequence = get_new_file_sequence(shards[-1].last_sequence)
+
+
+def backfill_claimed_to_tip(network, storage_adapter, archive_source):
+    """
+    Ingest the checkpoints of a network up to the archive tip on BACKFILL_WORKERS processes, with the other
+    collectors sharing the storage.
+
+    Stops once less than a shard of checkpoints is left. If the collector follows the archive, it also waits for the
+    shards claimed by the other collectors, so it does not save their checkpoints again.
+    :return: The sequence of the next file to ingest
+    """
+    shard_claims = backfill.ShardClaims(storage_adapter, '{}-{}'.format(socket.gethostname(), os.getpid()),
+                                        CLAIM_LEASE_TIME, BACKFILL_SHARD_SIZE)
+
+    with ProcessPoolExecutor(max_workers=BACKFILL_WORKERS) as pool:
+        while True:
+            # The last file is advanced by all the collectors
+            file_sequence = get_next_file_sequence(network, storage_adapter)
+            tip_sequence = get_archive_tip_sequence(archive_source)
+            shards = backfill.split_to_shards(file_sequence, tip_sequence, BACKFILL_SHARD_SIZE, aligned=True)
+            if len(shards) <= 1:
+                if not (FOLLOW_ARCHIVE and storage_adapter.has_file_claims()):
+                    logging.info('Backfill reached the archive tip at file {}'.format(tip_sequence))
+                    return file_sequence
+
+                logging.info('Waiting for the shards claimed by other collectors')
+                time.sleep(shard_claims.renew_interval)
+                continue
+
+            logging.info('Backfilling files {} to {} in {} shards'.format(file_sequence, tip_sequence, len(shards)))
+            saved = backfill.ingest_claimed_shards(
+                pool, functools.partial(ingest_shard, network_name=network.name), shards, shard_claims,
+                lambda: storage_adapter.advance_last_file_sequence(network.first_file, get_new_file_sequence),
+                max_pending=BACKFILL_WORKERS * 2, max_retries=MAX_RETRIES)
+            if not saved:
+                # The last file waits for shards that are still ingested
+                logging.info('The shards are claimed or saved by other collectors, waiting for them')
+                time.sleep(shard_claims.renew_interval)
+
+
+def get_next_file_sequence(network, storage_adapter):
+    """Get the sequence of the next file of a network to ingest, after the last file saved to its storage."""
+    file_sequence = storage_adapter.get_last_file_sequence()
+    if file_sequence != network.first_file:
+        # If restarted, getting next file in sequence as the last one was ingested
+        file_sequence = get_new_file_sequence(file_sequence)
+
+    return file_sequence
+
+
 def main():
     """Main entry point."""
     # Initialize everything
-    logging.basicConfig(level=LOG_LEVEL, format='%(asctime)s | %(levelname)s | %(message)s')
-    if APP_ID is not None:
-        if re.match('^[A-z0-9]{4}$', APP_ID) is None:
-            logging.error('APP ID is invalid')
+    log_format = '%(asctime)s | %(levelname)s | %(threadName)s | %(message)s' if NETWORKS_FILE else \
+        '%(asctime)s | %(levelname)s | %(message)s'
+    logging.basicConfig(level=LOG_LEVEL, format=log_format)
+
+    for network in NETWORKS:
+        network_description = 'network {}'.format(network.name) if network.name else 'the archive'
+        if not network.first_file:
+            logging.error('FIRST_FILE is required to follow {}'.format(network_description))
             sys.exit(1)
 
+        if network.app_id is not None and network.app_ids:
+            logging.error('Only one of APP_ID and APP_IDS can be set, for {}'.format(network_description))
+            sys.exit(1)
+
+        for app_id in network.saved_app_ids or ():
+            if re.match('^[A-z0-9]{4}$', app_id) is None:
+                logging.error('APP ID {} is invalid'.format(app_id))
+                sys.exit(1)
+
     # Validating email alert if necessary
     if EMAIL_SMTP:
         __email_validation()
 
-    storage_adapter = get_storage_adapter()
+    # Fail on start, rather than on the first file, if the watchlist can not be loaded
+    if ACCOUNT_WATCHLIST is not None:
+        ACCOUNT_WATCHLIST.reload_if_changed()
+
+    # The networks whose archives are on s3 share a client, and its connection pool
+    s3 = None
+    if any(urllib.parse.urlparse(network.archive_url).scheme == 's3' for network in NETWORKS):
+        s3 = setup_s3(len(NETWORKS))
+
+    followers = []
+    for network in NETWORKS:
+        storage_adapter = get_storage_adapter(network)
+        file_sequence = get_next_file_sequence(network, storage_adapter)
+        archive_source = setup_archive_source(network, s3)
+
+        if BACKFILL_WORKERS:
+            # Catching up with the archives in parallel, one network at a time, before starting any thread
+            try:
+                if BACKFILL_CLAIMS:
+                    file_sequence = backfill_claimed_to_tip(network, storage_adapter, archive_source)
+                else:
+                    file_sequence = backfill_to_tip(network, storage_adapter, archive_source, file_sequence)
+            except Exception:
+                logging.error('Backfill failed. Quitting.')
+                send_notification(traceback.format_exc(), network)
+                raise
 
-    file_sequence = storage_adapter.get_last_file_sequence()
-    if file_sequence != FIRST_FILE:
-        # If restarted, getting next file in sequence as the last one was ingested
-        file_sequence = get_new_file_sequence(file_sequence)
-    s3 = setup_s3()
+        followers.append((network, storage_adapter, archive_source, file_sequence))
+
+    if not FOLLOW_ARCHIVE:
+        logging.info('Not following the archive, quitting')
+        return
+
+    decode_executor = None
+    if DECODE_WORKERS:
+        # All the worker processes are forked before any thread is started. Python 3.6 (of the Dockerfile) starts them
+        # all on the first task, newer versions start a worker for a task only when none is idle, so every worker is
+        # given a task that keeps it busy until all of them are started.
+        decode_executor = ProcessPoolExecutor(max_workers=DECODE_WORKERS)
+        warm_up_tasks = [decode_executor.submit(time.sleep, DECODE_WORKERS_WARM_UP_TIME) for _ in range(DECODE_WORKERS)]
+        for warm_up_task in warm_up_tasks:
+            warm_up_task.result()
+
+    # Shared by all the networks, so every network can download its prefetched checkpoints at the same time
+    download_executor = ThreadPoolExecutor(
+        max_workers=len(CHECKPOINT_FILE_TYPES) * (get_prefetch_depth(len(followers)) + 1) * len(followers))
+
+    if len(followers) == 1:
+        follow_archive(*followers[0], download_executor=download_executor, decode_executor=decode_executor)
+    else:
+        follow_archives(followers, download_executor, decode_executor)
+
+
+def follow_archives(followers, download_executor, decode_executor):
+    """
+    Follow the archives of several networks concurrently, every network on a thread of its own.
+
+    :param followers: A list of the network, its storage adapter, archive source and the next file to ingest
+    :raise: The error of the first network that failed, the collector quits without following the others
+    """
+    failures = queue.Queue()
+
+    def follow(network, storage_adapter, archive_source, file_sequence):
+        try:
+            follow_archive(network, storage_adapter, archive_source, file_sequence, download_executor,
+                           decode_executor, len(followers))
+        except BaseException as e:
+            failures.put(e)
+
+    for follower in followers:
+        logging.info('Following network {}'.format(follower[0].name))
+        threading.Thread(target=follow, args=follower, name=follower[0].name, daemon=True).start()
+
+    raise failures.get()
+
+
+def get_prefetch_depth(networks_count=1):
+    """
+    Get the maximal prefetch depth of every network, so the networks followed together fetch as many files ahead as
+    a single network would.
+    """
+    return PREFETCH_DEPTH // networks_count
+
+
+def follow_archive(network, storage_adapter, archive_source, file_sequence, download_executor, decode_executor,
+                   networks_count=1):
+    """
+    Ingest the checkpoints of a network from file_sequence on, file by file, as they are published to its archive.
+
+    Only returns by raising the error of a file that could not be ingested after MAX_RETRIES attempts.
+    :param networks_count: Number of networks followed together, which split the prefetch depth and memory budget
+    """
+    # Checkpoints that are not published yet are waited for, instead of failing to download them
+    tip_scheduler = TipScheduler(lambda: get_archive_current_ledger(archive_source))
+
+    # Upcoming checkpoints are downloaded and unpacked in the background while the current one is written,
+    # as many of them as the writes need while catching up with the archive, within the CPU and memory budgets
+    prefetch_depth = get_prefetch_depth(networks_count)
+    concurrency_controller = ConcurrencyController(prefetch_depth, DECODE_WORKERS,
+                                                   PREFETCH_MEMORY_BUDGET // networks_count)
+    prefetcher = CheckpointPrefetcher(
+        lambda sequence: fetch_checkpoint(network, archive_source, download_executor, sequence,
+                                          type(storage_adapter), tip_scheduler, decode_executor,
+                                          concurrency_controller),
+        get_new_file_sequence, prefetch_depth)
 
     consecutive_failed_attempts = 0
 
     while True:
 
         try:
-            # Download the files from S3
-            download_file(s3, 'ledger-' + file_sequence)
-            download_file(s3, 'transactions-' + file_sequence)
-            download_file(s3, 'results-' + file_sequence)
-
-            # Unpack the files
-            results = parser.parse('results-{}.xdr.gz'.format(file_sequence))
-            ledgers = parser.parse('ledger-{}.xdr.gz'.format(file_sequence))
-            transactions = parser.parse('transactions-{}.xdr.gz'.format(file_sequence),
-                                        with_hash=True, network_id=NETWORK_PASSPHARSE)
-
-            # Get a ledger:closeTime dictionary
-            ledgers_dictionary = get_ledgers_dictionary(ledgers)
-            # Get a txHash:txResult dictionary
-            results_dictionary = get_result_dictionary(results)
-
-            # Remove the files from storage
-            logging.info('Removing downloaded files.')
-            os.remove('ledger-{}.xdr.gz'.format(file_sequence))
-            os.remove('transactions-{}.xdr.gz'.format(file_sequence))
-            os.remove('results-{}.xdr.gz'.format(file_sequence))
-
-            # Write the data to storage
-            write_data(storage_adapter, transactions, ledgers_dictionary, results_dictionary, file_sequence)
+            if storage_adapter.is_file_saved(file_sequence):
+                # Saved ahead of the last file by an interrupted backfill
+                logging.info('File {} was already saved'.format(file_sequence))
+                storage_adapter.update_last_file_sequence(file_sequence)
+            else:
+                published_ledger = tip_scheduler.get_published_ledger()
+                concurrency_controller.observe_lag(
+                    None if published_ledger is None else
+                    (published_ledger - int(file_sequence, 16)) // backfill.CHECKPOINT_FREQUENCY)
+                prefetcher.set_depth(concurrency_controller.get_depth())
+
+                # Get the downloaded and unpacked checkpoint, in sequence order
+                operations = prefetcher.get(file_sequence)
+
+                # Write the data to storage, the operations are kept until then in case writing is retried
+                write_start = time.monotonic()
+                write_data(storage_adapter, operations, file_sequence)
+                concurrency_controller.observe_stage(WRITE_STAGE, time.monotonic() - write_start)
+                concurrency_controller.observe_stage(COMMIT_STAGE, storage_adapter.last_commit_time)
+                operations.close()
 
             # Get the name of the next file I should work on
             file_sequence = get_new_file_sequence(file_sequence)
             consecutive_failed_attempts = 0
 
-        except ClientError:
+        except (ArchiveFileError, ClientError):
             # Avoiding failing the process, only sending notification on 1st occurrence
             if consecutive_failed_attempts == 0:
                 # Sending notification only if there is a new delay
                 send_notification("Reached retry limit when downloading the next ledger: {}\n".format(file_sequence) +
-                                  "There might be a delay in the blockchain archiving bucket.")
+                                  "There might be a delay in the blockchain archiving bucket.", network)
                 consecutive_failed_attempts += 1
             continue
 
@@ -301,7 +882,11 @@ def main():
             if consecutive_failed_attempts > MAX_RETRIES:
 
                 logging.error('Reached retry limit. Quitting.')
-                send_notification(traceback.format_exc())
+                send_notification(traceback.format_exc(), network)
+                prefetcher.shutdown()
+                download_executor.shutdown(wait=False)
+                if decode_executor is not None:
+                    decode_executor.shutdown(wait=False)
                 raise
 
             logging.info('Retrying in 3 minutes')
@@ -310,22 +895,35 @@ def main():
 
 
 def send_email_alert(error_msg):
+    global smtp_server
 
-    context = ssl.create_default_context()
     recipients = EMAIL_RECIPIENTS if isinstance(EMAIL_RECIPIENTS, list) else __convert_recipients_to_list(EMAIL_RECIPIENTS)
-    with smtplib.SMTP_SSL(EMAIL_SMTP, SSL_PORT, context=context) as server:
 
-        server.login(user=EMAIL_ACCOUNT, password=EMAIL_PASSWORD)
+    # Preparing mail message
+    body = "Exception occurred while trying to parse blockchain history from the {archive} archive:\n\n" \
+           "{error_msg}".format(archive=', '.join(network.archive_url for network in NETWORKS), error_msg=error_msg)
 
-        # Preparing mail message
-        body = "Exception occurred while trying to parse blockchain history from {bucket} S3 bucket:\n\n" \
-               "{error_msg}".format(bucket=BUCKET_NAME, error_msg=error_msg)
+    message = 'From: {sender}\nTo: {recipients}\nSubject: {subject}\n\n{body}'.\
+        format(sender=EMAIL_ACCOUNT, recipients=', '.join(recipients),
+               subject='Alert! History Collector exception', body=body)
 
-        message = 'From: {sender}\nTo: {recipients}\nSubject: {subject}\n\n{body}'.\
-            format(sender=EMAIL_ACCOUNT, recipients=', '.join(recipients),
-                   subject='Alert! History Collector exception', body=body)
+    if smtp_server is not None:
+        try:
+            smtp_server.sendmail(EMAIL_ACCOUNT, recipients, message)
+            return
+        except smtplib.SMTPServerDisconnected:
+            # Idle connections are closed by the server, connecting again
+            smtp_server = None
 
+    context = ssl.create_default_context()
+    server = smtplib.SMTP_SSL(EMAIL_SMTP, SSL_PORT, context=context)
+    try:
+        server.login(user=EMAIL_ACCOUNT, password=EMAIL_PASSWORD)
         server.sendmail(EMAIL_ACCOUNT, recipients, message)
+    except BaseException:
+        server.close()
+        raise
+    smtp_server = server
 
 
 def __convert_recipients_to_list(recipients_str):
@@ -335,8 +933,11 @@ def __convert_recipients_to_list(recipients_str):
 
 
 def invoke_lambda(args):
+    global lambda_client
+    if lambda_client is None:
+        import boto3
+        lambda_client = boto3.client('lambda', LAMBDA_REGION)
 
-    lambda_client = boto3.client('lambda', LAMBDA_REGION)
     lambda_client.invoke(FunctionName=LAMBDA_NAME, Payload=json.dumps(args))
 
 
@@ -356,7 +957,19 @@ def __email_validation():
         sys.exit(1)
 
 
-def send_notification(notification_message):
+def send_notification(notification_message, network=None):
+    """
+    Queue an alert, it is delivered by the alert dispatcher without blocking the collector.
+
+    :param network: The network the alert is about, named in the alert if it is one of the networks in NETWORKS_FILE
+    """
+    if network is not None and network.name is not None:
+        notification_message = 'Network {}: {}'.format(network.name, notification_message)
+    ALERT_DISPATCHER.send(notification_message)
+
+
+def deliver_notification(notification_message):
+    """Deliver alerts by email and lambda, runs on the alert dispatcher's thread."""
     if EMAIL_SMTP:
         send_email_alert(notification_message)
         logging.error('Error occurred, alert email sent')
@@ -366,24 +979,28 @@ def send_notification(notification_message):
         logging.error('Error occurred, lambda invoked')
 
 
-def get_storage_adapter():
+def get_storage_adapter(network):
     """
-    This function generates an instance of the right storage adapter according the docker-compose file.
+    This function generates an instance of the right storage adapter according to the network's configuration.
     It will also raise exception if configuration for both/none of the storage adapters were supplied.
     Only one supported.
     :return: An instance of the relevant storage adapter
     """
     # Validating supplied configuration
-    if POSTGRES_HOST and S3_STORAGE_BUCKET:
+    if network.postgres_host and network.s3_storage_bucket:
         raise ValueError('Only one storage method is supported')
 
     storage_adapter = None
 
-    if S3_STORAGE_BUCKET:
-        storage_adapter = S3StorageAdapter(S3_STORAGE_BUCKET, S3_STORAGE_KEY_PREFIX,
-                                           S3_STORAGE_AWS_ACCESS_KEY, S3_STORAGE_AWS_SECRET_KEY, S3_STORAGE_REGION)
-    elif POSTGRES_HOST:
-        storage_adapter = PostgresStorageAdapter(POSTGRES_HOST, PYTHON_PASSWORD)
+    if network.s3_storage_bucket:
+        from adapters.s3_storage_adapter import S3StorageAdapter
+        storage_adapter = S3StorageAdapter(network.s3_storage_bucket, network.s3_storage_key_prefix,
+                                           network.s3_storage_aws_access_key, network.s3_storage_aws_secret_key,
+                                           network.s3_storage_region)
+    elif network.postgres_host:
+        from adapters.postgres_storage_adapter import PostgresStorageAdapter
+        storage_adapter = PostgresStorageAdapter(network.postgres_host, network.python_password,
+                                                 network.postgres_database)
     else:
         raise Exception('No storage method supplied')
 
@@ -0,0 +1,96 @@
+"""
+The networks a collector follows, every network with its own archive and storage.
+
+Networks are configured in a JSON file of a list of networks, for example:
+    [{"name": "mainnet", "archive_url": "s3://bucket/core", "postgres_host": "mainnet-db", "first_file": "0000003f"},
+     {"name": "testnet", "archive_url": "https://history.testnet.example/core", "kin_issuer": "GBC3...",
+      "network_passphrase": "Kin Testnet ; December 2018", "postgres_host": "testnet-db", "first_file": "0000003f"}]
+Settings a network does not set are the collector's, given by the environment variables of the same name.
+A network that sets its storage does not take the collector's, so networks can be saved to postgres and to s3.
+"""
+
+import json
+from operation_handlers import get_operation_handlers
+from transaction_filter import TransactionFilter
+
+# The settings choosing the storage of a network, only one of them is set
+STORAGE_SETTINGS = ('postgres_host', 's3_storage_bucket')
+
+
+class Network:
+    """The settings of a network, and the handlers and filter of the operations saved from its archive."""
+
+    def __init__(self, name, kin_issuer, network_passphrase, archive_url, first_file='', app_id=None, app_ids=(),
+                 operation_tables=('payments', 'creations'), postgres_host='', postgres_database='kin',
+                 python_password='', s3_storage_bucket='', s3_storage_key_prefix='', s3_storage_aws_access_key='',
+                 s3_storage_aws_secret_key='', s3_storage_region=''):
+        """
+        :param name: Name of the network, None for the single network of a collector configured without a file
+        :param app_id: Only save the transactions of this app
+        :param app_ids: Save the transactions of every one of these apps to destinations of its own, instead of app_id
+        """
+        if not kin_issuer or not network_passphrase:
+            raise ValueError('Network {} has no kin_issuer or network_passphrase'.format(name))
+
+        self.name = name
+        self.kin_issuer = kin_issuer
+        self.network_passphrase = network_passphrase
+        self.archive_url = archive_url
+        self.first_file = first_file
+        self.app_id = app_id
+        self.app_ids = list(app_ids)
+        self.operation_tables = list(operation_tables)
+        self.postgres_host = postgres_host
+        self.postgres_database = postgres_database
+        self.python_password = python_password
+        self.s3_storage_bucket = s3_storage_bucket
+        self.s3_storage_key_prefix = s3_storage_key_prefix
+        self.s3_storage_aws_access_key = s3_storage_aws_access_key
+        self.s3_storage_aws_secret_key = s3_storage_aws_secret_key
+        self.s3_storage_region = s3_storage_region
+
+        # The apps whose transactions are saved, all apps if None
+        if self.app_ids:
+            self.saved_app_ids = frozenset(self.app_ids)
+        elif app_id is not None:
+            self.saved_app_ids = frozenset([app_id])
+        else:
+            self.saved_app_ids = None
+
+        # The handlers extracting the operations of every saved table, by the operation type they handle
+        self.operation_handlers = get_operation_handlers(self.operation_tables, kin_issuer)
+
+        # Drops the transactions that would be skipped, before they are decoded
+        self.transaction_filter = TransactionFilter(self.operation_handlers, self.saved_app_ids)
+
+
+def load_networks(file_name, defaults):
+    """
+    Load the networks of a configuration file.
+
+    :param defaults: A dictionary of the settings of the networks that do not set them
+    :return: A list of the networks, by their order in the file
+    """
+    with open(file_name) as networks_file:
+        settings = json.load(networks_file)
+
+    networks = []
+    for network_settings in settings:
+        if not network_settings.get('name'):
+            raise ValueError('Every network in {} needs a name'.format(file_name))
+        network_defaults = defaults
+        if any(network_settings.get(setting) for setting in STORAGE_SETTINGS):
+            network_defaults = {setting: value for setting, value in defaults.items()
+                                if setting not in STORAGE_SETTINGS}
+        try:
+            networks.append(Network(**dict(network_defaults, **network_settings)))
+        except TypeError as e:
+            raise ValueError('Invalid settings of network {}: {}'.format(network_settings['name'], e)) from e
+
+    names = [network.name for network in networks]
+    if not networks:
+        raise ValueError('There are no networks in {}'.format(file_name))
+    if len(set(names)) != len(names):
+        raise ValueError('The networks in {} must have unique names'.format(file_name))
+
+    return networks
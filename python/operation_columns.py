@@ -0,0 +1,113 @@
+"""
+Select the operations of a checkpoint to save, with vectorized masks over columns of their values.
+
+The values the filters compare - operation type, asset codes and issuers, and the memo's app id - are gathered
+once into columns for all the decoded operations of a ledger, then compared with numpy at once.
+Rows are only built by the operation handlers for the selected operations.
+"""
+
+import numpy
+from operation_handlers import KIN_ASSET_CODE
+
+# Memos of apps are '1-<app id>-anything', only the first characters are compared
+APP_ID_SIZE = 4
+APP_MEMO_PREFIX_LENGTH = APP_ID_SIZE + 3
+
+
+class OperationColumns:
+    """The decoded transactions of a ledger, and the columns of their operations."""
+
+    def __init__(self, operation_handlers):
+        """
+        :param operation_handlers: The enabled operation handlers, by the operation type they handle
+        """
+        self.operation_handlers = operation_handlers
+        self.assets_count = max([len(handler.kin_assets) for handler in operation_handlers.values()] + [0])
+
+        # A transaction, the LedgerResults of its ledger, and its timestamp - by position in the ledger
+        self.transactions = []
+        self.memos = []
+
+        # Columns of the operations, in the order of their transactions
+        self.tx_positions = []
+        self.op_indices = []
+        self.op_types = []
+        self.asset_codes = [[] for _ in range(self.assets_count)]
+        self.asset_issuers = [[] for _ in range(self.assets_count)]
+
+    def __len__(self):
+        return len(self.op_types)
+
+    def add_transaction(self, transaction, ledger_results, timestamp):
+        """
+        Add the operations of a decoded transaction to the columns.
+
+        :param ledger_results: The LedgerResults of the transaction's ledger, only looked up for saved transactions
+        """
+        tx_position = len(self.transactions)
+        self.transactions.append((transaction, ledger_results, timestamp))
+        memo = transaction['tx']['memo']['text']
+        self.memos.append(memo if isinstance(memo, str) else '')
+
+        for op_index, operation in enumerate(transaction['tx']['operations']):
+            op_type = operation['body']['type']
+            self.tx_positions.append(tx_position)
+            self.op_indices.append(op_index)
+            self.op_types.append(op_type)
+
+            operation_handler = self.operation_handlers.get(op_type)
+            kin_assets = operation_handler.kin_assets if operation_handler is not None else ()
+            for asset_index in range(self.assets_count):
+                code, issuer = '', ''
+                if asset_index < len(kin_assets):
+                    op_body_name, asset_name = kin_assets[asset_index]
+                    credit_asset = operation['body'][op_body_name][asset_name]['alphaNum4']
+                    if credit_asset is not None:
+                        code, issuer = credit_asset['assetCode'], credit_asset['issuer']['ed25519']
+
+                self.asset_codes[asset_index].append(code)
+                self.asset_issuers[asset_index].append(issuer)
+
+    def select(self, kin_issuer, app_ids=None):
+        """
+        Find the operations the handlers might save.
+
+        :param kin_issuer: Address of the kin asset issuer
+        :param app_ids: Only select operations of transactions with the memo of one of these apps, all if None
+        :return: The positions of the selected operations in the columns, and the app id of every transaction
+        """
+        apps = self.__get_apps()
+        if not len(self):
+            return numpy.zeros(0, dtype=numpy.int64), apps
+
+        op_types = numpy.array(self.op_types, dtype=numpy.int64)
+        mask = numpy.isin(op_types, list(self.operation_handlers))
+
+        # Operations of handlers saving only kin need one of their assets to be kin
+        kin_types = [op_type for op_type, handler in self.operation_handlers.items() if handler.kin_assets]
+        is_kin = numpy.zeros(len(self), dtype=bool)
+        for codes, issuers in zip(self.asset_codes, self.asset_issuers):
+            is_kin |= (numpy.array(codes) == KIN_ASSET_CODE) & (numpy.array(issuers) == kin_issuer)
+        mask &= is_kin | ~numpy.isin(op_types, kin_types)
+
+        if app_ids is not None:
+            tx_positions = numpy.array(self.tx_positions, dtype=numpy.int64)
+            mask &= numpy.isin(apps, list(app_ids))[tx_positions]
+
+        return numpy.flatnonzero(mask), apps
+
+    def __get_apps(self):
+        """Get the app id of the memo of every transaction, an empty string if it is not an app memo."""
+        memos = numpy.array(self.memos, dtype='U{}'.format(APP_MEMO_PREFIX_LENGTH))
+        # Every character is a 4 bytes code point, missing characters are zeros
+        characters = memos.view(numpy.uint32).reshape(len(memos), APP_MEMO_PREFIX_LENGTH)
+        app_characters = characters[:, 2:APP_ID_SIZE + 2]
+
+        # Same as the app id regex: 1-<uppercase|lowercase|digits>*4-anything, where A-z includes a few symbols
+        is_app_memo = (characters[:, 0] == ord('1')) & (characters[:, 1] == ord('-')) & \
+            (characters[:, APP_ID_SIZE + 2] == ord('-')) & \
+            (((app_characters >= ord('A')) & (app_characters <= ord('z'))) |
+             ((app_characters >= ord('0')) & (app_characters <= ord('9')))).all(axis=1)
+
+        apps = numpy.ascontiguousarray(app_characters).view('U{}'.format(APP_ID_SIZE)).reshape(len(memos))
+        return numpy.where(is_app_memo, apps, '')
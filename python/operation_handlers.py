@@ -0,0 +1,285 @@
+"""
+Extract the operations saved to the storage, a handler for every type of operations.
+
+Every handler turns the operations of a single type into rows of its own table. All the enabled handlers run
+on the same decoded transactions, so saving another type of operations does not read the archive again.
+"""
+
+import base64
+import collections
+from abc import ABC, abstractmethod
+from kin_base.stellarxdr import StellarXDR_const as const
+from kin_base.utils import decode_check
+from adapters.hc_storage_adapter import HistoryCollectorStorageAdapter, PAYMENTS_TABLE, CREATIONS_TABLE, \
+    utc_from_timestamp
+from datetime import datetime
+from xdr_decoder import parse_amount
+
+KIN_ASSET_CODE = 'KIN'
+
+# The values of a transaction every one of its operations is saved with
+TransactionFields = collections.namedtuple('TransactionFields', ['memo', 'tx_fee', 'tx_charged_fee', 'tx_status',
+                                                                 'tx_hash', 'timestamp'])
+
+
+class OperationHandler(ABC):
+    """Extracts the operations of a single type into rows of a table."""
+    # The XDR operation type handled, and the table the operations are saved to
+    operation_type = None
+    table_name = None
+    # Names of the operation body and of its decoded assets, the operation is saved only if one of them is kin.
+    # Empty when operations are saved whatever their assets are.
+    kin_assets = ()
+
+    def __init__(self, kin_issuer):
+        """
+        :param kin_issuer: Address of the kin asset issuer
+        """
+        self.kin_issuer = kin_issuer
+        self.packed_kin_issuer = decode_check('account', kin_issuer)
+
+    def is_relevant(self, operation):
+        """
+        Tell if an unpacked operation might be saved, before its transaction is decoded.
+        It should never be False for an operation extract would save.
+        """
+        return True
+
+    @abstractmethod
+    def extract(self, adapter_class, transaction_fields, source, operation, result, op_index):
+        """
+        Convert a decoded operation to a row of the handler's table.
+
+        :param adapter_class: The storage adapter class, converting the rows of the payments and creations tables
+        :param transaction_fields: TransactionFields of the operation's transaction
+        :param source: Address of the operation's source, or of the transaction's source if it has none
+        :param operation: The decoded operation
+        :param result: The decoded result of the operation
+        :param op_index: Index of the operation in its transaction
+        :return: A row, or None if the operation is not saved
+        """
+        pass
+
+    @staticmethod
+    @abstractmethod
+    def output_schema():
+        """
+        :return: A dictionary of the columns of the handler's table. Key - name, Value - type
+        """
+        pass
+
+    def _is_kin_asset(self, asset):
+        """Tell if a decoded asset is kin."""
+        return asset['alphaNum4'] is not None and asset['alphaNum4']['assetCode'] == KIN_ASSET_CODE and \
+            asset['alphaNum4']['issuer']['ed25519'] == self.kin_issuer
+
+    def _is_packed_kin_asset(self, asset):
+        """Tell if an unpacked asset is kin, the decoded asset code has its padding removed."""
+        return asset.type == const.ASSET_TYPE_CREDIT_ALPHANUM4 and \
+            asset.alphaNum4.assetCode.replace(b'\x00', b'') == KIN_ASSET_CODE.encode() and \
+            asset.alphaNum4.issuer.ed25519 == self.packed_kin_issuer
+
+
+class PaymentHandler(OperationHandler):
+    """Kin payments."""
+    operation_type = const.PAYMENT
+    table_name = PAYMENTS_TABLE
+    kin_assets = (('paymentOp', 'asset'),)
+
+    def is_relevant(self, operation):
+        return self._is_packed_kin_asset(operation.body.paymentOp.asset)
+
+    def extract(self, adapter_class, transaction_fields, source, operation, result, op_index):
+        # Check if this is a payment for our asset
+        if not self._is_kin_asset(operation['body']['paymentOp']['asset']):
+            return None
+
+        destination = operation['body']['paymentOp']['destination']['ed25519']
+        amount = operation['body']['paymentOp']['amount']
+        op_status = result['tr']['paymentResult']['code'] if result else None
+
+        return adapter_class.convert_payment(source, destination, amount, transaction_fields.memo,
+                                             transaction_fields.tx_fee, transaction_fields.tx_charged_fee, op_index,
+                                             transaction_fields.tx_status, op_status, transaction_fields.tx_hash,
+                                             transaction_fields.timestamp)
+
+    @staticmethod
+    def output_schema():
+        # Rows are converted by the storage adapter, to its own columns
+        return HistoryCollectorStorageAdapter.payments_output_schema()
+
+
+class CreationHandler(OperationHandler):
+    """Account creations."""
+    operation_type = const.CREATE_ACCOUNT
+    table_name = CREATIONS_TABLE
+
+    def extract(self, adapter_class, transaction_fields, source, operation, result, op_index):
+        destination = operation['body']['createAccountOp']['destination']['ed25519']
+        balance = operation['body']['createAccountOp']['startingBalance']
+        op_status = result['tr']['createAccountResult']['code'] if result else None
+
+        return adapter_class.convert_creation(source, destination, balance, transaction_fields.memo,
+                                              transaction_fields.tx_fee, transaction_fields.tx_charged_fee, op_index,
+                                              transaction_fields.tx_status, op_status, transaction_fields.tx_hash,
+                                              transaction_fields.timestamp)
+
+    @staticmethod
+    def output_schema():
+        # Rows are converted by the storage adapter, to its own columns
+        return HistoryCollectorStorageAdapter.creations_output_schema()
+
+
+class PathPaymentHandler(OperationHandler):
+    """Path payments sending or receiving kin."""
+    operation_type = const.PATH_PAYMENT
+    table_name = 'path_payments'
+    kin_assets = (('pathPaymentOp', 'sendAsset'), ('pathPaymentOp', 'destAsset'))
+
+    def is_relevant(self, operation):
+        path_payment = operation.body.pathPaymentOp
+        return self._is_packed_kin_asset(path_payment.sendAsset) or self._is_packed_kin_asset(path_payment.destAsset)
+
+    def extract(self, adapter_class, transaction_fields, source, operation, result, op_index):
+        path_payment = operation['body']['pathPaymentOp']
+        if not self._is_kin_asset(path_payment['sendAsset']) and not self._is_kin_asset(path_payment['destAsset']):
+            return None
+
+        op_status = result['tr']['pathPaymentResult']['code'] if result else None
+
+        # Only 'amount' values are scaled down by the decoder
+        return PathPaymentRow(source=source, destination=path_payment['destination']['ed25519'],
+                              send_asset=_format_asset(path_payment['sendAsset']),
+                              send_max=parse_amount(path_payment['sendMax']),
+                              dest_asset=_format_asset(path_payment['destAsset']),
+                              dest_amount=parse_amount(path_payment['destAmount']),
+                              **_get_common_fields(transaction_fields, op_index, op_status))
+
+    @staticmethod
+    def output_schema():
+        schema = {
+            'source': str,
+            'destination': str,
+            'send_asset': str,
+            'send_max': float,
+            'dest_asset': str,
+            'dest_amount': float
+        }
+        schema.update(COMMON_OUTPUT_SCHEMA)
+        return schema
+
+
+class AccountMergeHandler(OperationHandler):
+    """Account merges, with the balance merged when they succeeded."""
+    operation_type = const.ACCOUNT_MERGE
+    table_name = 'account_merges'
+
+    def extract(self, adapter_class, transaction_fields, source, operation, result, op_index):
+        op_status = None
+        balance = None
+        if result:
+            merge_result = result['tr']['accountMergeResult']
+            op_status = merge_result['code']
+            if merge_result.get('sourceAccountBalance') is not None:
+                balance = parse_amount(merge_result['sourceAccountBalance'])
+
+        return AccountMergeRow(source=source, destination=operation['body']['destination']['ed25519'],
+                               balance=balance, **_get_common_fields(transaction_fields, op_index, op_status))
+
+    @staticmethod
+    def output_schema():
+        schema = {
+            'source': str,
+            'destination': str,
+            'balance': float
+        }
+        schema.update(COMMON_OUTPUT_SCHEMA)
+        return schema
+
+
+class ManageDataHandler(OperationHandler):
+    """Account data entries set or removed."""
+    operation_type = const.MANAGE_DATA
+    table_name = 'manage_data'
+
+    def extract(self, adapter_class, transaction_fields, source, operation, result, op_index):
+        manage_data = operation['body']['manageDataOp']
+        op_status = result['tr']['manageDataResult']['code'] if result else None
+
+        # The decoder leaves the name and the value as lists of bytes, the value is missing when the entry is removed
+        name = bytes(manage_data['dataName']).decode('utf-8', errors='replace')
+        value = base64.b64encode(bytes(manage_data['dataValue'][0])).decode() if manage_data['dataValue'] else None
+
+        return ManageDataRow(source=source, name=name, value=value,
+                             **_get_common_fields(transaction_fields, op_index, op_status))
+
+    @staticmethod
+    def output_schema():
+        schema = {
+            'source': str,
+            'name': str,
+            'value': str
+        }
+        schema.update(COMMON_OUTPUT_SCHEMA)
+        return schema
+
+
+# Columns of the transaction of the operation, every table of the handlers ends with them
+COMMON_OUTPUT_SCHEMA = {
+    'memo': str,
+    'tx_fee': int,
+    'tx_charged_fee': int,
+    'op_index': int,
+    'tx_status': str,
+    'op_status': str,
+    'tx_hash': str,
+    'timestamp': datetime
+}
+
+# Rows of the payments and creations tables are defined by the storage adapters, rows of the other tables are the same
+# for all of them. Rows are defined at module level, so they can be pickled.
+PathPaymentRow = collections.namedtuple('PathPaymentRow', PathPaymentHandler.output_schema())
+AccountMergeRow = collections.namedtuple('AccountMergeRow', AccountMergeHandler.output_schema())
+ManageDataRow = collections.namedtuple('ManageDataRow', ManageDataHandler.output_schema())
+
+# Every operation handler, by the name of the table it saves to
+OPERATION_HANDLERS = {handler.table_name: handler for handler in (PaymentHandler, CreationHandler,
+                                                                   PathPaymentHandler, AccountMergeHandler,
+                                                                   ManageDataHandler)}
+
+
+def get_operation_handlers(table_names, kin_issuer):
+    """
+    Build the handlers of the tables to save.
+
+    :param table_names: Names of the tables to save operations to
+    :param kin_issuer: Address of the kin asset issuer
+    :return: A dispatch table of the handlers, by the operation type they handle
+    """
+    operation_handlers = {}
+    for table_name in table_names:
+        if table_name not in OPERATION_HANDLERS:
+            raise ValueError('There is no handler of operations saved to {}, available tables are: {}'.format(
+                table_name, ', '.join(OPERATION_HANDLERS)))
+
+        operation_handler = OPERATION_HANDLERS[table_name](kin_issuer)
+        operation_handlers[operation_handler.operation_type] = operation_handler
+
+    return operation_handlers
+
+
+def _get_common_fields(transaction_fields, op_index, op_status):
+    """Get the values of the columns every table of the handlers ends with."""
+    return dict(memo=transaction_fields.memo, tx_fee=transaction_fields.tx_fee,
+                tx_charged_fee=transaction_fields.tx_charged_fee, op_index=op_index,
+                tx_status=transaction_fields.tx_status, op_status=op_status, tx_hash=transaction_fields.tx_hash,
+                timestamp=utc_from_timestamp(transaction_fields.timestamp))
+
+
+def _format_asset(asset):
+    """Format a decoded asset as 'native' or '<code>:<issuer>'."""
+    for credit_asset in (asset.get('alphaNum4'), asset.get('alphaNum12')):
+        if credit_asset is not None:
+            return '{}:{}'.format(credit_asset['assetCode'], credit_asset['issuer']['ed25519'])
+
+    return 'native'
@@ -0,0 +1,57 @@
+"""
+Keep the operations extracted from a checkpoint in a file, so memory does not grow with the size of the checkpoint.
+
+Operations are pickled one chunk at a time, and read back one chunk at a time while they are saved.
+"""
+
+import os
+import pickle
+
+
+def write_chunks(file_object, operations_chunks):
+    """
+    Pickle chunks of operations into a file.
+
+    :param file_object: A binary file object to write to
+    :param operations_chunks: An iterable of chunks of operations, as given to the storage adapter
+    """
+    for operations_chunk in operations_chunks:
+        pickle.dump(operations_chunk, file_object, pickle.HIGHEST_PROTOCOL)
+
+
+class OperationsSpool:
+    """
+    The chunks of operations of a checkpoint, read from a file.
+
+    Can be iterated more than once, every iteration reads the file again from its start.
+    """
+
+    def __init__(self, file_object):
+        """
+        :param file_object: A seekable binary file object, written by write_chunks
+        """
+        self.file_object = file_object
+
+    @classmethod
+    def from_file_name(cls, file_name):
+        """Open a spool written to a named file, the file is removed once the spool is closed."""
+        spool = cls(open(file_name, 'rb'))
+        os.remove(file_name)
+        return spool
+
+    def __iter__(self):
+        self.file_object.seek(0)
+        while True:
+            try:
+                yield pickle.load(self.file_object)
+            except EOFError:
+                return
+
+    def close(self):
+        self.file_object.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,87 @@
+"""Fetch upcoming checkpoints in background workers while the current one is being written."""
+
+import collections
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+
+class CheckpointPrefetcher:
+    """
+    Keep a window of upcoming checkpoints downloading and decoding in background workers.
+
+    Checkpoints are handed out strictly in sequence order, so commits to the storage stay ordered
+    no matter in which order the workers finish.
+    """
+
+    def __init__(self, fetch_function, next_sequence_function, depth):
+        """
+        :param fetch_function: Called with a file sequence, returns the fetched data of that checkpoint
+        :param next_sequence_function: Called with a file sequence, returns the sequence that follows it
+        :param depth: Number of checkpoints to fetch ahead of the one currently being handled, and the maximal depth
+          it can be set to later
+        """
+        self.fetch_function = fetch_function
+        self.next_sequence_function = next_sequence_function
+        self.depth = depth
+        self.max_depth = depth
+        self.executor = ThreadPoolExecutor(max_workers=depth + 1)
+        self.pending = collections.deque()
+        self.next_to_schedule = None
+        self.current = None
+
+    def get(self, file_sequence):
+        """
+        Return the fetched data of the given checkpoint, waiting for it if it is not ready yet.
+
+        Asking again for the last returned checkpoint (when writing it failed) does not fetch it again.
+        If fetching the checkpoint failed, the exception is raised and the checkpoint is rescheduled.
+        """
+        if self.current is not None and self.current[0] == file_sequence:
+            return self.current[1]
+        self.current = None
+
+        if not self.pending or self.pending[0][0] != file_sequence:
+            self.__reset(file_sequence)
+        self.__fill(self.depth + 1)
+
+        _, future = self.pending.popleft()
+        try:
+            data = future.result()
+        except Exception:
+            # Put the checkpoint back at the head of the window, the rest of the window stays valid
+            self.pending.appendleft((file_sequence, self.executor.submit(self.fetch_function, file_sequence)))
+            raise
+
+        self.current = (file_sequence, data)
+        self.__fill(self.depth)
+        return data
+
+    def set_depth(self, depth):
+        """
+        Change the number of checkpoints to fetch ahead, up to the depth the prefetcher was created with.
+
+        Checkpoints already fetching beyond a smaller depth are kept, no more are fetched until the window shrinks.
+        """
+        self.depth = min(max(depth, 0), self.max_depth)
+
+    def shutdown(self):
+        """Cancel the checkpoints that did not start fetching and release the workers."""
+        for _, future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=False)
+
+    def __reset(self, file_sequence):
+        if self.pending:
+            logging.info('Prefetched checkpoints are out of order, restarting prefetching from {}'.format(
+                file_sequence))
+        for _, future in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.next_to_schedule = file_sequence
+
+    def __fill(self, size):
+        while len(self.pending) < size:
+            file_sequence = self.next_to_schedule
+            self.pending.append((file_sequence, self.executor.submit(self.fetch_function, file_sequence)))
+            self.next_to_schedule = self.next_sequence_function(file_sequence)
@@ -0,0 +1,47 @@
+"""
+Process a single checkpoint and return, for batch and serverless workers ingesting history in parallel.
+
+The checkpoint is saved the same way a backfill worker saves it, without advancing the last file.
+The storage adapter and the archive source are set up on the first checkpoint a process handles, and only the
+modules of the configured ones are imported, so a cold worker starts quickly and a warm one reuses them.
+
+Usage:
+    python process_checkpoint.py <file sequence> [<network name>]
+"""
+
+import json
+import logging
+import re
+import sys
+import main
+
+logging.basicConfig(level=main.LOG_LEVEL, format='%(asctime)s | %(levelname)s | %(message)s')
+
+# Checkpoint files are named after their last ledger, 8 hexadecimal digits
+FILE_SEQUENCE_REGEX = re.compile('^[0-9a-f]{8}$')
+
+
+def handler(event, context=None):
+    """
+    Process the checkpoint of an event, for example of an AWS lambda invocation.
+
+    :param event: A dictionary of the 'file_sequence' of the checkpoint, for example {'file_sequence': '0000003f'},
+      and the name of its 'network' if the networks are configured in NETWORKS_FILE, the first network if it is missing
+    :param context: The runner's context, unused
+    :return: A dictionary of the file sequence, and whether it was saved or was saved before
+    """
+    file_sequence = event['file_sequence']
+    if FILE_SEQUENCE_REGEX.match(file_sequence) is None or \
+            (int(file_sequence, 16) + 1) % main.backfill.CHECKPOINT_FREQUENCY != 0:
+        raise ValueError('Invalid checkpoint file sequence: {}'.format(file_sequence))
+
+    saved = main.ingest_checkpoint(file_sequence, event.get('network'))
+    logging.info('File {} {}'.format(file_sequence, 'saved' if saved else 'was already saved'))
+    return {'file_sequence': file_sequence, 'saved': saved}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        sys.exit(__doc__)
+
+    print(json.dumps(handler(dict(zip(('file_sequence', 'network'), sys.argv[1:])))))
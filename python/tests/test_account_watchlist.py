@@ -0,0 +1,80 @@
+import os
+import pytest
+from collections import namedtuple
+from hashlib import sha256
+from kin_base.utils import encode_check, decode_check
+from account_watchlist import AccountWatchlist, decode_address
+
+Payment = namedtuple('Payment', ['source', 'destination'])
+ManageData = namedtuple('ManageData', ['source', 'name'])
+
+
+def test_contains(tmpdir):
+    watched = [__generate_address(index) for index in range(1000)]
+    watchlist = __generate_watchlist(tmpdir, watched)
+
+    assert all(address in watchlist for address in watched)
+    # Accounts passing the bloom filter by chance are still not watched
+    assert not any(__generate_address(index) in watchlist for index in range(1000, 20000))
+
+
+def test_decode_address():
+    address = __generate_address(0)
+    assert decode_address(address) == decode_check('account', address)
+
+    # Wrong checksum
+    with pytest.raises(ValueError):
+        decode_address(address[:-1] + ('A' if address[-1] != 'A' else 'B'))
+    # Not an account address
+    with pytest.raises(ValueError):
+        decode_address(encode_check('seed', bytes(32)).decode())
+
+
+def test_filter_chunks(tmpdir):
+    watched, other = __generate_address(0), __generate_address(1)
+    watchlist = __generate_watchlist(tmpdir, [watched])
+    chunks = [(None, 'payments', [Payment(watched, other), Payment(other, watched), Payment(other, other)]),
+              ('test', 'manage_data', [ManageData(watched, 'name'), ManageData(other, 'name')]),
+              (None, 'creations', [Payment(other, other)])]
+
+    assert list(watchlist.filter_chunks(chunks)) == [
+        (None, 'payments', [Payment(watched, other), Payment(other, watched)]),
+        ('test', 'manage_data', [ManageData(watched, 'name')])]
+
+
+def test_reload_if_changed(tmpdir):
+    watchlist = __generate_watchlist(tmpdir, [__generate_address(0)])
+
+    # Modified files are loaded again
+    __write_watchlist_file(tmpdir, [__generate_address(1)], modified_time=1000)
+    watchlist.reload_if_changed()
+    assert __generate_address(0) not in watchlist
+    assert __generate_address(1) in watchlist
+
+    # A file that can not be loaded keeps the previous accounts
+    __write_watchlist_file(tmpdir, ['not an address'], modified_time=2000)
+    watchlist.reload_if_changed()
+    assert __generate_address(1) in watchlist
+
+
+def test_first_load_fails(tmpdir):
+    with pytest.raises(FileNotFoundError):
+        AccountWatchlist(str(tmpdir.join('missing'))).reload_if_changed()
+
+
+def __generate_watchlist(tmpdir, addresses):
+    watchlist = AccountWatchlist(__write_watchlist_file(tmpdir, addresses))
+    watchlist.reload_if_changed()
+    return watchlist
+
+
+def __write_watchlist_file(tmpdir, addresses, modified_time=None):
+    file_path = tmpdir.join('watchlist')
+    file_path.write('\n'.join(addresses) + '\n')
+    if modified_time is not None:
+        os.utime(str(file_path), (modified_time, modified_time))
+    return str(file_path)
+
+
+def __generate_address(index):
+    return encode_check('account', sha256(str(index).encode()).digest()).decode()
@@ -0,0 +1,64 @@
+import threading
+from alert_dispatcher import AlertDispatcher
+
+
+def test_send_does_not_wait_for_delivery():
+    delivering = threading.Event()
+    release = threading.Event()
+    delivered = []
+
+    def deliver(message):
+        delivering.set()
+        release.wait()
+        delivered.append(message)
+
+    dispatcher = AlertDispatcher(deliver, 0)
+    dispatcher.send('first')
+    assert delivering.wait(5)
+    # Queued while the first alert is stuck in delivery
+    dispatcher.send('second')
+
+    release.set()
+    dispatcher.close(5)
+    assert delivered == ['first', 'second']
+
+
+def test_alerts_are_coalesced_until_next_delivery():
+    delivered = []
+    delivered_first = threading.Event()
+
+    def deliver(message):
+        delivered.append(message)
+        delivered_first.set()
+
+    dispatcher = AlertDispatcher(deliver, 60)
+    dispatcher.send('first')
+    assert delivered_first.wait(5)
+
+    for _ in range(3):
+        dispatcher.send('error')
+    dispatcher.send('other error')
+    # Nothing is delivered until the interval passes, or the dispatcher is closed
+    assert delivered == ['first']
+
+    dispatcher.close(5)
+    assert delivered == ['first', 'error\n(Repeated 3 times)\n\nother error']
+
+
+def test_failed_delivery_does_not_stop_dispatcher():
+    delivered = []
+    failed = threading.Event()
+
+    def deliver(message):
+        if message == 'fails':
+            failed.set()
+            raise OSError('test')
+        delivered.append(message)
+
+    dispatcher = AlertDispatcher(deliver, 0)
+    dispatcher.send('fails')
+    assert failed.wait(5)
+    dispatcher.send('delivered')
+    dispatcher.close(5)
+
+    assert delivered == ['delivered']
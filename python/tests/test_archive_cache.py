@@ -0,0 +1,53 @@
+import hashlib
+import io
+import os
+from archive_cache import ArchiveCache, CHECKSUM_SIZE
+
+
+def test_put_and_get(tmpdir):
+    archive_cache = ArchiveCache(str(tmpdir.join('cache')), 1024, 1024)
+    assert archive_cache.get('transactions-0000003f.xdr.gz') is None
+
+    file_object = io.BytesIO(b'contents')
+    archive_cache.put('transactions-0000003f.xdr.gz', file_object)
+
+    # The saved file is left ready to be decoded
+    assert file_object.read() == b'contents'
+    assert archive_cache.get('transactions-0000003f.xdr.gz').read() == b'contents'
+    assert archive_cache.get('results-0000003f.xdr.gz') is None
+
+
+def test_corrupted_file(tmpdir):
+    archive_cache = ArchiveCache(str(tmpdir), 1024, 1024)
+    archive_cache.put('ledger-0000003f.xdr.gz', io.BytesIO(b'contents'))
+
+    cached_file_name, = os.listdir(str(tmpdir))
+    with open(str(tmpdir.join(cached_file_name)), 'r+b') as cached_file:
+        cached_file.seek(CHECKSUM_SIZE)
+        cached_file.write(b'C')
+
+    assert archive_cache.get('ledger-0000003f.xdr.gz') is None
+    # Corrupted files are removed
+    assert os.listdir(str(tmpdir)) == []
+
+
+def test_evict_least_recently_used(tmpdir):
+    file_size = CHECKSUM_SIZE + 100
+    archive_cache = ArchiveCache(str(tmpdir), file_size * 2, 1024)
+
+    archive_cache.put('first', io.BytesIO(b'1' * 100))
+    archive_cache.put('second', io.BytesIO(b'2' * 100))
+    for file_index, name in enumerate(['first', 'second']):
+        os.utime(__get_cached_path(tmpdir, name), (1000 + file_index, 1000 + file_index))
+
+    # Reading the first file makes the second the least recently used
+    archive_cache.get('first')
+    archive_cache.put('third', io.BytesIO(b'3' * 100))
+
+    assert archive_cache.get('first') is not None
+    assert archive_cache.get('second') is None
+    assert archive_cache.get('third') is not None
+
+
+def __get_cached_path(tmpdir, archive_path):
+    return str(tmpdir.join(hashlib.sha256(archive_path.encode()).hexdigest()))
@@ -0,0 +1,53 @@
+import io
+import pytest
+from botocore.exceptions import ClientError
+from archive_sources import ArchiveFileError, MissingArchiveFileError, S3ArchiveSource, LocalArchiveSource
+
+PATH = 'ledger/00/00/00/ledger-0000003f.xdr.gz'
+
+
+class FakeS3:
+    def __init__(self, objects, error_code='NoSuchKey'):
+        self.objects = objects
+        self.error_code = error_code
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': self.error_code, 'Message': ''}}, 'GetObject')
+        return {'Body': io.BytesIO(self.objects[Bucket, Key])}
+
+
+def test_s3_archive_source():
+    archive_source = S3ArchiveSource('s3://bucket/core/', FakeS3({('bucket', 'core/' + PATH): b'ledger'}), 1024)
+
+    assert archive_source.open(PATH).read() == b'ledger'
+    assert archive_source.get_url(PATH) == 's3://bucket/core/' + PATH
+    with pytest.raises(MissingArchiveFileError):
+        archive_source.open('history.json')
+
+    # The root of the bucket
+    archive_source = S3ArchiveSource('s3://bucket', FakeS3({('bucket', PATH): b'ledger'}), 1024)
+    assert archive_source.open(PATH).read() == b'ledger'
+
+    # Other errors are not missing files, but might be retried too
+    archive_source = S3ArchiveSource('s3://bucket', FakeS3({}, error_code='SlowDown'), 1024)
+    with pytest.raises(ArchiveFileError) as error:
+        archive_source.open(PATH)
+    assert not isinstance(error.value, MissingArchiveFileError)
+
+
+def test_local_archive_source(tmpdir):
+    tmpdir.join(PATH).write_binary(b'ledger', ensure=True)
+    tmpdir.join('history.json').write_binary(b'')
+    archive_source = LocalArchiveSource('file://' + str(tmpdir))
+
+    with archive_source.open(PATH) as archive_file:
+        assert archive_file.read() == b'ledger'
+        archive_file.seek(0)
+        assert archive_file.read(3) == b'led'
+
+    with pytest.raises(MissingArchiveFileError):
+        archive_source.open('transactions/00/00/00/transactions-0000003f.xdr.gz')
+    # A file that is still being copied
+    with pytest.raises(ArchiveFileError):
+        archive_source.open('history.json')
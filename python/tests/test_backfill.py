@@ -0,0 +1,157 @@
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from backfill import split_to_shards, ShardWatermark, ingest_shards, Shard, ShardClaims, ingest_claimed_shards
+
+
+def test_split_to_shards():
+    shards = split_to_shards('0000003f', '0000017f', 2)
+
+    assert shards == [Shard('0000003f', 2, '0000007f'), Shard('000000bf', 2, '000000ff'),
+                      Shard('0000013f', 2, '0000017f')]
+
+
+def test_split_to_shards_last_shard_smaller():
+    shards = split_to_shards('0000003f', '000000bf', 2)
+
+    assert shards == [Shard('0000003f', 2, '0000007f'), Shard('000000bf', 1, '000000bf')]
+
+
+def test_split_to_shards_aligned():
+    # The first shard ends where it would have, had the range started at the first checkpoint
+    shards = split_to_shards('000000bf', '0000023f', 4, aligned=True)
+
+    assert shards == [Shard('000000bf', 2, '000000ff'), Shard('0000013f', 4, '000001ff'),
+                      Shard('0000023f', 1, '0000023f')]
+    assert split_to_shards('0000013f', '0000017f', 4, aligned=True) == [Shard('0000013f', 2, '0000017f')]
+
+
+def test_split_to_shards_empty_range():
+    assert split_to_shards('0000013f', '000000ff', 2) == []
+
+
+def test_watermark_advances_only_over_contiguous_shards():
+    watermark = ShardWatermark(split_to_shards('0000003f', '0000013f', 1))
+
+    assert watermark.complete(1) is None
+    assert watermark.complete(3) is None
+    assert watermark.complete(0) == '0000007f'
+    assert watermark.complete(2) == '000000ff'
+    assert watermark.complete(4) == '0000013f'
+
+
+def test_ingest_shards():
+    shards = split_to_shards('0000003f', '0000043f', 2)
+    ingested = []
+    advances = []
+    lock = threading.Lock()
+
+    def ingest(first_sequence, count):
+        with lock:
+            ingested.append((first_sequence, count))
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        ingest_shards(pool, ingest, shards, advances.append, max_pending=4, max_retries=0)
+
+    assert sorted(ingested) == [(shard.first_sequence, shard.count) for shard in shards]
+    assert advances[-1] == '0000043f'
+    assert advances == sorted(advances)
+
+
+def test_ingest_shards_retries_failed_shard():
+    shards = split_to_shards('0000003f', '000000ff', 1)
+    attempts = []
+    advances = []
+
+    def ingest(first_sequence, count):
+        attempts.append(first_sequence)
+        if first_sequence == '0000007f' and attempts.count(first_sequence) == 1:
+            raise RuntimeError('test')
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        ingest_shards(pool, ingest, shards, advances.append, max_pending=1, max_retries=1)
+
+    assert attempts.count('0000007f') == 2
+    assert advances == ['0000003f', '0000007f', '000000bf', '000000ff']
+
+
+def test_ingest_shards_gives_up_after_retries():
+    shards = split_to_shards('0000003f', '000000ff', 1)
+    advances = []
+
+    def ingest(first_sequence, count):
+        if first_sequence == '0000007f':
+            raise RuntimeError('test')
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        with pytest.raises(RuntimeError):
+            ingest_shards(pool, ingest, shards, advances.append, max_pending=1, max_retries=2)
+
+    # The last file never moves past the failed shard
+    assert advances == ['0000003f']
+
+
+class FakeClaimsStorage:
+    def __init__(self, claims):
+        self.claims = dict(claims)
+        self.renewals = []
+
+    def claim_file(self, file_name, owner, lease_time):
+        return self.claims.setdefault(file_name, owner) == owner
+
+    def renew_file_claims(self, file_names, owner, lease_time):
+        self.renewals.append(sorted(file_names))
+        return {file_name for file_name in file_names if self.claims.get(file_name) == owner}
+
+    def release_file_claim(self, file_name, owner):
+        if self.claims.get(file_name) == owner:
+            del self.claims[file_name]
+
+
+def test_ingest_claimed_shards_skips_shards_of_other_collectors():
+    shards = split_to_shards('000000bf', '0000033f', 4, aligned=True)
+    storage = FakeClaimsStorage({'0000013f': 'other'})
+    ingested = []
+    advances = []
+
+    def ingest(first_sequence, count):
+        ingested.append(first_sequence)
+        return count
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        saved = ingest_claimed_shards(pool, ingest, shards, ShardClaims(storage, 'this', 30, 4),
+                                      lambda: advances.append(None), max_pending=2, max_retries=0)
+
+    # The first shard is claimed by its aligned first checkpoint
+    assert sorted(ingested) == ['000000bf', '0000023f', '0000033f']
+    assert saved == 2 + 4 + 1
+    assert len(advances) == 3
+    # Only the claim of the other collector is left
+    assert storage.claims == {'0000013f': 'other'}
+
+
+def test_ingest_claimed_shards_renews_claims():
+    shards = split_to_shards('0000003f', '0000007f', 1, aligned=True)
+    storage = FakeClaimsStorage({})
+    ingesting = threading.Event()
+    release = threading.Event()
+
+    def ingest(first_sequence, count):
+        if first_sequence == '0000007f':
+            ingesting.set()
+            release.wait()
+        return count
+
+    def renew_file_claims(file_names, owner, lease_time):
+        # Renewed while the shard is ingested
+        release.set()
+        return FakeClaimsStorage.renew_file_claims(storage, file_names, owner, lease_time)
+
+    storage.renew_file_claims = renew_file_claims
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        ingest_claimed_shards(pool, ingest, shards, ShardClaims(storage, 'this', 0.03, 1),
+                              lambda: None, max_pending=2, max_retries=0)
+
+    assert ingesting.is_set()
+    assert storage.renewals[0] == ['0000007f']
+    assert storage.claims == {}
@@ -0,0 +1,47 @@
+from concurrency_controller import ConcurrencyController, DOWNLOAD_STAGE, DECODE_STAGE, WRITE_STAGE
+
+
+def __observe_stages(controller, download, decode, write):
+    controller.observe_stage(DOWNLOAD_STAGE, download)
+    controller.observe_stage(DECODE_STAGE, decode)
+    controller.observe_stage(WRITE_STAGE, write)
+
+
+def test_depth_is_maximal_until_stages_are_measured():
+    assert ConcurrencyController(4, 2, 0).get_depth() == 4
+
+
+def test_depth_keeps_writes_busy_while_catching_up():
+    controller = ConcurrencyController(8, 4, 0)
+    controller.observe_lag(1000)
+
+    __observe_stages(controller, 1, 2, 1)
+    assert controller.get_depth() == 3
+
+    # Slow writes need fewer checkpoints fetched ahead
+    controller = ConcurrencyController(8, 4, 0)
+    controller.observe_lag(1000)
+    __observe_stages(controller, 1, 2, 3)
+    assert controller.get_depth() == 1
+
+
+def test_single_stream_at_tip():
+    controller = ConcurrencyController(8, 4, 0)
+    __observe_stages(controller, 1, 2, 0.1)
+
+    controller.observe_lag(2)
+    assert controller.get_depth() == 2
+    controller.observe_lag(0)
+    assert controller.get_depth() == 0
+
+
+def test_depth_within_budgets():
+    # A single decoder keeps up with one checkpoint downloading while another one is decoded
+    controller = ConcurrencyController(8, 1, 0)
+    __observe_stages(controller, 1, 1, 0.1)
+    assert controller.get_depth() == 1
+
+    controller = ConcurrencyController(8, 8, 300)
+    __observe_stages(controller, 1, 1, 0.1)
+    controller.observe_checkpoint_size(100)
+    assert controller.get_depth() == 2
@@ -0,0 +1,57 @@
+import os
+import pytest
+from decoded_checkpoints import DecodedCheckpoints
+from ledger_results import LedgerResultsError, merge_by_ledger
+
+LEDGERS_DICTIONARY = {2: 1535594286, 3: 1535594291}
+
+
+def test_save_and_load(tmpdir):
+    decoded_checkpoints = DecodedCheckpoints(str(tmpdir))
+    transactions = [__transaction_entry(2, ['a', 'b']), __transaction_entry(3, ['c'])]
+    results = [__results_entry(2, ['a', 'b']), __results_entry(3, ['c'])]
+
+    assert not decoded_checkpoints.contains('0000003f')
+    with decoded_checkpoints.save('0000003f', LEDGERS_DICTIONARY, merge_by_ledger(transactions, results)) as ledgers:
+        # Saved while the ledgers are iterated
+        assert next(ledgers)[0] == transactions[0]
+    assert decoded_checkpoints.contains('0000003f')
+
+    with decoded_checkpoints.load('0000003f') as (ledgers_dictionary, ledgers):
+        assert ledgers_dictionary == LEDGERS_DICTIONARY
+        loaded = [(entry, ledger_results.get(entry['txSet']['txs'][-1])) for entry, ledger_results in ledgers]
+    assert loaded == [(transactions[0], 'result-b'), (transactions[1], 'result-c')]
+
+
+def test_load_validates(tmpdir):
+    decoded_checkpoints = DecodedCheckpoints(str(tmpdir))
+    with decoded_checkpoints.save('0000003f', LEDGERS_DICTIONARY,
+                                  merge_by_ledger([__transaction_entry(3, ['a'])], [__results_entry(3, ['b'])])):
+        pass
+
+    with decoded_checkpoints.load('0000003f', validate=True) as (_, ledgers):
+        entry, ledger_results = next(ledgers)
+        with pytest.raises(LedgerResultsError):
+            ledger_results.get(entry['txSet']['txs'][0])
+
+
+def test_failed_save(tmpdir):
+    decoded_checkpoints = DecodedCheckpoints(str(tmpdir))
+
+    with pytest.raises(ValueError):
+        with decoded_checkpoints.save('0000003f', LEDGERS_DICTIONARY,
+                                      merge_by_ledger([__transaction_entry(2, ['a'])], [__results_entry(2, ['a'])])):
+            raise ValueError
+
+    # Nothing is left of a checkpoint that was not saved
+    assert not decoded_checkpoints.contains('0000003f')
+    assert os.listdir(str(tmpdir)) == []
+
+
+def __transaction_entry(ledger_sequence, hashes):
+    return {'ledgerSeq': ledger_sequence, 'txSet': {'txs': [{'hash': tx_hash} for tx_hash in hashes]}}
+
+
+def __results_entry(ledger_sequence, hashes):
+    return {'ledgerSeq': ledger_sequence, 'txResultSet': {'results': [
+        {'transactionHash': tx_hash, 'result': 'result-' + tx_hash} for tx_hash in hashes]}}
@@ -0,0 +1,49 @@
+import pytest
+from ledger_results import LedgerResults, LedgerResultsError, merge_by_ledger
+
+
+def test_merge_by_ledger():
+    transactions = [__transactions_entry(3, ['a']), __transactions_entry(5, ['b', 'c']), __transactions_entry(6, [])]
+    results = [__results_entry(2, ['x']), __results_entry(3, ['a']), __results_entry(4, ['y']),
+               __results_entry(5, ['c', 'b']), __results_entry(6, ['z'])]
+
+    merged = [(entry['ledgerSeq'], [ledger_results.get(transaction)['code'] for transaction in entry['txSet']['txs']])
+              for entry, ledger_results in merge_by_ledger(transactions, results)]
+
+    assert merged == [(3, ['a']), (5, ['b', 'c']), (6, [])]
+
+
+def test_single_transaction_ledger_is_matched_by_position():
+    ledger_results = LedgerResults(3, __results_entry(3, ['a'])['txResultSet']['results'])
+
+    assert ledger_results.get({'hash': 'other'}) == {'code': 'a'}
+
+
+def test_validate_hashes():
+    ledger_results = LedgerResults(3, __results_entry(3, ['a'])['txResultSet']['results'], validate=True)
+
+    assert ledger_results.get({'hash': 'a'}) == {'code': 'a'}
+    with pytest.raises(LedgerResultsError):
+        ledger_results.get({'hash': 'other'})
+
+
+def test_missing_result():
+    transactions = [__transactions_entry(3, ['a']), __transactions_entry(4, ['b'])]
+    results = [__results_entry(3, ['a', 'c'])]
+
+    merged = list(merge_by_ledger(transactions, results))
+
+    with pytest.raises(LedgerResultsError):
+        merged[0][1].get({'hash': 'b'})
+    with pytest.raises(LedgerResultsError):
+        merged[1][1].get({'hash': 'b'})
+
+
+def __transactions_entry(ledger_sequence, hashes):
+    return {'ledgerSeq': ledger_sequence, 'txSet': {'txs': [{'hash': tx_hash} for tx_hash in hashes]}}
+
+
+def __results_entry(ledger_sequence, hashes):
+    return {'ledgerSeq': ledger_sequence,
+            'txResultSet': {'results': [{'transactionHash': tx_hash, 'result': {'code': tx_hash}}
+                                        for tx_hash in hashes]}}
@@ -0,0 +1,52 @@
+import json
+import pytest
+from networks import Network, load_networks
+
+KIN_ISSUER = 'GBC3SG6NGTSZ2OMH3FFGB7UVRQWILW367U4GSOOF4TFSZONV42UJXUH7'
+DEFAULTS = dict(kin_issuer=KIN_ISSUER, network_passphrase='Public Global Kin Ecosystem Network ; June 2018',
+                archive_url='s3://bucket/core', first_file='0000003f', postgres_host='localhost')
+
+
+def test_load_networks(tmpdir):
+    networks_file = tmpdir.join('networks.json')
+    networks_file.write(json.dumps([
+        {'name': 'mainnet'},
+        {'name': 'testnet', 'network_passphrase': 'Kin Testnet ; December 2018', 'app_ids': ['abcd'],
+         'operation_tables': ['payments'], 'postgres_host': 'testnet-db'}]))
+
+    mainnet, testnet = load_networks(str(networks_file), DEFAULTS)
+
+    # Settings the network does not set are the defaults
+    assert (mainnet.name, mainnet.archive_url, mainnet.postgres_host) == ('mainnet', 's3://bucket/core', 'localhost')
+    assert mainnet.saved_app_ids is None
+    assert (testnet.network_passphrase, testnet.postgres_host) == ('Kin Testnet ; December 2018', 'testnet-db')
+    assert testnet.saved_app_ids == frozenset(['abcd'])
+    assert [handler.table_name for handler in testnet.operation_handlers.values()] == ['payments']
+
+
+def test_network_storage_is_not_mixed_with_defaults(tmpdir):
+    networks_file = tmpdir.join('networks.json')
+    networks_file.write(json.dumps([{'name': 'mainnet'}, {'name': 'testnet', 's3_storage_bucket': 'testnet-bucket'}]))
+
+    mainnet, testnet = load_networks(str(networks_file), DEFAULTS)
+
+    assert (mainnet.postgres_host, mainnet.s3_storage_bucket) == ('localhost', '')
+    assert (testnet.postgres_host, testnet.s3_storage_bucket) == ('', 'testnet-bucket')
+
+
+@pytest.mark.parametrize('networks', [
+    [],
+    [{'name': 'mainnet'}, {'name': 'mainnet'}],
+    [{'archive_url': 's3://bucket/core'}],
+    [{'name': 'mainnet', 'archive': 's3://bucket/core'}]])
+def test_load_invalid_networks(tmpdir, networks):
+    networks_file = tmpdir.join('networks.json')
+    networks_file.write(json.dumps(networks))
+
+    with pytest.raises(ValueError):
+        load_networks(str(networks_file), DEFAULTS)
+
+
+def test_network_requires_issuer_and_passphrase():
+    with pytest.raises(ValueError):
+        Network('mainnet', '', 'Public Global Kin Ecosystem Network ; June 2018', 's3://bucket/core')
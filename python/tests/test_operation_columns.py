@@ -0,0 +1,61 @@
+import re
+from kin_base.utils import encode_check
+from operation_columns import OperationColumns
+from operation_handlers import get_operation_handlers
+
+KIN_ISSUER = encode_check('account', bytes(range(32))).decode()
+OTHER_ISSUER = encode_check('account', bytes(32)).decode()
+OPERATION_HANDLERS = get_operation_handlers(['payments', 'creations', 'path_payments'], KIN_ISSUER)
+
+
+def test_select_operations():
+    operation_columns = __generate_columns([
+        ('1-test-memo', [__payment('KIN', KIN_ISSUER), __payment('KIN', OTHER_ISSUER), __payment(None, None)]),
+        (None, [{'body': {'type': 0}}, {'body': {'type': 8}}]),
+        ('1-test-memo', [__path_payment((None, None), ('KIN', KIN_ISSUER)),
+                         __path_payment((None, None), ('XLM', KIN_ISSUER))])])
+
+    operation_positions, _ = operation_columns.select(KIN_ISSUER)
+
+    assert list(operation_positions) == [0, 3, 5]
+
+
+def test_select_app_operations():
+    memos = ['1-test-memo', '1-abcd-', '1-test', '2-test-memo', '1-te$t-memo', '1-qwer-memo', '', None]
+    operation_columns = __generate_columns([(memo, [{'body': {'type': 0}}]) for memo in memos])
+
+    operation_positions, apps = operation_columns.select(KIN_ISSUER, {'test', 'abcd'})
+
+    assert list(operation_positions) == [0, 1]
+    # Same as the app id regex of the decoded memos
+    assert list(apps) == [re.match('^1-([A-z0-9]{4})-', memo).group(1) if memo and re.match('^1-[A-z0-9]{4}-', memo)
+                          else '' for memo in memos]
+
+
+def test_select_nothing():
+    operation_positions, apps = OperationColumns(OPERATION_HANDLERS).select(KIN_ISSUER, {'test'})
+
+    assert len(operation_positions) == 0
+    assert len(apps) == 0
+
+
+def __generate_columns(transactions):
+    operation_columns = OperationColumns(OPERATION_HANDLERS)
+    for memo, operations in transactions:
+        operation_columns.add_transaction({'tx': {'memo': {'text': memo}, 'operations': operations}}, None, 0)
+    return operation_columns
+
+
+def __payment(code, issuer):
+    return {'body': {'type': 1, 'paymentOp': {'asset': __asset(code, issuer)}}}
+
+
+def __path_payment(send_asset, dest_asset):
+    return {'body': {'type': 2, 'pathPaymentOp': {'sendAsset': __asset(*send_asset),
+                                                  'destAsset': __asset(*dest_asset)}}}
+
+
+def __asset(code, issuer):
+    if code is None:
+        return {'alphaNum4': None}
+    return {'alphaNum4': {'assetCode': code, 'issuer': {'ed25519': issuer}}}
@@ -0,0 +1,136 @@
+import base64
+import pytest
+from datetime import datetime
+from types import SimpleNamespace
+from kin_base.stellarxdr import Xdr
+from kin_base.utils import encode_check
+from xdrparser import parser
+from adapters.postgres_storage_adapter import PostgresStorageAdapter
+from operation_handlers import OperationHandler, TransactionFields, get_operation_handlers
+
+ISSUER = bytes(range(32))
+KIN_ISSUER = encode_check('account', ISSUER).decode()
+DESTINATION = bytes(32)
+TRANSACTION_FIELDS = TransactionFields(memo='1-test-memo', tx_fee=100, tx_charged_fee=100, tx_status='txSUCCESS',
+                                       tx_hash='aa' * 32, timestamp=1535594286)
+OPERATION_HANDLERS = get_operation_handlers(['payments', 'creations', 'path_payments', 'account_merges',
+                                             'manage_data'], KIN_ISSUER)
+
+
+def test_get_operation_handlers():
+    operation_handlers = get_operation_handlers(['creations', 'account_merges'], KIN_ISSUER)
+
+    assert {operation_type: operation_handler.table_name
+            for operation_type, operation_handler in operation_handlers.items()} == {0: 'creations',
+                                                                                     8: 'account_merges'}
+    with pytest.raises(ValueError):
+        get_operation_handlers(['payments', 'offers'], KIN_ISSUER)
+
+
+def test_incomplete_handler_can_not_be_created():
+    class IncompleteHandler(OperationHandler):
+        table_name = 'incomplete'
+
+        @staticmethod
+        def output_schema():
+            return {}
+
+    with pytest.raises(TypeError):
+        IncompleteHandler(KIN_ISSUER)
+
+
+def test_payment():
+    operation = __generate_operation(1, paymentOp=Xdr.types.PaymentOp(
+        destination=__generate_account(DESTINATION), asset=__generate_kin(), amount=123456789))
+    result = __generate_result(1, paymentResult=SimpleNamespace(code=0))
+
+    row = __extract(operation, result)
+
+    assert row == PostgresStorageAdapter.convert_payment('source', encode_check('account', DESTINATION).decode(),
+                                                         12.34568, '1-test-memo', 100, 100, 0, 'txSUCCESS',
+                                                         'PAYMENT_SUCCESS', 'aa' * 32, 1535594286)
+
+
+def test_path_payment():
+    operation = __generate_operation(2, pathPaymentOp=Xdr.types.PathPaymentOp(
+        sendAsset=__generate_kin(), sendMax=20000000, destination=__generate_account(DESTINATION),
+        destAsset=Xdr.types.Asset(type=0), destAmount=5000000, path=[]))
+    result = __generate_result(2, pathPaymentResult=SimpleNamespace(code=-1))
+
+    assert OPERATION_HANDLERS[2].is_relevant(operation)
+    row = __extract(operation, result)
+
+    assert row.send_asset == 'KIN:{}'.format(KIN_ISSUER)
+    assert row.send_max == 2.0
+    assert row.dest_asset == 'native'
+    assert row.dest_amount == 0.5
+    assert row.op_status == 'PATH_PAYMENT_MALFORMED'
+    assert row.timestamp == datetime.strptime('2018-08-30 01:58:06', '%Y-%m-%d %H:%M:%S')
+
+
+def test_path_payment_without_kin():
+    operation = __generate_operation(2, pathPaymentOp=Xdr.types.PathPaymentOp(
+        sendAsset=Xdr.types.Asset(type=0), sendMax=20000000, destination=__generate_account(DESTINATION),
+        destAsset=Xdr.types.Asset(type=0), destAmount=5000000, path=[]))
+    result = __generate_result(2, pathPaymentResult=SimpleNamespace(code=-1))
+
+    assert not OPERATION_HANDLERS[2].is_relevant(operation)
+    assert __extract(operation, result) is None
+
+
+def test_account_merge():
+    operation = __generate_operation(8, destination=__generate_account(DESTINATION))
+
+    row = __extract(operation, __generate_result(8, accountMergeResult=Xdr.types.AccountMergeResult(
+        code=0, sourceAccountBalance=15000000)))
+    assert row.destination == encode_check('account', DESTINATION).decode()
+    assert row.balance == 1.5
+    assert row.op_status == 'ACCOUNT_MERGE_SUCCESS'
+
+    # Failed merges have no balance
+    row = __extract(operation, __generate_result(8, accountMergeResult=Xdr.types.AccountMergeResult(code=-2)))
+    assert row.balance is None
+
+
+def test_manage_data():
+    row = __extract(__generate_operation(10, manageDataOp=Xdr.types.ManageDataOp(dataName=b'name',
+                                                                                dataValue=[b'\x00value'])),
+                    __generate_result(10, manageDataResult=SimpleNamespace(code=0)))
+    assert row.name == 'name'
+    assert base64.b64decode(row.value) == b'\x00value'
+
+    # Removed entries have no value
+    row = __extract(__generate_operation(10, manageDataOp=Xdr.types.ManageDataOp(dataName=b'name', dataValue=[])),
+                    __generate_result(10, manageDataResult=SimpleNamespace(code=0)))
+    assert row.value is None
+
+
+def __extract(operation, result):
+    """Decode an operation and its result the same way the collector does, and extract them."""
+    packer = Xdr.StellarXDRPacker()
+    packer.pack_Operation(operation)
+    packer.pack_OperationResult(result)
+    unpacker = Xdr.StellarXDRUnpacker(packer.get_buffer())
+    decoded_operation = parser.todict(unpacker.unpack_Operation(), '.0')
+    decoded_result = parser.todict(unpacker.unpack_OperationResult(), '.0')
+
+    operation_handler = OPERATION_HANDLERS[decoded_operation['body']['type']]
+    return operation_handler.extract(PostgresStorageAdapter, TRANSACTION_FIELDS, 'source', decoded_operation,
+                                     decoded_result, 0)
+
+
+def __generate_operation(operation_type, **body):
+    return Xdr.types.Operation(sourceAccount=[], body=SimpleNamespace(type=operation_type, **body))
+
+
+def __generate_result(operation_type, **result):
+    return Xdr.types.OperationResult(code=0, tr=SimpleNamespace(type=operation_type, **result))
+
+
+def __generate_kin():
+    return Xdr.types.Asset(type=1, alphaNum4=SimpleNamespace(assetCode=b'KIN\x00',
+                                                             issuer=__generate_account(ISSUER)))
+
+
+def __generate_account(key):
+    return Xdr.types.PublicKey(type=0, ed25519=key)
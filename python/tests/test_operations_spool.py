@@ -0,0 +1,30 @@
+import io
+import os
+from operations_spool import OperationsSpool, write_chunks
+
+CHUNKS = [([('payment', 1), ('payment', 2)], []), ([], [('creation', 3)])]
+
+
+def test_spool_is_read_every_iteration():
+    file_object = io.BytesIO()
+    write_chunks(file_object, iter(CHUNKS))
+
+    with OperationsSpool(file_object) as spool:
+        assert list(spool) == CHUNKS
+        assert list(spool) == CHUNKS
+
+    assert file_object.closed
+
+
+def test_spool_from_file_name(tmpdir):
+    file_path = str(tmpdir.join('operations'))
+    with open(file_path, 'wb') as file_object:
+        write_chunks(file_object, CHUNKS)
+
+    with OperationsSpool.from_file_name(file_path) as spool:
+        assert not os.path.exists(file_path)
+        assert list(spool) == CHUNKS
+
+
+def test_empty_spool():
+    assert list(OperationsSpool(io.BytesIO())) == []
@@ -2,7 +2,7 @@ import pytest
 import re
 import random
 import string
-from adapters.postgres_storage_adapter import PostgresStorageAdapter
+from adapters.postgres_storage_adapter import PostgresStorageAdapter, format_copy_rows
 from datetime import datetime
 from psycopg2 import IntegrityError
 
@@ -37,8 +37,8 @@ def test_get_last_file_sequence(postgres_storage_adapter_instance: PostgresStora
 def test_save_payments(postgres_storage_adapter_instance: PostgresStorageAdapter):
     payments = list()
 
-    payments.append(__generate_row_based_on_schema(postgres_storage_adapter_instance.payments_output_schema()))
-    payments.append(__generate_row_based_on_schema(postgres_storage_adapter_instance.payments_output_schema()))
+    payments.append(__generate_payment(postgres_storage_adapter_instance))
+    payments.append(__generate_payment(postgres_storage_adapter_instance))
 
     number_of_rows_before_saving = __get_count_of_table(postgres_storage_adapter_instance, 'payments')
 
@@ -65,8 +65,7 @@ def test_save_payments_with_null_value(postgres_storage_adapter_instance: Postgr
 
     payments = list()
 
-    payments.append(__generate_row_based_on_schema(postgres_storage_adapter_instance.payments_output_schema()))
-    payments[0][selected_column] = None
+    payments.append(__generate_payment(postgres_storage_adapter_instance, **{selected_column: None}))
 
     number_of_rows_before_saving = __get_count_of_table(postgres_storage_adapter_instance, 'payments')
 
@@ -78,8 +77,8 @@ def test_save_payments_with_null_value(postgres_storage_adapter_instance: Postgr
     postgres_storage_adapter_instance.cursor.execute('SELECT source, {} FROM payments ORDER BY time DESC LIMIT 1'.format(selected_column))
     returned_row = postgres_storage_adapter_instance.cursor.fetchone()
 
-    assert returned_row[0] == payments[0]['source']
-    assert returned_row[1] == payments[0][selected_column]
+    assert returned_row[0] == payments[0].source
+    assert returned_row[1] == getattr(payments[0], selected_column)
 
     # Rollback
     postgres_storage_adapter_instance._rollback()
@@ -99,8 +98,7 @@ def test_save_payments_null_value_error(postgres_storage_adapter_instance: Postg
 
     payments = list()
 
-    payments.append(__generate_row_based_on_schema(postgres_storage_adapter_instance.payments_output_schema()))
-    payments[0][selected_column] = None
+    payments.append(__generate_payment(postgres_storage_adapter_instance, **{selected_column: None}))
 
     try:
         postgres_storage_adapter_instance._save_payments(payments)
@@ -116,8 +114,8 @@ def test_save_payments_null_value_error(postgres_storage_adapter_instance: Postg
 def test_save_creations(postgres_storage_adapter_instance: PostgresStorageAdapter):
     creations = list()
 
-    creations.append(__generate_row_based_on_schema(postgres_storage_adapter_instance.creations_output_schema()))
-    creations.append(__generate_row_based_on_schema(postgres_storage_adapter_instance.creations_output_schema()))
+    creations.append(__generate_creation(postgres_storage_adapter_instance))
+    creations.append(__generate_creation(postgres_storage_adapter_instance))
 
     number_of_rows_before_saving = __get_count_of_table(postgres_storage_adapter_instance, 'creations')
 
@@ -144,8 +142,7 @@ def test_save_creations_with_null_value(postgres_storage_adapter_instance: Postg
 
     creations = list()
 
-    creations.append(__generate_row_based_on_schema(postgres_storage_adapter_instance.creations_output_schema()))
-    creations[0][selected_column] = None
+    creations.append(__generate_creation(postgres_storage_adapter_instance, **{selected_column: None}))
 
     number_of_rows_before_saving = __get_count_of_table(postgres_storage_adapter_instance, 'creations')
 
@@ -157,8 +154,8 @@ def test_save_creations_with_null_value(postgres_storage_adapter_instance: Postg
     postgres_storage_adapter_instance.cursor.execute('SELECT source, {} FROM creations ORDER BY time DESC LIMIT 1'.format(selected_column))
     returned_row = postgres_storage_adapter_instance.cursor.fetchone()
 
-    assert returned_row[0] == creations[0]['source']
-    assert returned_row[1] == creations[0][selected_column]
+    assert returned_row[0] == creations[0].source
+    assert returned_row[1] == getattr(creations[0], selected_column)
 
     # Rollback
     postgres_storage_adapter_instance._rollback()
@@ -178,8 +175,7 @@ def test_save_creation_null_value_error(postgres_storage_adapter_instance: Postg
 
     creations = list()
 
-    creations.append(__generate_row_based_on_schema(postgres_storage_adapter_instance.creations_output_schema()))
-    creations[0][selected_column] = None
+    creations.append(__generate_creation(postgres_storage_adapter_instance, **{selected_column: None}))
 
     try:
         postgres_storage_adapter_instance._save_creations(creations)
@@ -201,11 +197,11 @@ def test_save(postgres_storage_adapter_instance : PostgresStorageAdapter):
 
     payments_row_count = random.randint(1, 4)
     for i in range(payments_row_count):
-        payments.append(__generate_row_based_on_schema(postgres_storage_adapter_instance.payments_output_schema()))
+        payments.append(__generate_payment(postgres_storage_adapter_instance))
 
     creations_row_count = random.randint(1, 3)
     for i in range(creations_row_count):
-        creations.append(__generate_row_based_on_schema(postgres_storage_adapter_instance.creations_output_schema()))
+        creations.append(__generate_creation(postgres_storage_adapter_instance))
 
     postgres_storage_adapter_instance.cursor.execute('SELECT * FROM lastfile')
     pre_test_ledger_name = postgres_storage_adapter_instance.cursor.fetchone()[0]
@@ -227,6 +223,27 @@ def test_save(postgres_storage_adapter_instance : PostgresStorageAdapter):
     postgres_storage_adapter_instance.save([], [], pre_test_ledger_name)
 
 
+def test_save_chunks_is_atomic(postgres_storage_adapter_instance : PostgresStorageAdapter):
+    # Test Setup
+    timestamp_before_insertion = datetime.now()
+    where_clause = 'time > \'{}\''.format(timestamp_before_insertion.strftime('%Y-%m-%d %H:%M:%S'))
+    pre_test_ledger_name = postgres_storage_adapter_instance.get_last_file_sequence()
+
+    def operations_chunks():
+        yield None, 'payments', [__generate_payment(postgres_storage_adapter_instance)]
+        yield None, 'creations', [__generate_creation(postgres_storage_adapter_instance)]
+        raise ValueError('test')
+
+    # Test
+    with pytest.raises(ValueError):
+        postgres_storage_adapter_instance.save_chunks(operations_chunks(), 'test')
+
+    # Chunks saved before the failure were rolled back with it
+    assert __get_count_of_table(postgres_storage_adapter_instance, 'payments', where_clause) == 0
+    assert __get_count_of_table(postgres_storage_adapter_instance, 'creations', where_clause) == 0
+    assert postgres_storage_adapter_instance.get_last_file_sequence() == pre_test_ledger_name
+
+
 def test_save_empty_file(postgres_storage_adapter_instance : PostgresStorageAdapter):
     # Test Setup
     payments = list()
@@ -251,22 +268,93 @@ def test_save_empty_file(postgres_storage_adapter_instance : PostgresStorageAdap
     postgres_storage_adapter_instance.save([], [], pre_test_ledger_name)
 
 
+def test_save_without_advancing_last_file(postgres_storage_adapter_instance: PostgresStorageAdapter):
+    # Test Setup
+    pre_test_ledger_name = postgres_storage_adapter_instance.get_last_file_sequence()
+    ledger_name = 'ffffffff'
+
+    # Test
+    postgres_storage_adapter_instance.save([], [], ledger_name, advance_last_file=False)
+
+    assert postgres_storage_adapter_instance.get_last_file_sequence() == pre_test_ledger_name
+    assert postgres_storage_adapter_instance.is_file_saved(ledger_name)
+
+    # Test Cleanup
+    postgres_storage_adapter_instance.cursor.execute('DELETE FROM completedfiles WHERE name = %s', (ledger_name,))
+    postgres_storage_adapter_instance.conn.commit()
+
+
+def test_update_last_file_sequence(postgres_storage_adapter_instance: PostgresStorageAdapter):
+    # Test Setup
+    pre_test_ledger_name = postgres_storage_adapter_instance.get_last_file_sequence()
+    ledger_name = 'fffffffe'
+    postgres_storage_adapter_instance.save([], [], ledger_name, advance_last_file=False)
+
+    # Test
+    postgres_storage_adapter_instance.update_last_file_sequence(ledger_name)
+
+    assert postgres_storage_adapter_instance.get_last_file_sequence() == ledger_name
+    # Files behind the last file are no longer marked
+    assert not postgres_storage_adapter_instance.is_file_saved(ledger_name)
+
+    # Test Cleanup
+    postgres_storage_adapter_instance.update_last_file_sequence(pre_test_ledger_name)
+
+
+def test_claim_file(postgres_storage_adapter_instance: PostgresStorageAdapter):
+    # Test
+    assert postgres_storage_adapter_instance.claim_file('ffffffff', 'collector-1', 60)
+    assert not postgres_storage_adapter_instance.claim_file('ffffffff', 'collector-2', 60)
+    assert postgres_storage_adapter_instance.has_file_claims()
+    assert postgres_storage_adapter_instance.renew_file_claims(['ffffffff'], 'collector-1', 60) == {'ffffffff'}
+    assert postgres_storage_adapter_instance.renew_file_claims(['ffffffff'], 'collector-2', 60) == set()
+
+    # An expired claim is claimed by another collector
+    postgres_storage_adapter_instance.renew_file_claims(['ffffffff'], 'collector-1', -1)
+    assert postgres_storage_adapter_instance.claim_file('ffffffff', 'collector-2', 60)
+
+    # Test Cleanup
+    postgres_storage_adapter_instance.release_file_claim('ffffffff', 'collector-2')
+
+
+def test_advance_last_file_sequence(postgres_storage_adapter_instance: PostgresStorageAdapter):
+    # Test Setup
+    pre_test_ledger_name = postgres_storage_adapter_instance.get_last_file_sequence()
+    postgres_storage_adapter_instance.update_last_file_sequence('fffffe3f')
+    for ledger_name in ['fffffe7f', 'fffffebf', 'ffffff3f']:
+        postgres_storage_adapter_instance.save([], [], ledger_name, advance_last_file=False)
+
+    # Test
+    last_file = postgres_storage_adapter_instance.advance_last_file_sequence(
+        pre_test_ledger_name, lambda file_name: '{:08x}'.format(int(file_name, 16) + 64))
+
+    # Only advanced up to the missing file
+    assert last_file == 'fffffebf'
+    assert postgres_storage_adapter_instance.get_last_file_sequence() == 'fffffebf'
+    assert not postgres_storage_adapter_instance.is_file_saved('fffffe7f')
+    assert postgres_storage_adapter_instance.is_file_saved('ffffff3f')
+
+    # Test Cleanup
+    postgres_storage_adapter_instance.update_last_file_sequence('ffffff3f')
+    postgres_storage_adapter_instance.update_last_file_sequence(pre_test_ledger_name)
+
+
 def test_convert_payment(postgres_storage_adapter_instance: PostgresStorageAdapter):
 
     payment = __generate_row_based_on_schema(postgres_storage_adapter_instance.payments_output_schema())
     payment['time'] = 1535594286
-    returned_dict = postgres_storage_adapter_instance.convert_payment(*payment.values())
+    returned_row = postgres_storage_adapter_instance.convert_payment(*payment.values())
     payment.update({'time': datetime.strptime('2018-08-30 01:58:06', '%Y-%m-%d %H:%M:%S')})
-    assert returned_dict == payment
+    assert returned_row._asdict() == payment
 
 
 def test_convert_creations(postgres_storage_adapter_instance: PostgresStorageAdapter):
 
     creation = __generate_row_based_on_schema(postgres_storage_adapter_instance.creations_output_schema())
     creation['time'] = 1535594286
-    returned_dict = postgres_storage_adapter_instance.convert_creation(*creation.values())
+    returned_row = postgres_storage_adapter_instance.convert_creation(*creation.values())
     creation.update({'time': datetime.strptime('2018-08-30 01:58:06', '%Y-%m-%d %H:%M:%S')})
-    assert returned_dict == creation
+    assert returned_row._asdict() == creation
 
 
 def __get_count_of_table(postgres_storage_adapter_instance, table_name, where_clause='true'):
@@ -275,6 +363,18 @@ def __get_count_of_table(postgres_storage_adapter_instance, table_name, where_cl
     return int(postgres_storage_adapter_instance.cursor.fetchone()[0])
 
 
+def __generate_payment(postgres_storage_adapter_instance, **values):
+    row_dict = __generate_row_based_on_schema(postgres_storage_adapter_instance.payments_output_schema())
+    row_dict.update(values)
+    return postgres_storage_adapter_instance.payment_row(**row_dict)
+
+
+def __generate_creation(postgres_storage_adapter_instance, **values):
+    row_dict = __generate_row_based_on_schema(postgres_storage_adapter_instance.creations_output_schema())
+    row_dict.update(values)
+    return postgres_storage_adapter_instance.creation_row(**row_dict)
+
+
 def __generate_row_based_on_schema(schema):
     row_dict = {}
 
@@ -300,3 +400,11 @@ def __generate_row_based_on_schema(schema):
         row_dict[column] = value
 
     return row_dict
+
+
+def test_format_copy_rows():
+    rows = [('tab\there', 'line\nbreak\r', 'back\\slash', None),
+            (1, 0.1, datetime(2018, 8, 30, 1, 58, 6), 'plain')]
+
+    assert format_copy_rows(rows).read() == 'tab\\there\tline\\nbreak\\r\tback\\\\slash\t\\N\n' \
+                                           '1\t0.1\t2018-08-30 01:58:06\tplain\n'
@@ -0,0 +1,89 @@
+import threading
+import pytest
+from prefetcher import CheckpointPrefetcher
+
+
+def __next_sequence(sequence):
+    return sequence + 1
+
+
+def test_get_returns_checkpoints_in_order():
+    prefetcher = CheckpointPrefetcher(lambda sequence: sequence * 10, __next_sequence, 3)
+
+    assert [prefetcher.get(sequence) for sequence in range(5)] == [0, 10, 20, 30, 40]
+    prefetcher.shutdown()
+
+
+def test_get_fetches_ahead():
+    fetched = []
+    lock = threading.Lock()
+
+    def fetch(sequence):
+        with lock:
+            fetched.append(sequence)
+        return sequence
+
+    prefetcher = CheckpointPrefetcher(fetch, __next_sequence, 2)
+    prefetcher.get(0)
+    prefetcher.shutdown()
+
+    assert sorted(fetched) == [0, 1, 2]
+
+
+def test_get_same_checkpoint_again_does_not_fetch_again():
+    fetched = []
+    prefetcher = CheckpointPrefetcher(lambda sequence: fetched.append(sequence) or sequence, __next_sequence, 0)
+
+    assert prefetcher.get(7) == 7
+    assert prefetcher.get(7) == 7
+    assert fetched == [7]
+    prefetcher.shutdown()
+
+
+def test_get_failed_checkpoint_is_fetched_again():
+    attempts = []
+
+    def fetch(sequence):
+        attempts.append(sequence)
+        if attempts.count(sequence) == 1 and sequence == 1:
+            raise RuntimeError('test')
+        return sequence
+
+    prefetcher = CheckpointPrefetcher(fetch, __next_sequence, 1)
+    assert prefetcher.get(0) == 0
+    with pytest.raises(RuntimeError):
+        prefetcher.get(1)
+
+    assert prefetcher.get(1) == 1
+    assert prefetcher.get(2) == 2
+    prefetcher.shutdown()
+
+
+def test_get_out_of_order_restarts_window():
+    prefetcher = CheckpointPrefetcher(lambda sequence: sequence, __next_sequence, 2)
+
+    assert prefetcher.get(0) == 0
+    assert prefetcher.get(10) == 10
+    assert prefetcher.get(11) == 11
+    prefetcher.shutdown()
+
+
+def test_set_depth_limits_fetching_ahead():
+    fetched = []
+    lock = threading.Lock()
+
+    def fetch(sequence):
+        with lock:
+            fetched.append(sequence)
+        return sequence
+
+    prefetcher = CheckpointPrefetcher(fetch, __next_sequence, 2)
+    prefetcher.set_depth(0)
+    assert prefetcher.get(0) == 0
+    assert prefetcher.get(1) == 1
+    assert fetched == [0, 1]
+
+    # Never deeper than the depth it was created with
+    prefetcher.set_depth(5)
+    assert prefetcher.depth == 2
+    prefetcher.shutdown()
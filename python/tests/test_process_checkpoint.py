@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+
+ENVIRONMENT = {'POSTGRES_HOST': 'localhost', 'PYTHON_PASSWORD': 'password',
+               'KIN_ISSUER': 'GBC3SG6NGTSZ2OMH3FFGB7UVRQWILW367U4GSOOF4TFSZONV42UJXUH7',
+               'NETWORK_PASSPHRASE': 'Public Global Kin Ecosystem Network ; June 2018', 'MAX_RETRIES': '1',
+               'ARCHIVE_URL': 'file:///archive', 'LOG_LEVEL': 'INFO'}
+
+
+def test_cold_start_imports():
+    # Imported in a new process, as a cold worker would
+    script = '\n'.join([
+        'import sys, process_checkpoint',
+        'print(sorted(name for name in ("pandas", "boto3", "psycopg2") if name in sys.modules))',
+        'try:',
+        '    process_checkpoint.handler({"file_sequence": "0000007e"})',
+        'except ValueError:',
+        '    print("invalid")'])
+    environment = dict(os.environ, **ENVIRONMENT)
+    environment['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    output = subprocess.check_output([sys.executable, '-c', script], env=environment).decode().split()
+
+    # Only the postgres adapter is imported, once the storage is set up
+    assert output == ['[]', 'invalid']
+
+
+def test_checkpoint_up_to_last_file_is_not_saved_again():
+    # Checkpoints that are not saved yet are fetched, and fail as there is no archive
+    script = '\n'.join([
+        'import main, process_checkpoint',
+        'class Storage:',
+        '    def get_last_file_sequence(self):',
+        '        return "000000bf"',
+        '    def is_file_saved(self, file_name):',
+        '        return file_name == "0000013f"',
+        'main.worker_clients[None] = (Storage(), None, None)',
+        'def fetch_checkpoint(*args):',
+        '    raise KeyError("fetched")',
+        'main.fetch_checkpoint = fetch_checkpoint',
+        'for file_sequence in ("0000007f", "000000bf", "000000ff", "0000013f"):',
+        '    try:',
+        '        print(process_checkpoint.handler({"file_sequence": file_sequence})["saved"])',
+        '    except KeyError:',
+        '        print("fetched")'])
+    environment = dict(os.environ, FIRST_FILE='0000003f', **ENVIRONMENT)
+    environment['PYTHONPATH'] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    output = subprocess.check_output([sys.executable, '-c', script], env=environment).decode().split()
+
+    assert output == ['False', 'False', 'fetched', 'False']
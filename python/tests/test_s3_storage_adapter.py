@@ -4,7 +4,7 @@ import botocore
 import random
 import string
 from unittest.mock import patch
-from adapters.s3_storage_adapter import S3StorageAdapter, COMPLETED_LEDGERS_DIR_NAME
+from adapters.s3_storage_adapter import S3StorageAdapter, COMPLETED_LEDGERS_DIR_NAME, APPS_DIR_NAME
 from datetime import datetime
 
 
@@ -133,6 +133,62 @@ def test_save_empty_file(s3_storage_adapter_instance : S3StorageAdapter):
     s3_storage_adapter_instance._rollback()
 
 
+def test_save_without_advancing_last_file(s3_storage_adapter_instance: S3StorageAdapter):
+    # Test Setup
+    s3_storage_adapter_instance.operations_to_save = []
+    pre_test_ledger_name = s3_storage_adapter_instance.get_last_file_sequence()
+    ledger_name = 'test_out_of_order'
+    s3_storage_adapter_instance.file_name = ledger_name
+    s3_storage_adapter_instance._rollback()
+
+    # Test
+    assert not s3_storage_adapter_instance.is_file_saved(ledger_name)
+    s3_storage_adapter_instance.save([{'type': 'payment'}], [], ledger_name, advance_last_file=False)
+
+    assert s3_storage_adapter_instance.get_last_file_sequence() == pre_test_ledger_name
+    assert s3_storage_adapter_instance.is_file_saved(ledger_name)
+
+    # Test Cleanup
+    s3_storage_adapter_instance.operations_to_save = []
+    s3_storage_adapter_instance._rollback()
+
+
+def test_save_chunks_of_apps(s3_storage_adapter_instance: S3StorageAdapter):
+    # Test Setup
+    s3_storage_adapter_instance.operations_to_save = []
+    ledger_name = 'test_apps'
+    app_ledger_key = '{}{}/{}/ledgers/ledger={}'.format(s3_storage_adapter_instance.full_key_prefix, APPS_DIR_NAME,
+                                                        'test', ledger_name)
+    operations_chunks = [(None, 'payments', [{'type': 'payment'}]),
+                         ('test', 'payments', [{'type': 'payment'}]),
+                         ('test', 'creations', [{'type': 'creation'}])]
+
+    # Test
+    s3_storage_adapter_instance.save_chunks(operations_chunks, ledger_name, advance_last_file=False)
+
+    # Every app has a single csv in its own directory
+    assert len(__get_files_in_key(s3_storage_adapter_instance,
+                                  '{}{}'.format(s3_storage_adapter_instance.ledgers_prefix, ledger_name))) == 1
+    assert len(__get_files_in_key(s3_storage_adapter_instance, app_ledger_key)) == 1
+
+    # Test Cleanup
+    # Failing to save the file again rolls back the directories of all of its apps
+    with patch('botocore.client.BaseClient._make_api_call', new=__mock_make_api_call_fail_when_posting_complete):
+        with pytest.raises(Exception):
+            s3_storage_adapter_instance.save_chunks(operations_chunks, ledger_name, advance_last_file=False)
+
+    assert len(__get_files_in_key(s3_storage_adapter_instance, app_ledger_key)) == 0
+
+
+def test_update_last_file_sequence(s3_storage_adapter_instance: S3StorageAdapter):
+    pre_test_ledger_name = s3_storage_adapter_instance.get_last_file_sequence()
+
+    s3_storage_adapter_instance.update_last_file_sequence('test_update')
+    assert s3_storage_adapter_instance.get_last_file_sequence() == 'test_update'
+
+    s3_storage_adapter_instance.update_last_file_sequence(pre_test_ledger_name)
+
+
 def test_rollback(s3_storage_adapter_instance: S3StorageAdapter):
     # Test Setup
     s3_storage_adapter_instance.operations_to_save = []
@@ -161,10 +217,10 @@ def test_convert_payment(s3_storage_adapter_instance : S3StorageAdapter):
     payment = __generate_row_based_on_schema(s3_storage_adapter_instance.payments_output_schema())
     payment['timestamp'] = 1535594286
     del payment['type']
-    returned_dict = s3_storage_adapter_instance.convert_payment(*payment.values())
+    returned_row = s3_storage_adapter_instance.convert_payment(*payment.values())
     payment.update({'timestamp': datetime.strptime('2018-08-30 01:58:06', '%Y-%m-%d %H:%M:%S'),
                     'type': 'payment'})
-    assert returned_dict == payment
+    assert returned_row._asdict() == payment
 
 
 def test_convert_creations(s3_storage_adapter_instance: S3StorageAdapter):
@@ -172,10 +228,10 @@ def test_convert_creations(s3_storage_adapter_instance: S3StorageAdapter):
     creation = __generate_row_based_on_schema(s3_storage_adapter_instance.creations_output_schema())
     creation['timestamp'] = 1535594286
     del creation['type']
-    returned_dict = s3_storage_adapter_instance.convert_creation(*creation.values())
+    returned_row = s3_storage_adapter_instance.convert_creation(*creation.values())
     creation.update({'timestamp': datetime.strptime('2018-08-30 01:58:06', '%Y-%m-%d %H:%M:%S'),
                      'type': 'creation'})
-    assert returned_dict == creation
+    assert returned_row._asdict() == creation
 
 
 def __put_file_on_s3(s3_storage_adapter_instance: S3StorageAdapter, key, string):
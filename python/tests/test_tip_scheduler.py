@@ -0,0 +1,94 @@
+import threading
+import pytest
+import tip_scheduler
+from tip_scheduler import TipScheduler, jittered_backoff
+
+
+class FakeClock:
+
+    def __init__(self, now):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock(1000)
+    monkeypatch.setattr(tip_scheduler.time, 'time', fake_clock.time)
+    monkeypatch.setattr(tip_scheduler.time, 'sleep', fake_clock.sleep)
+    return fake_clock
+
+
+def test_jittered_backoff_is_bounded():
+    for attempt in range(20):
+        assert 1 <= jittered_backoff(attempt, 1, 30) <= 30
+
+
+def test_predict_publish_time():
+    scheduler = TipScheduler(lambda: 0)
+    assert scheduler.predict_publish_time(127) is None
+
+    scheduler.observe_ledgers({ledger: 500 + (ledger - 1) * 5 for ledger in range(1, 64)})
+
+    assert scheduler.predict_publish_time(127) == 500 + 62 * 5 + 64 * 5
+
+
+def test_wait_for_published_ledger_does_not_sleep(clock):
+    scheduler = TipScheduler(lambda: 127)
+    scheduler.wait_for_ledger(127)
+
+    assert clock.sleeps == []
+
+
+def test_wait_sleeps_until_predicted_publish_time(clock):
+    # The next checkpoint ledger closes 320 seconds after the last ingested one, and is published at 1320
+    scheduler = TipScheduler(lambda: 127 if clock.now >= 1322 else 63)
+    scheduler.observe_ledgers({ledger: 1000 - (63 - ledger) * 5 for ledger in range(0, 64)})
+
+    scheduler.wait_for_ledger(127)
+
+    # One long sleep until shortly before the publication, then short polls
+    assert clock.sleeps[0] == pytest.approx(320 - tip_scheduler.MIN_POLL_INTERVAL)
+    assert all(seconds <= tip_scheduler.MAX_POLL_INTERVAL for seconds in clock.sleeps[1:])
+    assert clock.now < 1322 + tip_scheduler.MAX_POLL_INTERVAL
+    # How late the checkpoint was published is taken into account for the next one
+    assert scheduler.publish_delay > 0
+
+
+def test_wait_returns_when_state_file_can_not_be_read(clock):
+    def read_current_ledger():
+        raise RuntimeError('test')
+
+    TipScheduler(read_current_ledger).wait_for_ledger(127)
+
+    assert clock.sleeps == []
+
+
+def test_published_ledger_is_available_while_state_file_is_read():
+    reading = threading.Event()
+    release = threading.Event()
+
+    def read_current_ledger():
+        reading.set()
+        release.wait(5)
+        return 127
+
+    scheduler = TipScheduler(read_current_ledger)
+    waiter = threading.Thread(target=scheduler.wait_for_ledger, args=(127,))
+    waiter.start()
+    assert reading.wait(5)
+
+    # Not blocked by the read in progress
+    assert scheduler.get_published_ledger() is None
+    scheduler.observe_ledgers({64: 1000, 127: 1315})
+
+    release.set()
+    waiter.join(5)
+    assert scheduler.get_published_ledger() == 127
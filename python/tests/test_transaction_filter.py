@@ -0,0 +1,81 @@
+from hashlib import sha256
+from types import SimpleNamespace
+from kin_base.stellarxdr import Xdr
+from kin_base.utils import encode_check
+from transaction_filter import TransactionFilter
+from operation_handlers import get_operation_handlers
+
+ISSUER = bytes(range(32))
+KIN_ISSUER = encode_check('account', ISSUER).decode()
+OPERATION_HANDLERS = get_operation_handlers(['payments', 'creations'], KIN_ISSUER)
+
+
+def test_keeps_relevant_operations():
+    transaction_filter = TransactionFilter(OPERATION_HANDLERS)
+
+    assert transaction_filter(__generate_envelope(b'hello', [__generate_creation()]))
+    assert transaction_filter(__generate_envelope(b'hello', [__generate_payment(b'KIN\x00', ISSUER)]))
+    assert transaction_filter(__generate_envelope(None, [__generate_bump(), __generate_creation()]))
+
+
+def test_drops_irrelevant_operations():
+    transaction_filter = TransactionFilter(OPERATION_HANDLERS)
+
+    assert not transaction_filter(__generate_envelope(b'hello', [__generate_bump()]))
+    assert not transaction_filter(__generate_envelope(b'hello', [__generate_payment(b'KIN\x00', bytes(32))]))
+    assert not transaction_filter(__generate_envelope(b'hello', [__generate_payment(b'KINN', ISSUER)]))
+    assert not transaction_filter(__generate_envelope(b'hello', [__generate_payment(None, None)]))
+
+
+def test_app_id():
+    transaction_filter = TransactionFilter(OPERATION_HANDLERS, ['test'])
+
+    assert transaction_filter(__generate_envelope(b'1-test-', [__generate_creation()]))
+    assert transaction_filter(__generate_envelope(b'1-test-some memo', [__generate_creation()]))
+    assert not transaction_filter(__generate_envelope(b'1-abcd-some memo', [__generate_creation()]))
+    assert not transaction_filter(__generate_envelope(b'1-test', [__generate_creation()]))
+    assert not transaction_filter(__generate_envelope(b'test', [__generate_creation()]))
+    assert not transaction_filter(__generate_envelope(None, [__generate_creation()]))
+    assert not transaction_filter(__generate_envelope(b'1-test-', [__generate_bump()]))
+
+
+def test_multiple_app_ids():
+    transaction_filter = TransactionFilter(OPERATION_HANDLERS, ['test', 'abcd'])
+
+    assert transaction_filter(__generate_envelope(b'1-test-some memo', [__generate_creation()]))
+    assert transaction_filter(__generate_envelope(b'1-abcd-some memo', [__generate_creation()]))
+    assert not transaction_filter(__generate_envelope(b'1-efgh-some memo', [__generate_creation()]))
+
+
+def __generate_envelope(memo_text, operations):
+    memo = Xdr.types.Memo(type=0) if memo_text is None else Xdr.types.Memo(type=1, text=memo_text)
+    transaction = Xdr.types.Transaction(sourceAccount=__generate_account(b'source'), fee=100, seqNum=1,
+                                        timeBounds=[], memo=memo, operations=operations, ext=SimpleNamespace(v=0))
+
+    return Xdr.types.TransactionEnvelope(tx=transaction, signatures=[])
+
+
+def __generate_creation():
+    body = SimpleNamespace(type=0, createAccountOp=Xdr.types.CreateAccountOp(
+        destination=__generate_account(b'destination'), startingBalance=100000000))
+    return Xdr.types.Operation(sourceAccount=[], body=body)
+
+
+def __generate_payment(asset_code, issuer):
+    if asset_code is None:
+        asset = Xdr.types.Asset(type=0)
+    else:
+        asset = Xdr.types.Asset(type=1, alphaNum4=SimpleNamespace(
+            assetCode=asset_code, issuer=Xdr.types.PublicKey(type=0, ed25519=issuer)))
+    body = SimpleNamespace(type=1, paymentOp=Xdr.types.PaymentOp(destination=__generate_account(b'destination'),
+                                                                 asset=asset, amount=123456789))
+    return Xdr.types.Operation(sourceAccount=[], body=body)
+
+
+def __generate_bump():
+    return Xdr.types.Operation(sourceAccount=[], body=SimpleNamespace(type=11, bumpSequenceOp=SimpleNamespace(
+        bumpTo=2)))
+
+
+def __generate_account(seed):
+    return Xdr.types.PublicKey(type=0, ed25519=sha256(seed).digest())
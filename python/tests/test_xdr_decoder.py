@@ -0,0 +1,91 @@
+import gzip
+import io
+import pytest
+from hashlib import sha256
+from types import SimpleNamespace
+from kin_base.stellarxdr import Xdr
+from xdrparser import parser
+import xdr_decoder
+
+NETWORK_PASSPHRASE = 'Public Global Kin Ecosystem Network ; June 2018'
+ISSUER = bytes(range(32))
+
+
+def test_parse_transactions(tmpdir):
+    data = __generate_transactions_file([__generate_envelope(b'1-test-memo', 1), __generate_envelope(b'hello', 0)])
+    file_path = tmpdir.join('transactions-0000007f.xdr.gz')
+    file_path.write_binary(data)
+
+    expected = parser.parse(str(file_path), with_hash=True, network_id=NETWORK_PASSPHRASE)
+    returned = xdr_decoder.parse(io.BytesIO(data), 'transactions-0000007f', with_hash=True,
+                                 network_id=NETWORK_PASSPHRASE)
+
+    assert returned == expected
+    assert returned[0]['txSet']['txs'][0]['tx']['memo']['text'] == '1-test-memo'
+
+
+def test_xdr_file_decodes_lazily_every_iteration():
+    data = __generate_transactions_file([__generate_envelope(b'1-test-memo', 1)])
+    expected = xdr_decoder.parse(io.BytesIO(data), 'transactions-0000007f')
+    xdr_file = xdr_decoder.XdrFile(io.BytesIO(data), 'transactions-0000007f')
+
+    entries = iter(xdr_file)
+    assert next(entries) == expected[0]
+    assert list(entries) == expected[1:]
+    # Iterating again decodes the file from its start
+    assert list(xdr_file) == expected
+
+
+def test_parse_filtered_envelopes():
+    data = __generate_transactions_file([__generate_envelope(b'1-test-memo', 1), __generate_envelope(b'hello', 0)])
+    unfiltered = xdr_decoder.parse(io.BytesIO(data), 'transactions-0000007f', with_hash=True,
+                                   network_id=NETWORK_PASSPHRASE)
+
+    returned = xdr_decoder.parse(io.BytesIO(data), 'transactions-0000007f', with_hash=True,
+                                 network_id=NETWORK_PASSPHRASE,
+                                 envelope_filter=lambda envelope: envelope.tx.memo.text == b'hello')
+
+    assert returned[0]['txSet']['txs'] == unfiltered[0]['txSet']['txs'][1:]
+
+
+def test_parse_truncated_file():
+    data = gzip.decompress(__generate_transactions_file([__generate_envelope(b'1-test-memo', 1)]))
+
+    with pytest.raises(xdr_decoder.XdrFileError):
+        xdr_decoder.parse(io.BytesIO(gzip.compress(data[:-4])), 'transactions-0000007f')
+
+
+def test_parse_ledger_missing_ledgers():
+    data = gzip.compress(b'')
+
+    with pytest.raises(xdr_decoder.XdrFileError):
+        xdr_decoder.parse(io.BytesIO(data), 'ledger-0000007f')
+
+
+def __generate_transactions_file(envelopes, ledger_sequence=100):
+    entry = Xdr.types.TransactionHistoryEntry(
+        ledgerSeq=ledger_sequence, txSet=Xdr.types.TransactionSet(previousLedgerHash=bytes(32), txs=envelopes),
+        ext=SimpleNamespace(v=0))
+    packer = Xdr.StellarXDRPacker()
+    packer.pack_TransactionHistoryEntry(entry)
+    record = packer.get_buffer()
+
+    return gzip.compress((len(record) | 0x80000000).to_bytes(4, 'big') + record)
+
+
+def __generate_envelope(memo_text, operation_type):
+    account = Xdr.types.PublicKey(type=0, ed25519=sha256(memo_text).digest())
+    if operation_type == 1:
+        asset = Xdr.types.Asset(type=1, alphaNum4=SimpleNamespace(
+            assetCode=b'KIN\x00', issuer=Xdr.types.PublicKey(type=0, ed25519=ISSUER)))
+        body = SimpleNamespace(type=1, paymentOp=Xdr.types.PaymentOp(destination=account, asset=asset,
+                                                                     amount=123456789))
+    else:
+        body = SimpleNamespace(type=0, createAccountOp=Xdr.types.CreateAccountOp(destination=account,
+                                                                                 startingBalance=100000000))
+    operation = Xdr.types.Operation(sourceAccount=[], body=body)
+    transaction = Xdr.types.Transaction(sourceAccount=account, fee=100, seqNum=1, timeBounds=[],
+                                        memo=Xdr.types.Memo(type=1, text=memo_text), operations=[operation],
+                                        ext=SimpleNamespace(v=0))
+
+    return Xdr.types.TransactionEnvelope(tx=transaction, signatures=[])
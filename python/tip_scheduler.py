@@ -0,0 +1,145 @@
+"""
+Wait for checkpoints to be published to the archive.
+
+The archive's state file tells which ledger was published last. From the close times of the
+ledgers ingested so far we predict when the next checkpoint ledger closes and gets published,
+sleep until shortly before that and then poll the state file with a short jittered backoff.
+"""
+
+import logging
+import random
+import threading
+import time
+
+# Seconds between polls of the archive's state file, the backoff grows from the minimal to the maximal interval
+MIN_POLL_INTERVAL = 1
+MAX_POLL_INTERVAL = 30
+
+# Weight of the last observation when learning how long after its close a checkpoint is published
+PUBLISH_DELAY_SMOOTHING = 0.3
+
+
+def jittered_backoff(attempt, min_interval, max_interval):
+    """Return a random number of seconds to wait before the given retry attempt, growing exponentially."""
+    return random.uniform(min_interval, min(max_interval, min_interval * 2 ** attempt))
+
+
+class TipScheduler:
+    """Predict when ledgers are published to the archive and wait for them."""
+
+    def __init__(self, read_current_ledger, min_poll_interval=MIN_POLL_INTERVAL,
+                 max_poll_interval=MAX_POLL_INTERVAL):
+        """
+        :param read_current_ledger: Called to read the last ledger published to the archive
+        """
+        self.read_current_ledger = read_current_ledger
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+
+        self.last_ledger = None
+        self.last_close_time = None
+        self.close_interval = None
+        self.publish_delay = 0
+
+        # The state file is read at most once per min_poll_interval, no matter how many threads wait.
+        # It is read holding read_lock only, so the last ledger read is available while the next one is read.
+        self.read_lock = threading.Lock()
+        self.lock = threading.Lock()
+        self.current_ledger = None
+        self.current_ledger_read_at = None
+
+    def observe_ledgers(self, ledgers_dictionary):
+        """
+        Learn the ledger close times from a checkpoint that was ingested.
+
+        :param ledgers_dictionary: A dictionary of ledger sequence and close time
+        """
+        if not ledgers_dictionary:
+            return
+
+        first_ledger, last_ledger = min(ledgers_dictionary), max(ledgers_dictionary)
+        with self.lock:
+            if self.last_ledger is not None and last_ledger <= self.last_ledger:
+                return
+
+            if last_ledger > first_ledger:
+                self.close_interval = (ledgers_dictionary[last_ledger] - ledgers_dictionary[first_ledger]) / \
+                                      (last_ledger - first_ledger)
+            self.last_ledger = last_ledger
+            self.last_close_time = ledgers_dictionary[last_ledger]
+
+    def predict_publish_time(self, ledger_sequence):
+        """Return the predicted time (in seconds since the epoch) a ledger is published at, None if unknown."""
+        with self.lock:
+            if self.close_interval is None:
+                return None
+
+            return self.last_close_time + (ledger_sequence - self.last_ledger) * self.close_interval + \
+                self.publish_delay
+
+    def get_published_ledger(self):
+        """Return the last ledger published to the archive when the state file was last read, None if never read."""
+        with self.lock:
+            return self.current_ledger
+
+    def wait_for_ledger(self, ledger_sequence):
+        """
+        Block until the given ledger is published to the archive.
+
+        Returns right away if the archive's state file can not be read, leaving it to the download to retry.
+        """
+        attempt = 0
+        waited = False
+        while True:
+            current_ledger = self.__get_current_ledger()
+            if current_ledger is None:
+                return
+
+            if current_ledger >= ledger_sequence:
+                if waited:
+                    self.__learn_publish_delay(ledger_sequence)
+                return
+
+            predicted_publish_time = self.predict_publish_time(ledger_sequence)
+            time_to_publish = None if predicted_publish_time is None else predicted_publish_time - time.time()
+
+            if time_to_publish is not None and time_to_publish > self.max_poll_interval:
+                # Far from publication, no need to poll until shortly before it
+                logging.info('Ledger {} is expected to be published in {:.0f} seconds'.format(
+                    ledger_sequence, time_to_publish))
+                time.sleep(time_to_publish - self.min_poll_interval)
+                attempt = 0
+            else:
+                time.sleep(jittered_backoff(attempt, self.min_poll_interval, self.max_poll_interval))
+                attempt += 1
+            waited = True
+
+    def __get_current_ledger(self):
+        with self.read_lock:
+            now = time.time()
+            with self.lock:
+                if self.current_ledger_read_at is not None and \
+                        now - self.current_ledger_read_at < self.min_poll_interval:
+                    return self.current_ledger
+
+            try:
+                current_ledger = self.read_current_ledger()
+            except Exception as e:
+                logging.warning('Could not read the last ledger published to the archive: {}'.format(e))
+                return None
+
+            with self.lock:
+                self.current_ledger = current_ledger
+                self.current_ledger_read_at = now
+            return current_ledger
+
+    def __learn_publish_delay(self, ledger_sequence):
+        with self.lock:
+            if self.close_interval is None or self.current_ledger_read_at is None:
+                return
+
+            # The ledger was published between the last two reads of the state file
+            predicted_close_time = self.last_close_time + (ledger_sequence - self.last_ledger) * self.close_interval
+            delay = self.current_ledger_read_at - predicted_close_time
+            if 0 <= delay <= self.max_poll_interval * 10:
+                self.publish_delay += PUBLISH_DELAY_SMOOTHING * (delay - self.publish_delay)
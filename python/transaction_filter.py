@@ -0,0 +1,47 @@
+"""
+Tell apart the transactions that might be written to the storage, before they are decoded.
+
+Works on the raw unpacked transaction envelopes, comparing bytes instead of the json-compatible
+values, so irrelevant transactions are not hashed nor converted to dictionaries.
+"""
+
+import re
+from kin_base.stellarxdr import StellarXDR_const as const
+
+# Same as the app id regex used on decoded memos: 1-<uppercase|lowercase|digits>*4-anything
+APP_ID_MEMO_REGEX = re.compile(b'^1-[A-z0-9]{4}-')
+
+
+class TransactionFilter:
+    """
+    A filter of unpacked transaction envelopes.
+
+    Keeps every transaction that has an operation one of the operation handlers might save, and if app ids are given
+    only the ones with the memo of one of them. It never drops a transaction that the decoded filters would keep.
+    """
+
+    def __init__(self, operation_handlers, app_ids=None):
+        """
+        :param operation_handlers: The enabled operation handlers, by the operation type they handle
+        :param app_ids: Only keep transactions of these apps, all apps if None
+        """
+        self.operation_handlers = operation_handlers
+        self.app_ids = None if app_ids is None else frozenset(app_id.encode() for app_id in app_ids)
+
+    def __call__(self, envelope):
+        """Return True if the transaction envelope might be written to the storage."""
+        transaction = envelope.tx
+        if self.app_ids is not None and not self.__is_app_memo(transaction.memo):
+            return False
+
+        return any(self.__is_relevant_operation(operation) for operation in transaction.operations)
+
+    def __is_app_memo(self, memo):
+        if memo.type != const.MEMO_TEXT or APP_ID_MEMO_REGEX.match(memo.text) is None:
+            return False
+
+        return memo.text.split(b'-')[1] in self.app_ids
+
+    def __is_relevant_operation(self, operation):
+        operation_handler = self.operation_handlers.get(operation.body.type)
+        return operation_handler is not None and operation_handler.is_relevant(operation)
@@ -0,0 +1,167 @@
+"""
+Decode history archive files that were downloaded into memory.
+
+xdrparser only reads whole files from disk, this module feeds its unpacker from a file object instead,
+one structure (one ledger) at a time, and returns the same json-compatible structures as
+xdrparser.parser.parse.
+"""
+
+import decimal
+import gzip
+from hashlib import sha256
+from xdrparser import parser
+
+# xdrparser parses amounts with the decimal precision it sets on the thread that imported it,
+# keep a copy so files decoded on other threads get the same amounts
+DECIMAL_CONTEXT = decimal.getcontext().copy()
+
+# Ledger files should always have 64 structures in them, apart from the very first one where its 63.
+LEDGERS_PER_FILE = 64
+FIRST_FILE_SEQUENCE = '0000003f'
+
+# Each structure is prefixed with its length, the high bit marks the last fragment of the structure
+RECORD_MARK_SIZE = 4
+RECORD_LENGTH_MASK = 0x7fffffff
+
+
+class XdrFileError(Exception):
+
+    def __init__(self, message):
+        super(XdrFileError, self).__init__(message)
+
+
+class XdrFile:
+    """
+    A downloaded xdr file, decoded lazily one structure at a time.
+
+    Can be iterated more than once, every iteration decodes the file again from its start.
+    """
+
+    def __init__(self, file_object, file_name, with_hash=False, network_id=None, envelope_filter=None):
+        """
+        :param file_object: A seekable binary file object of the gzipped file
+        :param file_name: Name of the file in the archive, for example 'transactions-004c93bf'
+        :param with_hash: Calculate the hash of every transaction, only for a 'transactions' file
+        :param network_id: Network passphrase, needed for with_hash
+        :param envelope_filter: Called with every unpacked transaction envelope, only the envelopes
+                                it returns True for are decoded. Only for a 'transactions' file
+        """
+        self.file_object = file_object
+        self.file_name = file_name
+        self.with_hash = with_hash
+        self.network_id = network_id
+        self.envelope_filter = envelope_filter
+
+    def __iter__(self):
+        self.file_object.seek(0)
+        return iter_parse(self.file_object, self.file_name, self.with_hash, self.network_id, self.envelope_filter)
+
+    def close(self):
+        self.file_object.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def iter_parse(file_object, file_name, with_hash=False, network_id=None, envelope_filter=None):
+    """
+    Unpack and parse a gzipped xdr file object, yielding one json-compatible dictionary per structure.
+
+    Only a single structure is decompressed and decoded at a time.
+    Transaction envelopes rejected by envelope_filter are left out, before they are hashed and decoded.
+    Transactions are hashed from their bytes in the file, instead of packing them again.
+    """
+    file_type = file_name.split('-')[0]
+    network_hash = sha256(bytearray(network_id, 'utf-8')).digest() if with_hash else None
+
+    unpacker, unpacker_methods = parser.init_unpacker(b'')
+    unpack_struct = unpacker_methods[file_type]
+    transaction_spans = __record_transaction_spans(unpacker) if file_type == 'transactions' else None
+
+    with gzip.GzipFile(fileobj=file_object, mode='rb') as gzipped_file:
+        index = 0
+        while True:
+            record_mark = gzipped_file.read(RECORD_MARK_SIZE)
+            if not record_mark:
+                break
+
+            record_length = int.from_bytes(record_mark, 'big') & RECORD_LENGTH_MASK
+            record = gzipped_file.read(record_length)
+            if len(record_mark) != RECORD_MARK_SIZE or len(record) != record_length:
+                raise XdrFileError('File {} is truncated'.format(file_name))
+
+            unpacker.reset(record)
+            struct = unpack_struct()
+
+            if transaction_spans is not None:
+                # Pair every envelope with the position of its packed transaction in the record
+                envelopes = list(zip(struct.txSet.txs, transaction_spans))
+                del transaction_spans[:]
+
+                if envelope_filter is not None:
+                    envelopes = [envelope for envelope in envelopes if envelope_filter(envelope[0])]
+                    struct.txSet.txs = [transaction for transaction, _ in envelopes]
+
+                # If 'with_hash' is set to true, hash every envelope that was kept, straight from its packed bytes
+                if with_hash:
+                    for transaction, (start, end) in envelopes:
+                        transaction.hash = sha256(network_hash + parser.PACKED_ENVELOP_TYPE +
+                                                  record[start:end]).digest()
+
+            # Create a json-compatible dictionary, with the same path xdrparser gives structures in a list
+            with decimal.localcontext(DECIMAL_CONTEXT):
+                parsed_struct = parser.todict(struct, '.{}'.format(index))
+
+            yield parsed_struct
+            index += 1
+
+
+def __record_transaction_spans(unpacker):
+    """
+    Make the unpacker record where every transaction it unpacks starts and ends in its buffer.
+
+    :return: A list of (start, end) positions, appended to in the order the transactions are unpacked
+    """
+    spans = []
+    unpack_transaction = unpacker.unpack_Transaction
+
+    def unpack_and_record_transaction():
+        start = unpacker.get_position()
+        transaction = unpack_transaction()
+        spans.append((start, unpacker.get_position()))
+        return transaction
+
+    unpacker.unpack_Transaction = unpack_and_record_transaction
+    return spans
+
+
+def parse_amount(value):
+    """Scale down an amount the same way the decoder does, for amounts it leaves as they are."""
+    with decimal.localcontext(DECIMAL_CONTEXT):
+        return parser.parse_amount(value)
+
+
+def parse(file_object, file_name, with_hash=False, network_id=None, envelope_filter=None):
+    """
+    Unpack and parse a whole gzipped xdr file object.
+
+    :param file_object: A readable binary file object of the gzipped file, positioned at its start
+    :param file_name: Name of the file in the archive, for example 'ledger-004c93bf'
+    :param with_hash: Calculate the hash of every transaction, only for a 'transactions' file
+    :param network_id: Network passphrase, needed for with_hash
+    :param envelope_filter: Called with every unpacked transaction envelope, only the envelopes
+                            it returns True for are decoded. Only for a 'transactions' file
+    :return: A list of json-compatible dictionaries, one for every structure in the file
+    """
+    unpacked = list(iter_parse(file_object, file_name, with_hash, network_id, envelope_filter))
+
+    if file_name.split('-')[0] == 'ledger':
+        expected_ledgers = LEDGERS_PER_FILE - 1 if FIRST_FILE_SEQUENCE in file_name else LEDGERS_PER_FILE
+        if len(unpacked) != expected_ledgers:
+            raise XdrFileError('Found only {} ledgers in {}, expected {}'.format(
+                len(unpacked), file_name, expected_ledgers))
+
+    return unpacked